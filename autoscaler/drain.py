@@ -0,0 +1,114 @@
+from autoscaler.settings import *
+from autoscaler import k8s_controller as kc
+from autoscaler import tracing
+from autoscaler.polling import wait_until, PollError
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+import logging
+import time
+
+
+class Drainer:
+    """
+    Evicts pods of node concurrently (up to max_parallel evictions at the same time). Evictions refused
+    by PodDisruptionBudget (429) are retried with growing backoff, then drainer waits evicted pods to be
+    deleted from informer cache. Everything must finish until drain deadline
+    """
+    def __init__(self, v1, cache, max_parallel=drain_max_parallel, timeout=drain_timeout):
+        self.v1 = v1
+        self.cache = cache
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+
+    def get_pods_to_evict(self, node_name):
+        pods = []
+        for pod in self.cache.get_pods_by_node(node_name):
+            if kc.is_pod_terminated(pod):
+                continue
+            if kc.is_mirror_pod(pod):
+                logging.info(f"Ignoring pod {pod.metadata.name} eviction cause mirror (static) pod")
+            elif kc.is_daemonset_pod(pod):
+                logging.info(f"Ignoring pod {pod.metadata.name} eviction cause DaemonSet")
+            else:
+                if not pod.metadata.owner_references:
+                    logging.warning(f"Pod {pod.metadata.name} has no controller and will not be recreated")
+                logging.warning(f"Pod {pod.metadata.name} will be evicted")
+                pods.append(pod)
+        return pods
+
+    @tracing.traced
+    def drain(self, node_name, deadline=None, cancelled=None, wait=True):
+        """
+        Evict pods of node and (if wait) wait them to be deleted. Returns True if node is drained
+        """
+        deadline = min(deadline or time.time() + self.timeout, time.time() + self.timeout)
+        pods = self.get_pods_to_evict(node_name)
+        if not pods:
+            logging.warning(f"Node {node_name} drained")
+            return True
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(len(pods), self.max_parallel),
+                                thread_name_prefix="drain") as pool:
+            results = list(pool.map(lambda pod: self.evict(pod, deadline, cancelled), pods))
+        failed = [pod.metadata.name for pod, evicted in zip(pods, results) if not evicted]
+        if failed:
+            logging.error(f"Cannot drain node {node_name}: eviction of {', '.join(failed)} failed")
+            return False
+        logging.info(f"Evicted {len(pods)} pods from node {node_name} in {time.monotonic() - start:.1f} secs")
+
+        if wait:
+            try:
+                wait_until(lambda: not self.get_remaining_pods(pods), "pods deletion",
+                           deadline=deadline, cancelled=cancelled)
+            except PollError as ex:
+                remaining = [pod.metadata.name for pod in self.get_remaining_pods(pods)]
+                logging.error(f"Cannot drain node {node_name}: pods {', '.join(remaining)} not deleted ({ex})")
+                return False
+        logging.warning(f"Node {node_name} drained in {time.monotonic() - start:.1f} secs")
+        return True
+
+    def evict(self, pod, deadline, cancelled=None):
+        """
+        Evict pod retrying while PodDisruptionBudget does not allow it. Returns True if pod is evicted or gone
+        """
+        name, namespace = pod.metadata.name, pod.metadata.namespace
+        body = client.V1Eviction(metadata=client.V1ObjectMeta(name=name, namespace=namespace))
+        backoff = poll_initial_interval
+        while True:
+            try:
+                self.v1.create_namespaced_pod_eviction(name=name, namespace=namespace, body=body)
+                return True
+            except ApiException as ex:
+                if ex.status == 404:
+                    return True
+                if ex.status != 429:
+                    logging.warning(f"Pod {name} eviction failed due {ex.status} {ex.reason}")
+                    return False
+            except Exception as ex:
+                logging.warning(f"Pod {name} eviction failed due {ex}")
+                return False
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logging.warning(f"Pod {name} eviction is not allowed by disruption budget until drain deadline")
+                return False
+            logging.info(f"Pod {name} eviction is not allowed by disruption budget. Retrying in {backoff:.1f} secs")
+            if cancelled is not None:
+                if cancelled.wait(min(backoff, remaining)):
+                    return False
+            else:
+                time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, drain_backoff_max)
+
+    def get_remaining_pods(self, pods):
+        """
+        Return pods which are still in cache (pod recreated with the same name has other uid)
+        """
+        remaining = []
+        for pod in pods:
+            cached = self.cache.get_pod(pod.metadata.namespace, pod.metadata.name)
+            if cached is not None and cached.metadata.uid == pod.metadata.uid:
+                remaining.append(pod)
+        return remaining
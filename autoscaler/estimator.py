@@ -0,0 +1,87 @@
+import bisect
+import logging
+
+
+class OpenNodes:
+    """
+    Free resources of partially filled nodes indexed by free cpu: sorted distinct free cpu values and sorted
+    free memory of nodes with every value. Request is placed to node with the least free cpu and then the least
+    free memory which fits it, found by bisect, so cost does not grow with count of nodes.
+    Nodes which cannot fit even the smallest request (min_cpu, min_memory) are dropped
+    """
+    def __init__(self, min_cpu=0, min_memory=0):
+        self.cpus = []
+        self.memories = {}  # free cpu -> sorted free memory of nodes
+        self.min_cpu = min_cpu
+        self.min_memory = min_memory
+
+    def add(self, free_cpu, free_memory):
+        if free_cpu < self.min_cpu or free_memory < self.min_memory:
+            return
+        memories = self.memories.get(free_cpu)
+        if memories is None:
+            memories = self.memories[free_cpu] = []
+            bisect.insort(self.cpus, free_cpu)
+        bisect.insort(memories, free_memory)
+
+    def place(self, cpu, memory):
+        """
+        Place request to the best fitting node. Return False if no node fits
+        """
+        for i in range(bisect.bisect_left(self.cpus, cpu), len(self.cpus)):
+            free_cpu = self.cpus[i]
+            memories = self.memories[free_cpu]
+            if memories[-1] < memory:
+                continue
+            free_memory = memories.pop(bisect.bisect_left(memories, memory))
+            if not memories:
+                del self.memories[free_cpu]
+                del self.cpus[i]
+            self.add(free_cpu - cpu, free_memory - memory)
+            return True
+        return False
+
+
+def sort_requests(pods_requests, node_cpu, node_memory):
+    return sorted(pods_requests, key=lambda request: max(request[0] / node_cpu, request[1] / node_memory),
+                  reverse=True)
+
+
+def estimate_nodes_count(pods_requests, node_cpu, node_memory, limit=None):
+    """
+    Return count of new nodes (node_cpu milicores, node_memory MB) needed for pods requests
+    [(cpu, memory), ...] packed in decreasing order, every request to the best fitting open node.
+    Packing stops when limit is reached
+    """
+    if not pods_requests:
+        return 0
+    count = 0
+    oversized = 0
+    open_nodes = OpenNodes(min(request[0] for request in pods_requests),
+                           min(request[1] for request in pods_requests))
+    for cpu, memory in sort_requests(pods_requests, node_cpu, node_memory):
+        if cpu > node_cpu or memory > node_memory:
+            oversized += 1
+            continue
+        if open_nodes.place(cpu, memory):
+            continue
+        if limit is not None and count >= limit:
+            logging.info(f"Scale up estimation reached limit of {limit} nodes")
+            return limit
+        count += 1
+        open_nodes.add(node_cpu - cpu, node_memory - memory)
+
+    if oversized:
+        logging.warning(f"{oversized} pending pods do not fit to empty node ({node_cpu}m cpu, {node_memory}MB memory)")
+    return count
+
+
+def get_unplaced_requests(pods_requests, node_cpu, node_memory, count):
+    """
+    Return pods requests which do not fit to count empty nodes when packed the same way
+    """
+    open_nodes = OpenNodes()
+    for _ in range(count):
+        open_nodes.add(node_cpu, node_memory)
+    return [(cpu, memory) for cpu, memory in sort_requests(pods_requests, node_cpu, node_memory)
+            if not open_nodes.place(cpu, memory)]
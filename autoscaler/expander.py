@@ -0,0 +1,69 @@
+from autoscaler import estimator
+import logging
+
+
+class Option:
+    """
+    Scale up of node group by count nodes for pods requests which fit its node shape
+    """
+    def __init__(self, node_group, count, pods_requests, waste):
+        self.node_group = node_group
+        self.count = count
+        self.pods_requests = pods_requests
+        self.waste = waste
+
+    def __str__(self):
+        return (f"{self.node_group.name}: {self.count} nodes for {len(self.pods_requests)} pods, "
+                f"waste {self.waste:.2f}")
+
+
+def get_option(node_group, pods_requests):
+    """
+    Return option of node group for pods requests [(cpu, memory), ...], None if no pod fits its node
+    """
+    node_cpu, node_memory = node_group.get_node_shape()
+    limit = node_group.get_free_size()
+    fitting = [request for request in pods_requests if request[0] <= node_cpu and request[1] <= node_memory]
+    if not fitting or limit <= 0:
+        return None
+
+    count = estimator.estimate_nodes_count(fitting, node_cpu, node_memory, limit)
+    if count <= 0:
+        return None
+    cpu = min(sum(request[0] for request in fitting), count * node_cpu)
+    memory = min(sum(request[1] for request in fitting), count * node_memory)
+    waste = (2 - cpu / (count * node_cpu) - memory / (count * node_memory)) / 2
+    return Option(node_group, count, fitting, waste)
+
+
+def exclude_upcoming(node_groups, pods_requests):
+    """
+    Return pods requests which do not fit to nodes being provisioned by node groups
+    """
+    for node_group in node_groups:
+        if node_group.upcoming_size and pods_requests:
+            node_cpu, node_memory = node_group.get_node_shape()
+            pods_requests = estimator.get_unplaced_requests(pods_requests, node_cpu, node_memory,
+                                                            node_group.upcoming_size)
+    return pods_requests
+
+
+def least_waste(node_groups, pods_requests):
+    """
+    Return option of node group whose new nodes are left with the least share of unused cpu and memory
+    by pending pods, ties are broken by more pods fitting and then by fewer nodes.
+    Pods which fit no node group are left for the next scan (e.g. after other groups scale up)
+    """
+    options = []
+    for node_group in node_groups:
+        option = get_option(node_group, pods_requests)
+        if option is not None:
+            options.append(option)
+    if not options:
+        return None
+
+    best = min(options, key=lambda option: (round(option.waste, 6), -len(option.pods_requests), option.count))
+    if len(options) > 1:
+        logging.info(f"Expander options: {'; '.join(str(option) for option in options)}. "
+                     f"Selected node group {best.node_group.name}")
+    return best
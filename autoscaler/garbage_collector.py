@@ -0,0 +1,119 @@
+from autoscaler.settings import *
+from autoscaler import proxmox_controller as pc
+from autoscaler import metrics
+from autoscaler import tracing
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import threading
+import time
+
+
+class GarbageCollector:
+    """
+    Removes lost vms of node group: autoscaled vms without ready kubernetes node which no operation works on.
+    Time vm is first seen lost is kept per vm, so every vm waits its own grace period, and all vms whose
+    grace period expired are removed in one background operation in parallel (by inventory vmid and host,
+    without ProxmoxServer and template lookup)
+    """
+    def __init__(self, node_group, grace_period=pxe_vm_lost_cleanup_delay,
+                 max_parallel=pxe_vm_lost_cleanup_max_parallel):
+        self.node_group = node_group
+        self.grace_period = grace_period
+        self.max_parallel = max_parallel
+        self.lock = threading.Lock()
+        self.first_seen = {}  # vm name -> time it is seen lost first (time.time() based)
+
+    def find_lost(self, busy_vms=()):
+        """
+        Return vms of node group which are not ready nodes and are not reserved or worked on by operations
+        """
+        nodes = set(self.node_group.nodes)
+        return [vm for vm in pc.get_scaled_vms(self.node_group.vm_name)
+                if vm['name'] not in nodes and vm['name'] not in busy_vms]
+
+    def get_expired(self, busy_vms=()):
+        """
+        Track lost vms and return ones lost for grace period. Vms which are not lost anymore are forgotten
+        """
+        now = time.time()
+        lost = self.find_lost(busy_vms)
+        with self.lock:
+            names = {vm['name'] for vm in lost}
+            for name in set(self.first_seen) - names:
+                logging.info(f"Vm {name} is not lost anymore")
+                del self.first_seen[name]
+            for name in names - set(self.first_seen):
+                logging.info(f"Found lost vm {name}. Removing it in {self.grace_period} secs")
+                self.first_seen[name] = now
+            return [vm for vm in lost if now - self.first_seen[vm['name']] >= self.grace_period]
+
+    def pending(self):
+        with self.lock:
+            return len(self.first_seen)
+
+    @tracing.traced
+    def collect(self, operations, busy_vms=()):
+        """
+        Remove lost vms whose grace period expired in parallel in background operation.
+        No collection is started while the previous one is running
+        """
+        if operations.in_flight("clean_up"):
+            return None
+        expired = self.get_expired(busy_vms)
+        if not expired:
+            return None
+
+        logging.warning(f"Removing lost autoscaled nodes {', '.join(vm['name'] for vm in expired)}..")
+        waves = math.ceil(len(expired) / self.max_parallel)
+        operation = operations.submit("clean_up", lambda operation: self.__collect(operation, expired),
+                                      count=len(expired), timeout=waves * max_node_provision_time,
+                                      item_timeout=max_node_provision_time)
+        # vm names of items keep vms out of other operations and of the next collection
+        for i, vm in enumerate(expired):
+            operation.set_item(i + 1, vmname=vm['name'])
+        return operation
+
+    def __collect(self, operation, expired):
+        """
+        Return names of removed vms
+        """
+        not_ready_nodes = set(self.node_group.get_nodes(ready=False))
+        with ThreadPoolExecutor(max_workers=min(len(expired), self.max_parallel),
+                                thread_name_prefix="gc") as pool:
+            results = list(pool.map(lambda i: self.remove(operation, i + 1, expired[i],
+                                                          expired[i]['name'] in not_ready_nodes),
+                                    range(len(expired))))
+        removed = [vm['name'] for vm, is_removed in zip(expired, results) if is_removed]
+        with self.lock:
+            for name in removed:
+                self.first_seen.pop(name, None)
+        if removed:
+            self.node_group.update_current_size()
+        return removed
+
+    def remove(self, operation, item, vm, not_ready):
+        name = vm['name']
+        try:
+            if not_ready:
+                # pods of not ready node are not deleted until node is deleted
+                self.node_group.drain_node(name, wait=False)
+                self.node_group.delete_node(name)
+            pc.remove_vm(vm, operation.item_deadline(), operation.cancelled)
+            logging.warning(f"Virtual machine {name} removed")
+            metrics.scaled_nodes_total.inc(kind="clean_up", result="removed")
+            return True
+        except Exception as ex:
+            logging.error(f"Cannot remove lost vm {name} due {ex}")
+            metrics.scaled_nodes_total.inc(kind="clean_up", result="failed")
+            return False
+        finally:
+            operation.finish_item(item)
+
+    def get_state(self):
+        with self.lock:
+            return {"first_seen": dict(self.first_seen)}
+
+    def restore_state(self, saved):
+        with self.lock:
+            self.first_seen = dict(saved.get("first_seen", {}))
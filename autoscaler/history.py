@@ -0,0 +1,124 @@
+from array import array
+import threading
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of last samples (timestamp, value) kept in two arrays of doubles
+    """
+    def __init__(self, size):
+        self.size = size
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.count = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        self.times[self.position] = timestamp
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def samples(self):
+        """
+        Return samples from oldest to newest
+        """
+        start = (self.position - self.count) % self.size
+        indexes = [(start + i) % self.size for i in range(self.count)]
+        return [(self.times[i], self.values[i]) for i in indexes]
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.position - 1) % self.size
+        return self.times[i], self.values[i]
+
+
+def ewma(samples, alpha):
+    """
+    Return exponentially weighted moving average of samples values, alpha is weight of newer sample
+    """
+    level = None
+    for _, value in samples:
+        level = value if level is None else alpha * value + (1 - alpha) * level
+    return level
+
+
+def holt(samples, alpha, beta, horizon):
+    """
+    Return value forecast horizon secs after the last sample by Holt linear trend method.
+    Trend is kept per second, so samples may come at irregular intervals
+    """
+    level, trend, last_time = None, 0.0, None
+    for timestamp, value in samples:
+        if level is None:
+            level, last_time = value, timestamp
+            continue
+        interval = timestamp - last_time
+        if interval <= 0:
+            continue
+        previous_level = level
+        level = alpha * value + (1 - alpha) * (level + trend * interval)
+        trend = beta * (level - previous_level) / interval + (1 - beta) * trend
+        last_time = timestamp
+    if level is None:
+        return None
+    return level + trend * horizon
+
+
+class NodeGroupHistory:
+    """
+    Pods requests of node group (cpu milicores, memory MB) and utilization of its nodes (%),
+    one sample per scan in ring buffers of fixed size
+    """
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.requests_cpu = RingBuffer(size)
+        self.requests_memory = RingBuffer(size)
+        self.nodes = {}  # node -> (cpu, memory) ring buffers
+
+    def record_requests(self, timestamp, cpu, memory):
+        with self.lock:
+            self.requests_cpu.append(timestamp, cpu)
+            self.requests_memory.append(timestamp, memory)
+
+    def record_node(self, node, timestamp, cpu, memory):
+        with self.lock:
+            if node not in self.nodes:
+                self.nodes[node] = (RingBuffer(self.size), RingBuffer(self.size))
+            self.nodes[node][0].append(timestamp, cpu)
+            self.nodes[node][1].append(timestamp, memory)
+
+    def prune(self, nodes):
+        """
+        Drop series of nodes which are not in node group anymore
+        """
+        with self.lock:
+            for node in set(self.nodes) - set(nodes):
+                del self.nodes[node]
+
+    def smoothed_utilization(self, node, alpha):
+        with self.lock:
+            if node not in self.nodes:
+                return None
+            cpu, memory = self.nodes[node]
+            return ewma(cpu.samples(), alpha), ewma(memory.samples(), alpha)
+
+    def forecast_requests(self, mode, horizon, alpha, beta, min_samples):
+        """
+        Return forecast of pods requests (cpu, memory) horizon secs ahead by ewma (smoothed level)
+        or holt (level and trend), None until min_samples are collected
+        """
+        with self.lock:
+            if len(self.requests_cpu) < max(min_samples, 2):
+                return None
+            cpu, memory = self.requests_cpu.samples(), self.requests_memory.samples()
+        if mode == 'holt':
+            return holt(cpu, alpha, beta, horizon), holt(memory, alpha, beta, horizon)
+        if mode == 'ewma':
+            return ewma(cpu, alpha), ewma(memory, alpha)
+        raise ValueError(f"Unknown forecast mode {mode}")
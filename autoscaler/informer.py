@@ -0,0 +1,271 @@
+from autoscaler.settings import *
+from autoscaler import k8s_api
+from autoscaler import projection
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+import json
+import logging
+import threading
+import time
+
+
+class Store:
+    """
+    Thread-safe local object store with secondary indexes
+    """
+    def __init__(self, key_func, indexers=None):
+        self.key_func = key_func
+        self.indexers = indexers or {}
+        self.lock = threading.RLock()
+        self.items = {}
+        self.indices = {name: {} for name in self.indexers}
+
+    def __index(self, key, obj):
+        for name, indexer in self.indexers.items():
+            for value in indexer(obj):
+                self.indices[name].setdefault(value, set()).add(key)
+
+    def __unindex(self, key, obj):
+        for name, indexer in self.indexers.items():
+            for value in indexer(obj):
+                keys = self.indices[name].get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.indices[name][value]
+
+    def update(self, obj):
+        key = self.key_func(obj)
+        with self.lock:
+            old = self.items.get(key)
+            if old is not None:
+                self.__unindex(key, old)
+            self.items[key] = obj
+            self.__index(key, obj)
+        return old
+
+    def delete(self, obj):
+        key = self.key_func(obj)
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.__unindex(key, old)
+        return old
+
+    def replace(self, objs):
+        with self.lock:
+            self.items = {}
+            self.indices = {name: {} for name in self.indexers}
+            for obj in objs:
+                self.update(obj)
+
+    def get(self, key):
+        with self.lock:
+            return self.items.get(key)
+
+    def list(self):
+        with self.lock:
+            return list(self.items.values())
+
+    def by_index(self, name, value):
+        with self.lock:
+            return [self.items[key] for key in self.indices[name].get(value, ())]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Informer:
+    """
+    Keeps a Store in sync with the apiserver using list+watch, resuming the watch from last seen resourceVersion.
+    Objects are read as json and stored as trimmed projections (project(dict)) instead of client models,
+    the initial list is read in pages of informer_list_page_size objects
+    """
+    def __init__(self, kind, list_func, key_func, indexers=None, project=None):
+        self.kind = kind
+        # without docstring watch does not deserialize objects to client models
+        self.list_func = lambda **kwargs: list_func(**kwargs)
+        self.project = project or (lambda obj: obj)
+        self.store = Store(key_func, indexers)
+        self.resource_version = None
+        self.synced = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.handlers = []
+
+    def add_event_handler(self, handler):
+        """
+        handler(event_type, obj, old_obj) is called from watch thread after store is updated
+        """
+        self.handlers.append(handler)
+
+    def start(self):
+        self.__list()
+        self.thread = threading.Thread(target=self.__run, name=f"informer-{self.kind}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def has_synced(self):
+        return self.synced.is_set()
+
+    def __list(self):
+        items, continue_token = [], None
+        while True:
+            ret = self.list_func(limit=informer_list_page_size, _continue=continue_token, _preload_content=False)
+            page = json.loads(ret.data)
+            items.extend(self.project(item) for item in page.get("items") or [])
+            del page["items"]
+            continue_token = page["metadata"].get("continue")
+            if not continue_token:
+                break
+        self.store.replace(items)
+        self.resource_version = page["metadata"]["resourceVersion"]
+        self.synced.set()
+        logging.info(f"Informer {self.kind} synced {len(items)} objects at resourceVersion {self.resource_version}")
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.__watch()
+            except ApiException as ex:
+                if ex.status == 410:
+                    logging.info(f"Informer {self.kind} resourceVersion {self.resource_version} expired. Relisting...")
+                    self.__relist()
+                else:
+                    logging.error(f"Informer {self.kind} watch failed due {ex}")
+                    time.sleep(informer_retry_delay)
+            except Exception as ex:
+                logging.error(f"Informer {self.kind} watch failed due {ex}")
+                time.sleep(informer_retry_delay)
+
+    def __relist(self):
+        while not self.stopped.is_set():
+            try:
+                self.__list()
+                return
+            except Exception as ex:
+                logging.error(f"Informer {self.kind} relist failed due {ex}")
+                time.sleep(informer_retry_delay)
+
+    def __watch(self):
+        w = watch.Watch()
+        for event in w.stream(self.list_func,
+                              resource_version=self.resource_version,
+                              allow_watch_bookmarks=True,
+                              timeout_seconds=informer_watch_timeout,
+                              _request_timeout=informer_watch_timeout + 30):
+            if self.stopped.is_set():
+                w.stop()
+                return
+            raw = event['raw_object']
+            if event['type'] == 'ERROR':
+                code = raw.get('code') if isinstance(raw, dict) else None
+                raise ApiException(status=code, reason=str(raw))
+            if event['type'] == 'BOOKMARK':
+                self.resource_version = raw['metadata']['resourceVersion']
+                continue
+            obj = self.project(raw)
+            old = None
+            if event['type'] in ('ADDED', 'MODIFIED'):
+                old = self.store.update(obj)
+            elif event['type'] == 'DELETED':
+                old = self.store.delete(obj)
+            self.resource_version = obj.metadata.resource_version
+            self.__notify(event['type'], obj, old)
+
+    def __notify(self, event_type, obj, old):
+        for handler in self.handlers:
+            try:
+                handler(event_type, obj, old)
+            except Exception as ex:
+                logging.error(f"Informer {self.kind} event handler failed due {ex}")
+
+
+def pod_key(pod):
+    return f"{pod.metadata.namespace}/{pod.metadata.name}"
+
+
+def node_key(node):
+    return node.metadata.name
+
+
+def pod_phase_index(pod):
+    if pod.status is None or pod.status.phase is None:
+        return []
+    return [pod.status.phase]
+
+
+def pod_node_index(pod):
+    if pod.spec is None or not pod.spec.node_name:
+        return []
+    return [pod.spec.node_name]
+
+
+def pod_unschedulable_index(pod):
+    if pod.status is None or not pod.status.conditions:
+        return []
+    for condition in pod.status.conditions:
+        if condition.type == "PodScheduled" and condition.status == "False" and condition.reason == "Unschedulable":
+            return ["true"]
+    return []
+
+
+def node_label_index(node):
+    labels = node.metadata.labels or {}
+    return [f"{key}={value}" for key, value in labels.items()]
+
+
+class ClusterCache:
+    def __init__(self, v1):
+        self.pods = Informer("pods",
+                             v1.list_pod_for_all_namespaces,
+                             pod_key,
+                             indexers={"phase": pod_phase_index,
+                                       "node": pod_node_index,
+                                       "unschedulable": pod_unschedulable_index},
+                             project=projection.project_pod)
+        self.nodes = Informer("nodes",
+                              v1.list_node,
+                              node_key,
+                              indexers={"label": node_label_index},
+                              project=projection.project_node)
+
+    def start(self):
+        self.pods.start()
+        self.nodes.start()
+
+    def get_node(self, node_name):
+        return self.nodes.store.get(node_name)
+
+    def get_nodes_by_label(self, label, value="true"):
+        return self.nodes.store.by_index("label", f"{label}={value}")
+
+    def get_pod(self, namespace, name):
+        return self.pods.store.get(f"{namespace}/{name}")
+
+    def get_pods_by_node(self, node_name):
+        return self.pods.store.by_index("node", node_name)
+
+    def get_pods_by_phase(self, phase):
+        return self.pods.store.by_index("phase", phase)
+
+    def get_unschedulable_pods(self):
+        return self.pods.store.by_index("unschedulable", "true")
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache():
+    """
+    Return process-wide ClusterCache, started on first use (kubeconfig must be loaded)
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ClusterCache(k8s_api.core_v1())
+            _shared_cache.start()
+    return _shared_cache
@@ -0,0 +1,89 @@
+from autoscaler import tracing
+import logging
+import threading
+
+
+class Snapshot:
+    """
+    Proxmox cluster vms, hosts and storages at the moment of one /cluster/resources call
+    """
+    def __init__(self, resources):
+        self.vms = []
+        self.by_name = {}
+        self.by_vmid = {}
+        self.node_by_vmid = {}
+        self.vmids = set()
+        self.nodes = []
+        self.storages = []
+
+        for resource in resources:
+            if resource.get("type") == "node":
+                self.nodes.append(resource)
+                continue
+            if resource.get("type") == "storage":
+                self.storages.append(resource)
+                continue
+            if "vmid" not in resource:
+                continue
+            self.vmids.add(resource["vmid"])
+            if resource.get("type") != "qemu":
+                continue
+            self.vms.append(resource)
+            self.by_vmid[resource["vmid"]] = resource
+            self.node_by_vmid[resource["vmid"]] = resource["node"]
+            if "name" in resource:
+                self.by_name[resource["name"]] = resource
+
+    def find_by_name_part(self, name_part):
+        return [vm for vm in self.vms if name_part in vm.get("name", "")]
+
+
+class Inventory:
+    """
+    Caches Proxmox vms snapshot until the next tick or until our own changes of vms
+    """
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    @tracing.traced
+    def get(self):
+        with self.lock:
+            if self.snapshot is None:
+                self.snapshot = Snapshot(self.api.cluster.resources.get())
+                logging.debug(f"Proxmox inventory refreshed with {len(self.snapshot.vms)} vms")
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+
+class VmidAllocator:
+    """
+    Hands out unique vmids to parallel workers: starts from /cluster/nextid and skips vmids used
+    in inventory snapshot or reserved by vms being created
+    """
+    def __init__(self, api, inventory):
+        self.api = api
+        self.inventory = inventory
+        self.lock = threading.Lock()
+        self.reserved = set()
+        self.next_vmid = None
+
+    def allocate(self):
+        with self.lock:
+            used = self.inventory.get().vmids
+            if not self.reserved or self.next_vmid is None:
+                self.next_vmid = int(self.api.cluster.nextid.get())
+            vmid = self.next_vmid
+            while vmid in used or vmid in self.reserved:
+                vmid += 1
+            self.reserved.add(vmid)
+            self.next_vmid = vmid + 1
+            return vmid
+
+    def release(self, vmid):
+        with self.lock:
+            self.reserved.discard(vmid)
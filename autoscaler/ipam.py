@@ -0,0 +1,144 @@
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+
+
+FREE, BUSY, LEASED = 0, 1, 2
+
+
+def parse_pool(pool):
+    """
+    Return first and last ip (as int) of pool given as range (10.0.0.10-10.0.0.20) or network (10.0.0.0/24)
+    """
+    if '-' in pool:
+        first_ip, last_ip = pool.split('-')
+        return int(ipaddress.ip_address(first_ip.strip())), int(ipaddress.ip_address(last_ip.strip()))
+    network = ipaddress.ip_network(pool.strip(), strict=False)
+    if network.num_addresses <= 2:
+        return int(network.network_address), int(network.broadcast_address)
+    return int(network.network_address) + 1, int(network.broadcast_address) - 1
+
+
+class IpPool:
+    """
+    Ip addresses of pool indexed by bytearray (one byte state per address) with leases
+    of addresses given to vms being provisioned. Leases are persisted to leases_file
+    """
+    def __init__(self, pool, leases_file=None, lease_time=900):
+        self.first, self.last = parse_pool(pool)
+        self.size = self.last - self.first + 1
+        self.leases_file = leases_file
+        self.lease_time = lease_time
+        self.lock = threading.Lock()
+        self.state = bytearray(self.size)
+        self.leases = {}  # ip -> {"holder": ..., "expires": ...}
+        self.__load()
+
+    def __index(self, ip):
+        index = int(ipaddress.ip_address(ip)) - self.first
+        if 0 <= index < self.size:
+            return index
+        return None
+
+    def __ip(self, index):
+        return ipaddress.ip_address(self.first + index).exploded
+
+    def reconcile(self, busy_ips):
+        """
+        Replace busy addresses with addresses observed in use (kubernetes nodes, vms)
+        """
+        with self.lock:
+            self.state = bytearray(self.size)
+            for ip in busy_ips:
+                index = self.__index(ip)
+                if index is not None:
+                    self.state[index] = BUSY
+            self.__expire()
+            for ip in self.leases:
+                self.state[self.__index(ip)] = LEASED
+            logging.info(f"Ip pool reconciled: {self.size - self.state.count(FREE)} of {self.size} addresses in use")
+
+    def reserve(self, holder):
+        """
+        Lease first free address to holder, None if pool is exhausted
+        """
+        with self.lock:
+            self.__expire()
+            index = self.state.find(FREE)
+            if index < 0:
+                logging.error("Free ip address for new host not found")
+                return None
+            ip = self.__ip(index)
+            self.state[index] = LEASED
+            self.leases[ip] = {"holder": holder, "expires": time.time() + self.lease_time}
+            self.__save()
+            logging.info(f"Found free ip address for new host {ip}")
+            return ip
+
+    def claim(self, ip, holder):
+        """
+        Lease given address to holder (e.g. to vm resumed after restart), None if it is out of pool
+        """
+        with self.lock:
+            index = self.__index(ip)
+            if index is None:
+                return None
+            self.state[index] = LEASED
+            self.leases[ip] = {"holder": holder, "expires": time.time() + self.lease_time}
+            self.__save()
+            return ip
+
+    def release(self, ip, busy=False):
+        """
+        Drop lease of ip. Address stays busy until next reconcile if it is used now
+        """
+        with self.lock:
+            if self.leases.pop(ip, None) is None:
+                return
+            index = self.__index(ip)
+            if index is not None:
+                self.state[index] = BUSY if busy else FREE
+            self.__save()
+
+    def __expire(self):
+        now = time.time()
+        expired = [ip for ip, lease in self.leases.items() if lease["expires"] < now]
+        for ip in expired:
+            logging.warning(f"Lease of ip {ip} by {self.leases[ip]['holder']} expired")
+            del self.leases[ip]
+            index = self.__index(ip)
+            if index is not None and self.state[index] == LEASED:
+                self.state[index] = FREE
+        if expired:
+            self.__save()
+
+    def __load(self):
+        if not self.leases_file or not os.path.exists(self.leases_file):
+            return
+        try:
+            with open(self.leases_file) as f:
+                leases = json.load(f)
+        except (OSError, ValueError) as ex:
+            logging.error(f"Cannot read ip leases from {self.leases_file} due {ex}")
+            return
+        for ip, lease in leases.items():
+            index = self.__index(ip)
+            if index is not None:
+                self.leases[ip] = lease
+                self.state[index] = LEASED
+        self.__expire()
+        logging.info(f"Loaded {len(self.leases)} ip leases from {self.leases_file}")
+
+    def __save(self):
+        if not self.leases_file:
+            return
+        try:
+            tmp_file = self.leases_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self.leases, f)
+            os.replace(tmp_file, self.leases_file)
+        except OSError as ex:
+            logging.error(f"Cannot save ip leases to {self.leases_file} due {ex}")
@@ -0,0 +1,126 @@
+from autoscaler.settings import *
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import logging
+import secrets
+import string
+import threading
+import yaml
+
+
+TOKEN_ALPHABET = string.ascii_lowercase + string.digits
+TOKEN_DESCRIPTION = "proxmox-autoscaler join token"
+TOKEN_GROUPS = "system:bootstrappers:kubeadm:default-node-token"
+
+
+class JoinCredentials:
+    """
+    Generates kubeadm join command through kubernetes api: bootstrap token Secret is created
+    (or reused) in kube-system, api endpoint and CA cert hash are read from kube-public/cluster-info.
+    Command is cached until token lifetime left is shorter than max_node_provision_time
+    """
+    def __init__(self, v1, token_ttl=join_token_ttl):
+        self.v1 = v1
+        self.token_ttl = token_ttl
+        self.lock = threading.Lock()
+        self.endpoint = None
+        self.ca_cert_hash = None
+        self.command = None
+        self.expiration = None
+
+    def get_join_command(self):
+        with self.lock:
+            if self.command is None or not self.__is_valid(self.expiration):
+                if self.endpoint is None:
+                    self.endpoint, self.ca_cert_hash = self.__read_cluster_info()
+                token, self.expiration = self.__find_token() or self.__create_token()
+                self.command = (f"kubeadm join {self.endpoint} --token {token} "
+                                f"--discovery-token-ca-cert-hash {self.ca_cert_hash}")
+                logging.info(f"Generated join command for {self.endpoint} valid until {self.expiration.isoformat()}")
+            return self.command
+
+    def __is_valid(self, expiration):
+        return expiration - datetime.now(timezone.utc) > timedelta(seconds=max_node_provision_time)
+
+    def __read_cluster_info(self):
+        cluster_info = self.v1.read_namespaced_config_map("cluster-info", "kube-public")
+        kubeconfig = yaml.safe_load(cluster_info.data["kubeconfig"])
+        cluster = kubeconfig["clusters"][0]["cluster"]
+        endpoint = cluster["server"].replace("https://", "").rstrip("/")
+        ca_cert = base64.b64decode(cluster["certificate-authority-data"])
+        return endpoint, ca_cert_hash(ca_cert)
+
+    def __find_token(self):
+        ret = self.v1.list_namespaced_secret("kube-system", field_selector="type=bootstrap.kubernetes.io/token")
+        for secret in ret.items:
+            data = {key: base64.b64decode(value).decode() for key, value in (secret.data or {}).items()}
+            if data.get("description") != TOKEN_DESCRIPTION or "expiration" not in data:
+                continue
+            expiration = datetime.strptime(data["expiration"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            if self.__is_valid(expiration):
+                logging.info(f"Reusing bootstrap token {data['token-id']}")
+                return f"{data['token-id']}.{data['token-secret']}", expiration
+        return None
+
+    def __create_token(self):
+        token_id = "".join(secrets.choice(TOKEN_ALPHABET) for _ in range(6))
+        token_secret = "".join(secrets.choice(TOKEN_ALPHABET) for _ in range(16))
+        expiration = (datetime.now(timezone.utc) + timedelta(seconds=self.token_ttl)).replace(microsecond=0)
+        body = {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {
+                "name": f"bootstrap-token-{token_id}",
+                "namespace": "kube-system"
+            },
+            "type": "bootstrap.kubernetes.io/token",
+            "stringData": {
+                "description": TOKEN_DESCRIPTION,
+                "token-id": token_id,
+                "token-secret": token_secret,
+                "expiration": expiration.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "usage-bootstrap-authentication": "true",
+                "usage-bootstrap-signing": "true",
+                "auth-extra-groups": TOKEN_GROUPS
+            }
+        }
+        self.v1.create_namespaced_secret("kube-system", body)
+        logging.info(f"Created bootstrap token {token_id}")
+        return f"{token_id}.{token_secret}", expiration
+
+
+def ca_cert_hash(ca_cert):
+    """
+    Return kubeadm discovery hash (sha256 of certificate SubjectPublicKeyInfo) of PEM or DER certificate
+    """
+    if ca_cert.lstrip().startswith(b"-----BEGIN"):
+        pem = b"".join(line for line in ca_cert.strip().splitlines() if not line.startswith(b"-----"))
+        ca_cert = base64.b64decode(pem)
+    return "sha256:" + hashlib.sha256(subject_public_key_info(ca_cert)).hexdigest()
+
+
+def subject_public_key_info(der):
+    # Certificate ::= SEQUENCE { tbsCertificate SEQUENCE { [0] version OPTIONAL, serialNumber, signature,
+    #                                                       issuer, validity, subject, subjectPublicKeyInfo, ... } }
+    _, certificate, _ = read_der(der, 0)
+    _, position, _ = read_der(der, certificate)
+    if der[position] == 0xa0:
+        position = read_der(der, position)[2]
+    for _ in range(5):
+        position = read_der(der, position)[2]
+    return der[position:read_der(der, position)[2]]
+
+
+def read_der(der, position):
+    """
+    Return tag, content start and element end of DER element at position
+    """
+    tag = der[position]
+    length = der[position + 1]
+    start = position + 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(der[start:start + size], "big")
+        start += size
+    return tag, start, start + length
@@ -0,0 +1,40 @@
+from autoscaler import metrics
+from autoscaler import tracing
+from kubernetes import client
+import threading
+import time
+
+
+class InstrumentedApiClient(client.ApiClient):
+    """
+    Kubernetes api client recording every api call and its latency by endpoint template
+    (e.g. /api/v1/namespaces/{namespace}/pods) in metrics. Latency of watch requests is
+    measured until response headers
+    """
+    def call_api(self, resource_path, method, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            with tracing.span(f"k8s {method} {resource_path}"):
+                return super().call_api(resource_path, method, *args, **kwargs)
+        finally:
+            metrics.kubernetes_api_calls_total.inc(method=method, endpoint=resource_path)
+            metrics.kubernetes_api_call_seconds.observe(time.monotonic() - start, method=method, endpoint=resource_path)
+
+
+_api_client = None
+_api_client_lock = threading.Lock()
+
+
+def api_client():
+    """
+    Return process-wide instrumented api client (kubeconfig must be loaded)
+    """
+    global _api_client
+    with _api_client_lock:
+        if _api_client is None:
+            _api_client = InstrumentedApiClient()
+    return _api_client
+
+
+def core_v1():
+    return client.CoreV1Api(api_client())
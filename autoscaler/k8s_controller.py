@@ -1,25 +1,36 @@
 from autoscaler.settings import *
-from kubernetes import client
+from autoscaler import drain
+from autoscaler import estimator
+from autoscaler import history
+from autoscaler import informer
+from autoscaler import k8s_api
+from autoscaler import quantity
+from autoscaler import simulator
+from autoscaler import state
+from autoscaler import tracing
 import logging
 import json
-import re
+import math
+import os
 import threading
+import time
 
 
 class KubernetesWatcher:
     def __init__(self):
-        self.v1 = client.CoreV1Api()
+        self.v1 = k8s_api.core_v1()
+        self.cache = informer.shared_cache()
 
     def has_unschedulable_pods(self):
-        ret = self.v1.list_pod_for_all_namespaces()
-        for item in ret.items:
-            for status in item.status.conditions:
-                if status.reason == "Unschedulable":
-                    if "Insufficient cpu" in status.message or "Insufficient memory" in status.message:
-                        logging.warning(f"Found unschedulable pod {item.metadata.name} due {status.message}")
-                        return True
+        for item in self.cache.get_unschedulable_pods():
+            if is_pod_insufficient_resources(item):
+                logging.warning(f"Found unschedulable pod {item.metadata.name} due insufficient resources")
+                return True
         return False
 
+    def get_unschedulable_pods(self):
+        return [item for item in self.cache.get_unschedulable_pods() if is_pod_insufficient_resources(item)]
+
 
 class NodeGroup:
     def __init__(self,
@@ -27,71 +38,123 @@ class NodeGroup:
                  min_size=3,
                  max_size=5,
                  node_cpu=4,
-                 node_memory=4):
+                 node_memory=4,
+                 name="default",
+                 template_vm=pxe_autoscaled_node_template_vm,
+                 vm_name=pxe_autoscaled_node_name,
+                 ip_pool=pxe_autoscaled_node_ip_pool,
+                 ip_leases_file=pxe_ip_leases_file,
+                 warm_pool_size=pxe_warm_pool_size,
+                 warm_pool_vm_name=pxe_warm_pool_vm_name):
+        self.name = name
         self.node_group_label = node_group_label
         self.min_size = min_size
         self.max_size = max_size
+        self.template_vm = template_vm
+        self.vm_name = vm_name
+        self.ip_pool = ip_pool
+        self.ip_leases_file = ip_leases_file
+        self.warm_pool_size = warm_pool_size
+        self.warm_pool_vm_name = warm_pool_vm_name
 
         self.k8s = KubernetesWatcher()
-        self.v1 = client.CoreV1Api()
+        self.cache = self.k8s.cache
+        self.v1 = k8s_api.core_v1()
         self.nodes_ip_addresses = []
         self.nodes = self.get_nodes(ready=True, log=True)
         self.current_size = len(self.nodes)
+        self.upcoming_size = 0  # nodes being provisioned now
         self.redundant_node = ''
+        self.redundant_nodes = []
         self.unneeded_node_delay = threading.Timer(scale_down_unneeded_time,
                                                    self.set_unneeded_node_delay_elapsed,
                                                    args=[True])
         self.unneeded_node_delay_elapsed = False
+        self.history = history.NodeGroupHistory(history_size)
+        self.drainer = drain.Drainer(self.v1, self.cache)
 
         self.capacity_cpu = node_cpu
-        self.capacity_mem = node_memory
+        self.capacity_mem = int(node_memory * 1024)
         self.__get_capacity()
 
     def __get_capacity(self):
         if self.nodes:
-            ret = self.v1.read_node_status(self.nodes[0])
-            mem = int(ret.status.capacity['memory'].replace('Ki', ''))
-
+            ret = self.cache.get_node(self.nodes[0])
             self.capacity_cpu = ret.status.capacity['cpu']
-            self.capacity_mem = round(mem/1024/1024)*1024
+            # kernel keeps part of vm memory, so node capacity is rounded back to vm memory in whole GB
+            self.capacity_mem = round(convert_memory(ret.status.capacity['memory']) / 1024) * 1024
+
+    def get_node_shape(self):
+        """
+        Return cpu (milicores) and memory (MB) new node has for pods: allocatable of ready nodes of node group
+        less requests of their DaemonSet and mirror pods (the smallest of nodes), node capacity without nodes
+        """
+        shape = None
+        for node_name in self.nodes:
+            node = self.cache.get_node(node_name)
+            if node is None or not node.status.allocatable:
+                continue
+            (daemon_cpu, daemon_memory), _ = split_daemon_requests(self.cache.get_pods_by_node(node_name))
+            cpu = convert_cpu(node.status.allocatable.get("cpu", 0)) - daemon_cpu
+            memory = convert_memory(node.status.allocatable.get("memory", 0)) - daemon_memory
+            shape = (cpu, memory) if shape is None else (min(shape[0], cpu), min(shape[1], memory))
+        if shape is None:
+            return convert_cpu(self.capacity_cpu), self.capacity_mem
+        return shape
 
     def get_nodes(self, ready=True, log=False):
         ready = str(ready)
         nodes = []
         ip_addresses = []
 
-        ret = self.v1.list_node()
-        for item in ret.items:
-            if self.node_group_label in item.metadata.labels:
-                if item.metadata.labels[self.node_group_label] == 'true':
-                    for status in item.status.conditions:
-                        if status.type == "Ready" and status.status == ready:
-                            if log:
-                                logging.info(f"{item.metadata.name} with state Ready - " + ready)
-                            nodes.append(item.metadata.name)
+        for item in self.cache.get_nodes_by_label(self.node_group_label):
+            for status in item.status.conditions or []:
+                if status.type == "Ready" and status.status == ready:
+                    if log:
+                        logging.info(f"{item.metadata.name} with state Ready - " + ready)
+                    nodes.append(item.metadata.name)
 
-                            for address in item.status.addresses:
-                                if address.type == 'InternalIP':
-                                    ip_addresses.append(address.address)
+                    for address in item.status.addresses or []:
+                        if address.type == 'InternalIP':
+                            ip_addresses.append(address.address)
 
         self.nodes_ip_addresses = ip_addresses
         return nodes
 
+    @tracing.traced
     def update_current_size(self):
         self.nodes = self.get_nodes(ready=True)
         self.current_size = len(self.nodes)
 
-    def is_need_scaling_up(self):
-        if self.current_size < self.min_size:
-            return True
-        if self.current_size < self.max_size:
-            if self.k8s.has_unschedulable_pods():
-                return True
-            else:
-                return False
-        else:
-            logging.warning("Autoscaler reached maximum size. Cant scale")
-            return False
+    def is_below_min_size(self):
+        return self.current_size + self.upcoming_size < self.min_size
+
+    def get_free_size(self):
+        """
+        Return count of nodes which can be added until max_size
+        """
+        return max(self.max_size - self.current_size - self.upcoming_size, 0)
+
+    @tracing.traced
+    def get_scale_up_count(self, pods_requests=None):
+        """
+        Return count of new nodes for pods requests (all unschedulable pods by default) and min_size
+        """
+        limit = self.max_size - self.current_size - self.upcoming_size
+        if limit <= 0:
+            return 0
+
+        if pods_requests is None:
+            pods_requests = [get_pod_requests(pod) for pod in self.k8s.get_unschedulable_pods()]
+        node_cpu, node_memory = self.get_node_shape()
+        count = estimator.estimate_nodes_count(pods_requests, node_cpu, node_memory,
+                                               self.max_size - self.current_size)
+        logging.info(f"{len(pods_requests)} unschedulable pods need {count} new nodes, "
+                     f"{self.upcoming_size} nodes are being provisioned")
+        if self.upcoming_size == 0:
+            count = max(count, 1)
+        count = max(count - self.upcoming_size, self.min_size - self.current_size - self.upcoming_size)
+        return min(count, limit)
 
     def get_unneeded_node_delay_elapsed(self):
         return self.unneeded_node_delay_elapsed
@@ -99,15 +162,125 @@ class NodeGroup:
     def set_unneeded_node_delay_elapsed(self, b):
         self.unneeded_node_delay_elapsed = b
 
+    def get_state(self):
+        return {"redundant_node": self.redundant_node,
+                "redundant_nodes": self.redundant_nodes,
+                "unneeded_node_delay": state.timer_deadline(self.unneeded_node_delay),
+                "unneeded_node_delay_elapsed": self.unneeded_node_delay_elapsed}
+
+    def restore_state(self, saved):
+        self.redundant_node = saved.get("redundant_node", "")
+        self.redundant_nodes = saved.get("redundant_nodes", [])
+        self.unneeded_node_delay_elapsed = saved.get("unneeded_node_delay_elapsed", False)
+        self.unneeded_node_delay = state.restore_timer(saved.get("unneeded_node_delay"),
+                                                       self.set_unneeded_node_delay_elapsed, True) \
+            or self.unneeded_node_delay
+
     def is_scaled(self):
         return True if self.current_size > self.min_size else False
 
+    def get_allocatable(self):
+        """
+        Return allocatable cpu (milicores) and memory (MB) of ready nodes and of nodes being provisioned
+        """
+        node_cpu, node_memory = self.get_node_shape()
+        cpu = self.upcoming_size * node_cpu
+        memory = self.upcoming_size * node_memory
+        for node_name in self.nodes:
+            node = self.cache.get_node(node_name)
+            if node is not None:
+                cpu += convert_cpu(node.status.allocatable.get("cpu"))
+                memory += convert_memory(node.status.allocatable.get("memory"))
+        return cpu, memory
+
+    @tracing.traced
+    def record_history(self):
+        """
+        Record pods requests of ready nodes of node group, taken from informer cache,
+        and utilization of the nodes from metrics snapshot
+        """
+        now = time.time()
+        cpu, memory = 0, 0
+        for node_name in self.nodes:
+            for pod in self.cache.get_pods_by_node(node_name):
+                if not is_pod_terminated(pod):
+                    pod_cpu, pod_memory = get_pod_requests(pod)
+                    cpu += pod_cpu
+                    memory += pod_memory
+        self.history.record_requests(now, cpu, memory)
+        self.history.prune(self.nodes)
+
+        try:
+            snapshot = self.get_utilization_snapshot()
+        except Exception as ex:
+            logging.error(f"Cannot record utilization of nodes due {ex}")
+            return
+        for node_name in self.nodes:
+            node_utilization = snapshot.get_node_utilization(node_name)
+            if "node" in node_utilization:
+                self.history.record_node(node_name, now, node_utilization["cpu"], node_utilization["memory"])
+
+    def get_forecast_requests(self):
+        if not forecast_mode:
+            return None
+        return self.history.forecast_requests(forecast_mode, forecast_lead_time,
+                                              forecast_alpha, forecast_beta, forecast_min_samples)
+
+    def get_forecast_shortage(self, removed_nodes=0):
+        """
+        Return count of nodes missing for requests forecast forecast_lead_time ahead to stay within
+        forecast_target_utilization of allocatable resources when removed_nodes nodes are removed,
+        0 when forecast is disabled or not ready.
+        Requests of scheduled pods never exceed allocatable resources, so forecast is compared with target share
+        """
+        forecast = self.get_forecast_requests()
+        if forecast is None:
+            return 0
+        node_cpu, node_memory = self.get_node_shape()
+        cpu, memory = self.get_allocatable()
+        cpu -= removed_nodes * node_cpu
+        memory -= removed_nodes * node_memory
+        target = forecast_target_utilization
+        return max(math.ceil((forecast[0] - cpu * target) / (node_cpu * target)),
+                   math.ceil((forecast[1] - memory * target) / (node_memory * target)), 0)
+
+    @tracing.traced
+    def get_forecast_scale_up_count(self):
+        """
+        Return count of nodes to provision in advance for forecast requests
+        """
+        count = min(self.get_forecast_shortage(), self.get_free_size())
+        if count > 0:
+            cpu, memory = self.get_forecast_requests()
+            logging.info(f"Node group {self.name} requests forecast in {forecast_lead_time} secs "
+                         f"({cpu:.0f}m cpu, {memory:.0f}MB memory) needs {count} new nodes")
+        return count
+
+    def smooth_utilization(self, node_utilization):
+        """
+        Replace node utilization with moving average of its history recorded every scan
+        (scale_down_utilization_smoothing)
+        """
+        if scale_down_utilization_smoothing < 1 and "node" in node_utilization:
+            smoothed = self.history.smoothed_utilization(node_utilization["node"], scale_down_utilization_smoothing)
+            if smoothed is not None:
+                node_utilization["cpu"], node_utilization["memory"] = smoothed
+        return node_utilization
+
+    @tracing.traced
     def can_scale_down(self):
         if self.k8s.has_unschedulable_pods():
             return False
 
+        if self.get_forecast_shortage(removed_nodes=1) > 0:
+            logging.info(f"Cannot scale down. Requests forecast needs all nodes of node group {self.name}")
+            self.unneeded_node_delay.cancel()
+            return False
+
         # checks utilization, if < setting value -> chooses node -> checks pod placement on other nodes > return true
-        node_group_utilization = self.get_utilization()
+        snapshot = self.get_utilization_snapshot()
+        node_group_utilization = [self.smooth_utilization(node_utilization)
+                                  for node_utilization in self.get_utilization(snapshot)]
         node_min_cpu = min(node_group_utilization, key=lambda x: x['cpu'])
         node_min_mem = min(node_group_utilization, key=lambda x: x['memory'])
 
@@ -118,7 +291,7 @@ class NodeGroup:
             self.unneeded_node_delay.cancel()
             return False
 
-        node = self.select_node_for_remove()
+        node = self.select_node_for_remove(snapshot)
         if node is None:
             logging.info("Node for scale down not selected")
             logging.info("Unneeded node timer canceled")
@@ -129,107 +302,100 @@ class NodeGroup:
             if not self.unneeded_node_delay.is_alive():
                 logging.info(f"Found redundant node {node}")
                 logging.info("Unneeded node timer started")
-                self.unneeded_node_delay = threading.Timer(scale_down_unneeded_time,
-                                                           self.set_unneeded_node_delay_elapsed,
-                                                           args=[True])
-                self.unneeded_node_delay.start()
+                self.unneeded_node_delay = state.start_timer(scale_down_unneeded_time,
+                                                             self.set_unneeded_node_delay_elapsed, True)
             return False
         self.unneeded_node_delay_elapsed = False
 
         if len(node_group_utilization) == 1:
-            if self.is_node_running_pods(node):
+            if snapshot.is_node_running_pods(node):
                 logging.info("Cannot scale down last autoscaler node with running pods")
                 return False
             self.redundant_node = node
+            self.redundant_nodes = [node]
             return True
 
-        # remove selected node from utilization list
-        node_group_utilization = list(filter(lambda i: i["node"] != node, node_group_utilization))
-
-        pods = self.get_node_utilization_by_pods(node)
-        summary_pod_cpu, summary_pod_memory = 0, 0
-        for pod in pods:
-            if max(node_group_utilization, key=lambda x: x['cpu_available'])["cpu_available"] <= pod["cpu"]:
-                logging.warning(f"Cannot find node with enough cpu for pod {pod['pod']} ({pod['cpu']})")
-                return False
-            if max(node_group_utilization, key=lambda x: x['memory_available'])["memory_available"] <= pod["memory"]:
-                logging.warning(f"Cannot find node with enough memory for pod {pod['pod']} ({pod['memory']})")
+        scale_down_simulator = self.get_scale_down_simulator()
+        pod = scale_down_simulator.find_unplaceable_pod(node)
+        if pod is not None:
+            logging.info(f"Cannot find node with enough resources for pod {pod} from node {node}")
+            underutilized = [item["node"] for item in node_group_utilization
+                             if item["cpu"] < scale_down_utilization_threshold
+                             and item["memory"] < scale_down_utilization_threshold]
+            candidates = [candidate for candidate in scale_down_simulator.rank_candidates()
+                          if candidate in underutilized]
+            if not candidates:
+                logging.info("Node group does not have resources for scheduling pods from any node")
                 return False
-            summary_pod_cpu += pod["cpu"]
-            summary_pod_memory += pod["memory"]
-
-        summary_available_cpu = sum(item["cpu_available"] for item in node_group_utilization)
-        summary_available_memory = sum(item["cpu_available"] for item in node_group_utilization)
-        if summary_pod_cpu >= summary_available_cpu or summary_pod_memory >= summary_available_memory:
-            logging.info("Node group does not have resources for scheduling pods from any node")
-            return False
+            node = candidates[0]
+            logging.info(f"Node {node} selected for scale down instead")
 
         self.redundant_node = node
+        self.redundant_nodes = self.select_nodes_for_bulk_remove(node, scale_down_simulator,
+                                                                 node_group_utilization, snapshot)
         return True
 
-    def get_node_utilization(self, node_name):
-        values_utilization = {}
-
-        req = client.ApiClient()
-        try:
-            response = req.call_api(resource_path=f"/apis/metrics.k8s.io/v1beta1/nodes/{node_name}",
-                                    method='GET',
-                                    auth_settings=['BearerToken'],
-                                    response_type='json',
-                                    _preload_content=False)
-        except Exception as e:
-            logging.error(e)
-            logging.error(f"Cannot get utilization from node {node_name}. Ignoring...")
-            return {"cpu": 99, "memory": 99}
-        response = json.loads(response[0].data.decode('utf-8'))
-        values_utilization["cpu_used"] = convert_cpu(response["usage"].get("cpu"))
-        values_utilization["memory_used"] = convert_memory(response["usage"].get("memory"))
-
-        ret = self.v1.read_node_status(node_name)
-        values_utilization["cpu_allocatable"] = convert_cpu(ret.status.allocatable.get("cpu"))
-        values_utilization["memory_allocatable"] = convert_memory((ret.status.allocatable.get("memory")))
-
-        values_utilization["cpu"] = (values_utilization["cpu_used"] / values_utilization["cpu_allocatable"]) * 100
-        values_utilization["memory"] = (values_utilization["memory_used"] / values_utilization["memory_allocatable"]) * 100
-        return values_utilization
+    def select_nodes_for_bulk_remove(self, node, scale_down_simulator, node_group_utilization, snapshot):
+        """
+        Return node selected for remove with other empty nodes (up to scale_down_max_empty_bulk) and
+        underutilized nodes (up to scale_down_max_underutilized_bulk) which can be removed together
+        keeping at least min_size nodes
+        """
+        limit = self.current_size - self.min_size
+        empty = [name for name in self.nodes if not snapshot.is_node_running_pods(name)]
+        underutilized = [item["node"] for item in node_group_utilization
+                         if item["node"] not in empty
+                         and item["cpu"] < scale_down_utilization_threshold
+                         and item["memory"] < scale_down_utilization_threshold]
+        underutilized = [name for name in scale_down_simulator.rank_candidates() if name in underutilized]
+        # selected node takes place of the empty or underutilized ones
+        empty_count = scale_down_max_empty_bulk - 1 if node in empty else scale_down_max_empty_bulk
+        underutilized_count = scale_down_max_underutilized_bulk - (node not in empty)
+        if scale_down_max_empty_bulk <= 1:
+            empty_count = 0
+
+        candidates = [node] + [name for name in empty if name != node][:max(empty_count, 0)] \
+            + [name for name in underutilized if name != node][:max(underutilized_count, 0)]
+        nodes = scale_down_simulator.select_removable(candidates, limit)
+        if node not in nodes:
+            return [node]
+        if len(nodes) > 1:
+            logging.info(f"Nodes {', '.join(nodes)} selected for bulk scale down")
+        return nodes
 
-    def get_utilization(self):
-        cluster_utilization = {}
+    @tracing.traced
+    def get_scale_down_simulator(self):
+        nodes = []
+        daemon_requests = {}
+        for node_name in self.nodes:
+            node = self.cache.get_node(node_name)
+            if node is None:
+                continue
+            (daemon_cpu, daemon_memory), pods = split_daemon_requests(self.cache.get_pods_by_node(node_name))
+            nodes.append(simulator.NodeState(node_name,
+                                             convert_cpu(node.status.allocatable.get("cpu")),
+                                             convert_memory(node.status.allocatable.get("memory")),
+                                             pods,
+                                             schedulable=not node.spec.unschedulable))
+            daemon_requests[node_name] = (daemon_cpu, daemon_memory)
+        return simulator.ScaleDownSimulator(nodes, daemon_requests)
+
+    @tracing.traced
+    def get_utilization_snapshot(self):
+        return utilization.get(self.cache, self.v1.api_client)
+
+    def get_node_utilization(self, node_name, snapshot=None):
+        snapshot = snapshot or self.get_utilization_snapshot()
+        return snapshot.get_node_utilization(node_name)
+
+    @tracing.traced
+    def get_utilization(self, snapshot=None):
+        snapshot = snapshot or self.get_utilization_snapshot()
         node_group_utilization = []
-
-        req = client.ApiClient()
-        try:
-            response = req.call_api(resource_path=f"/apis/metrics.k8s.io/v1beta1/nodes",
-                                    method='GET',
-                                    auth_settings=['BearerToken'],
-                                    response_type='json',
-                                    _preload_content=False)
-        except Exception as e:
-            logging.error(e)
-            logging.error("Cannot get utilization. Node metrics not available")
-            raise Exception(e)
-        response = json.loads(response[0].data.decode('utf-8'))
-        for node in response['items']:
-            node_utilization = {}
-            node_utilization["node"] = node['metadata'].get("name")
-            node_utilization["cpu_used"] = convert_cpu(node["usage"].get("cpu"))
-            node_utilization["memory_used"] = convert_memory(node["usage"].get("memory"))
-            cluster_utilization[node_utilization["node"]] = node_utilization
-
-        ret = self.v1.list_node()
-        for node in ret.items:
-            if self.node_group_label in node.metadata.labels:
-                if node.metadata.labels[self.node_group_label] == 'true' and node.metadata.name in cluster_utilization:
-                    node_utilization = cluster_utilization[node.metadata.name]
-                    node_utilization["cpu_allocatable"] = convert_cpu(node.status.allocatable.get("cpu"))
-                    node_utilization["memory_allocatable"] = convert_memory(node.status.allocatable.get("memory"))
-                    node_utilization["cpu_available"] = node_utilization["cpu_allocatable"] - node_utilization["cpu_used"]
-                    node_utilization["memory_available"] = node_utilization["memory_allocatable"] - node_utilization[
-                        "memory_used"]
-                    node_utilization["cpu"] = (node_utilization["cpu_used"] / node_utilization["cpu_allocatable"]) * 100
-                    node_utilization["memory"] = (node_utilization["memory_used"] / node_utilization[
-                        "memory_allocatable"]) * 100
-                    node_group_utilization.append(node_utilization)
+        for node in self.cache.get_nodes_by_label(self.node_group_label):
+            node_utilization = snapshot.get_node_utilization(node.metadata.name)
+            if "node" in node_utilization:
+                node_group_utilization.append(node_utilization)
         return node_group_utilization
 
     def label_new_node(self, node_name):
@@ -244,22 +410,19 @@ class NodeGroup:
         logging.info(f"Node {node_name} labeled with {self.node_group_label}")
 
     def is_node_exist(self, node_name):
-        ret = self.v1.list_node()
-        for item in ret.items:
-            if item.metadata.name == node_name:
-                logging.info(f"Node {node_name} found in kubernetes cluster")
-                return True
+        if self.cache.get_node(node_name) is not None:
+            logging.info(f"Node {node_name} found in kubernetes cluster")
+            return True
         logging.info(f"Node {node_name} not found in kubernetes cluster")
         return False
 
     def is_node_ready(self, node_name):
-        try:
-            ret = self.v1.read_node_status(node_name)
-        except:
+        ret = self.cache.get_node(node_name)
+        if ret is None:
             logging.info(f"Node {node_name} not exist in kubernetes cluster")
             return False
 
-        for status in ret.status.conditions:
+        for status in ret.status.conditions or []:
             if status.type == "Ready" and status.status == "True":
                 logging.info(f"{node_name} is Ready")
                 return True
@@ -267,54 +430,21 @@ class NodeGroup:
         return False
 
     def is_node_running_pods(self, node_name):
-        field_selector = f'spec.nodeName={node_name}'
-        ret = self.v1.list_pod_for_all_namespaces(field_selector=field_selector)
-        for pod in ret.items:
-            if "DaemonSet" not in pod.metadata.owner_references[0].kind:
-                #logging.info(f'Node {node_name} running pods')
-                return True
-        return False
+        return node_running_pods(self.cache.get_pods_by_node(node_name))
 
-    def get_node_utilization_by_pods(self, node):
-        pods_utilization = []
-        field_selector = f'spec.nodeName={node}'
-        ret = self.v1.list_pod_for_all_namespaces(field_selector=field_selector)
-        for pod in ret.items:
-            if "DaemonSet" not in pod.metadata.owner_references[0].kind:
-                pods_utilization.append(self.get_pod_utilization(pod.metadata.name, pod.metadata.namespace))
-        return pods_utilization
-
-    def get_pod_utilization(self, pod, namespace):
-        req = client.ApiClient()
-        try:
-            response = req.call_api(resource_path=f"/apis/metrics.k8s.io/v1beta1/namespaces/{namespace}/pods/{pod}",
-                                    method='GET',
-                                    auth_settings=['BearerToken'],
-                                    response_type='json',
-                                    _preload_content=False)
-        except Exception as e:
-            logging.error("Cannot get metrics for pod {pod.}")
-            logging.error(e)
-            return None
-        response = json.loads(response[0].data.decode('utf-8'))
-
-        cpu, memory = 0, 0
-        for container in response['containers']:
-            cpu += convert_cpu(container["usage"]["cpu"])
-            memory += convert_memory(container["usage"]["memory"])
-        return {"pod": pod, "cpu": cpu, "memory": memory}
-
-    def select_node_for_remove(self):
+    @tracing.traced
+    def select_node_for_remove(self, snapshot=None):
         empty_nodes = []
         node_min_cpu, node_min_mem, node_min_all = "", "", ""
         util_cpu, util_mem, util_all = 100, 100, 200
 
         # TODO: pod disruption logic
+        snapshot = snapshot or self.get_utilization_snapshot()
         nodes = self.nodes
         for node in nodes:
-            if not self.is_node_running_pods(node):
+            if not snapshot.is_node_running_pods(node):
                 empty_nodes.append(node)
-            util = self.get_node_utilization(node)
+            util = self.smooth_utilization(snapshot.get_node_utilization(node))
             node_util = util["cpu"] + util["memory"]
             if util["cpu"] <= util_cpu:
                 util_cpu = util["cpu"]
@@ -333,6 +463,7 @@ class NodeGroup:
         else:
             return node_min_cpu
 
+    @tracing.traced
     def cordon_node(self, node_name):
         body = {
             "spec": {
@@ -347,32 +478,26 @@ class NodeGroup:
             logging.error(f"Unscheduling node {node_name} failed")
             return False
 
-    def drain_node(self, node_name):
-        pods_to_evict = []
-
-        field_selector = 'spec.nodeName=' + node_name
-        ret = self.v1.list_pod_for_all_namespaces(field_selector=field_selector)
-        for pod in ret.items:
-            if "DaemonSet" in pod.metadata.owner_references[0].kind:
-                logging.info(f'Ignoring pod {pod.metadata.name} eviction cause DaemonSet')
-            else:
-                logging.warning(f'Pod {pod.metadata.name} will be evicted')
-                pods_to_evict.append(pod)
-
-        for pod in pods_to_evict:
-            try:
-                body = client.V1Eviction(metadata=client.V1ObjectMeta(name=pod.metadata.name,
-                                                                      namespace=pod.metadata.namespace))
-                self.v1.create_namespaced_pod_eviction(name=pod.metadata.name,
-                                                       namespace=pod.metadata.namespace,
-                                                       body=body)
-            except Exception as ex:
-                logging.warning(f'Pod {pod.metadata.name} eviction failed due {ex}')
-                logging.error(f"Cannot drain node {node_name}")
-                return False
-        logging.warning(f"Node {node_name} drained")
-        return True
+    @tracing.traced
+    def uncordon_node(self, node_name):
+        body = {
+            "spec": {
+                "unschedulable": False
+            }
+        }
+        try:
+            self.v1.patch_node(node_name, body)
+            logging.warning(f"Node {node_name} uncordoned")
+            return True
+        except Exception as ex:
+            logging.error(f"Uncordoning node {node_name} failed due {ex}")
+            return False
+
+    @tracing.traced
+    def drain_node(self, node_name, deadline=None, cancelled=None, wait=True):
+        return self.drainer.drain(node_name, deadline=deadline, cancelled=cancelled, wait=wait)
 
+    @tracing.traced
     def delete_node(self, node_name):
         try:
             self.v1.delete_node(node_name)
@@ -383,31 +508,189 @@ class NodeGroup:
             return False
 
 
+class UtilizationSnapshot:
+    """
+    Nodes utilization fetched once from metrics.k8s.io, nodes and their pods are taken from informer cache
+    """
+    def __init__(self, cache, api_client):
+        self.cache = cache
+        self.nodes_usage = {}
+
+        for node in get_metrics(api_client, "/apis/metrics.k8s.io/v1beta1/nodes")["items"]:
+            self.nodes_usage[node["metadata"]["name"]] = (convert_cpu(node["usage"].get("cpu")),
+                                                          convert_memory(node["usage"].get("memory")))
+
+    def get_node_utilization(self, node_name):
+        node = self.cache.get_node(node_name)
+        if node is None or node_name not in self.nodes_usage:
+            logging.error(f"Cannot get utilization from node {node_name}. Ignoring...")
+            return {"cpu": 99, "memory": 99}
+
+        node_utilization = {"node": node_name}
+        node_utilization["cpu_used"], node_utilization["memory_used"] = self.nodes_usage[node_name]
+        node_utilization["cpu_allocatable"] = convert_cpu(node.status.allocatable.get("cpu"))
+        node_utilization["memory_allocatable"] = convert_memory(node.status.allocatable.get("memory"))
+        node_utilization["cpu_available"] = node_utilization["cpu_allocatable"] - node_utilization["cpu_used"]
+        node_utilization["memory_available"] = node_utilization["memory_allocatable"] - node_utilization["memory_used"]
+        node_utilization["cpu"] = (node_utilization["cpu_used"] / node_utilization["cpu_allocatable"]) * 100
+        node_utilization["memory"] = (node_utilization["memory_used"] / node_utilization["memory_allocatable"]) * 100
+        return node_utilization
+
+    def get_node_pods(self, node_name):
+        return self.cache.get_pods_by_node(node_name)
+
+    def is_node_running_pods(self, node_name):
+        return node_running_pods(self.get_node_pods(node_name))
+
+
+class UtilizationCache:
+    """
+    Keeps one utilization snapshot shared by all node groups until the next tick
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def get(self, cache, api_client):
+        with self.lock:
+            if self.snapshot is None:
+                self.snapshot = UtilizationSnapshot(cache, api_client)
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+
+utilization = UtilizationCache()
+
+
+def create_node_groups(groups=None):
+    """
+    Return node groups of node_groups setting or one node group made of single group settings.
+    Groups are given as dicts with keys name, label, template, vm_name (required), min_size, max_size,
+    cpu (cores), memory (GB or quantity like 16Gi), ip_pool, ip_leases_file, warm_pool_size, warm_pool_vm_name
+    """
+    groups = node_groups if groups is None else groups
+    if not groups:
+        return [NodeGroup(node_group_label, min_size, max_size)]
+
+    result = []
+    for group in groups:
+        name = group["name"]
+        ip_pool = group.get("ip_pool", pxe_autoscaled_node_ip_pool)
+        default_leases_file = pxe_ip_leases_file if ip_pool == pxe_autoscaled_node_ip_pool \
+            else os.path.join(os.path.dirname(pxe_ip_leases_file), f"{name}-{os.path.basename(pxe_ip_leases_file)}")
+        memory = group.get("memory", 4)
+        if isinstance(memory, str):
+            memory = convert_memory(memory) / 1024
+        result.append(NodeGroup(group["label"],
+                                group.get("min_size", 0),
+                                group.get("max_size", max_size),
+                                node_cpu=group.get("cpu", 4),
+                                node_memory=memory,
+                                name=name,
+                                template_vm=group["template"],
+                                vm_name=group["vm_name"],
+                                ip_pool=ip_pool,
+                                ip_leases_file=group.get("ip_leases_file", default_leases_file),
+                                warm_pool_size=group.get("warm_pool_size", 0),
+                                warm_pool_vm_name=group.get("warm_pool_vm_name", f"{pxe_warm_pool_vm_name}.{name}")))
+        logging.info(f"Node group {name} ({group['label']}): {group.get('min_size', 0)}-{result[-1].max_size} "
+                     f"nodes of {result[-1].capacity_cpu} cpu, {result[-1].capacity_mem}MB memory")
+    return result
+
+
+@tracing.traced
+def get_metrics(api_client, resource_path):
+    try:
+        response = api_client.call_api(resource_path=resource_path,
+                                       method='GET',
+                                       auth_settings=['BearerToken'],
+                                       response_type='json',
+                                       _preload_content=False)
+    except Exception as e:
+        logging.error(e)
+        logging.error(f"Cannot get metrics {resource_path}. Metrics not available")
+        raise Exception(e)
+    return json.loads(response[0].data.decode('utf-8'))
+
+
+def node_running_pods(pods):
+    for pod in pods:
+        if not is_daemonset_pod(pod) and not is_pod_terminated(pod):
+            return True
+    return False
+
+
+def is_pod_insufficient_resources(pod):
+    for status in pod.status.conditions or []:
+        if status.reason == "Unschedulable" and status.message:
+            if "Insufficient cpu" in status.message or "Insufficient memory" in status.message:
+                return True
+    return False
+
+
+def is_daemonset_pod(pod):
+    for owner in pod.metadata.owner_references or []:
+        if owner.kind == "DaemonSet":
+            return True
+    return False
+
+
+def is_mirror_pod(pod):
+    return "kubernetes.io/config.mirror" in (pod.metadata.annotations or {})
+
+
+def is_pod_terminated(pod):
+    return pod.status is not None and pod.status.phase in ("Succeeded", "Failed")
+
+
+def get_pod_requests(pod):
+    """
+    Return pod requests (cpu in milicores, memory in MB) as scheduler counts them
+    """
+    cpu, memory = 0, 0
+    for container in pod.spec.containers:
+        requests = (container.resources and container.resources.requests) or {}
+        cpu += convert_cpu(requests["cpu"]) if "cpu" in requests else 0
+        memory += convert_memory(requests["memory"]) if "memory" in requests else 0
+
+    for container in pod.spec.init_containers or []:
+        requests = (container.resources and container.resources.requests) or {}
+        cpu = max(cpu, convert_cpu(requests["cpu"]) if "cpu" in requests else 0)
+        memory = max(memory, convert_memory(requests["memory"]) if "memory" in requests else 0)
+    return cpu, memory
+
+
+def split_daemon_requests(pods):
+    """
+    Return requests (cpu, memory) of DaemonSet and mirror pods, which run on every node,
+    and [(name, cpu, memory), ...] of other not terminated pods
+    """
+    daemon_cpu, daemon_memory = 0, 0
+    others = []
+    for pod in pods:
+        if is_pod_terminated(pod):
+            continue
+        cpu, memory = get_pod_requests(pod)
+        if is_daemonset_pod(pod) or is_mirror_pod(pod):
+            daemon_cpu += cpu
+            daemon_memory += memory
+        else:
+            others.append((pod.metadata.name, cpu, memory))
+    return (daemon_cpu, daemon_memory), others
+
+
 def convert_cpu(value):
     """
-    Return CPU in milicores if it is configured with value
+    Return CPU in milicores
     """
-    if re.match(r"[0-9]{1,9}m", str(value)):
-        cpu = re.sub("[^0-9]", "", value)
-    elif re.match(r"[0-9]{1,4}$", str(value)):
-        cpu = int(value) * 1000
-    elif re.match(r"[0-9]{1,15}n", str(value)):
-        cpu = int(re.sub("[^0-9]", "", value)) // 1000000
-    elif re.match(r"[0-9]{1,15}u", str(value)):
-        cpu = int(re.sub("[^0-9]", "", value)) // 1000
-    return int(cpu)
+    return quantity.cpu_millicores(value)
 
 
 def convert_memory(value):
     """
-    Return Memory in MB
+    Return Memory in MB (MiB)
     """
-    if re.match(r"[0-9]{1,9}Mi?", str(value)):
-        mem = re.sub("[^0-9]", "", value)
-    elif re.match(r"[0-9]{1,9}Ki?", str(value)):
-        mem = re.sub("[^0-9]", "", value)
-        mem = int(mem) // 1024
-    elif re.match(r"[0-9]{1,9}Gi?", str(value)):
-        mem = re.sub("[^0-9]", "", value)
-        mem = int(mem) * 1024
-    return int(mem)
+    return quantity.memory_mebibytes(value)
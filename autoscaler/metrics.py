@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+
+
+class Metric:
+    """
+    Metric with values by labels, exposed in Prometheus text format
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key)) + list(extra or [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.expose_value(key, value))
+        return lines
+
+    def expose_value(self, key, value):
+        return [f"{self.name}{self.format_labels(key)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # not cumulative counts by bucket (last is +Inf) and sum, cumulated on exposition
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def expose_value(self, key, value):
+        lines = []
+        count = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), value):
+            count += bucket_count
+            lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', bound)])} {count}")
+        lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        lines.append(f"{self.name}_sum{self.format_labels(key)} {value[-1]}")
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def observe_timings(histogram, timings):
+    """
+    Observe phases durations of polling.timed timings dict
+    """
+    for phase, duration in timings.items():
+        histogram.observe(duration, phase=phase)
+
+
+def expose():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, address=""):
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logging.info(f"Metrics endpoint started on port {port}")
+    return server
+
+
+registry = []
+
+scale_up_phase_seconds = Histogram("autoscaler_scale_up_phase_seconds",
+                                   "Duration of node provisioning phases", ["phase"])
+scale_down_phase_seconds = Histogram("autoscaler_scale_down_phase_seconds",
+                                     "Duration of node removing phases", ["phase"])
+scaled_nodes_total = Counter("autoscaler_scaled_nodes_total",
+                             "Nodes provisioned and removed by result", ["kind", "result"])
+tick_seconds = Histogram("autoscaler_tick_seconds", "Duration of watcher decision loop tick")
+reaction_seconds = Histogram("autoscaler_unschedulable_reaction_seconds",
+                             "Time between pod became unschedulable and its evaluation")
+kubernetes_api_calls_total = Counter("autoscaler_kubernetes_api_calls_total",
+                                     "Kubernetes api calls", ["method", "endpoint"])
+kubernetes_api_call_seconds = Histogram("autoscaler_kubernetes_api_call_seconds",
+                                        "Kubernetes api calls latency", ["method", "endpoint"])
+proxmox_api_calls_total = Counter("autoscaler_proxmox_api_calls_total",
+                                  "Proxmox api calls", ["method", "endpoint"])
+proxmox_api_call_seconds = Histogram("autoscaler_proxmox_api_call_seconds",
+                                     "Proxmox api calls latency", ["method", "endpoint"])
+node_group_size = Gauge("autoscaler_node_group_size",
+                        "Node group size: current (ready), upcoming (provisioning), min and max", ["group", "state"])
+node_group_requests_forecast = Gauge("autoscaler_node_group_requests_forecast",
+                                     "Pods requests of node group forecast forecast_lead_time ahead "
+                                     "(cpu milicores, memory MB)", ["group", "resource"])
+pending_pods = Gauge("autoscaler_pending_pods", "Pods unschedulable due insufficient resources")
+scaler_state = Gauge("autoscaler_state", "Scaler flags and timers of node group (1 - set or running)",
+                     ["group", "state"])
+lost_vms = Gauge("autoscaler_lost_vms", "Lost vms of node group waiting for clean up", ["group"])
@@ -0,0 +1,166 @@
+from autoscaler import tracing
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import threading
+import time
+
+
+class Operation:
+    """
+    Scale operation running in background: kind (scale_up, scale_down), nodes count, phase and deadline.
+    Deadline is set when operation starts running, so time queued behind other operations is not counted.
+    Every item (e.g. node being provisioned) gets its own deadline of item_timeout when worker starts it
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, kind, count, timeout, target=None, item_timeout=None):
+        self.id = next(Operation.ids)
+        self.kind = kind
+        self.count = count
+        self.target = target
+        self.phase = "pending"
+        self.phases = {}
+        self.items = {}  # item -> details (e.g. ip and vm name of node being provisioned)
+        self.finished_items = 0
+        self.timeout = timeout
+        self.item_timeout = item_timeout or timeout
+        self.started = None
+        self.deadline = None
+        self.cancelled = threading.Event()
+        self.result = None
+        self.future = None
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def __str__(self):
+        target = f" {self.target}" if self.target else ""
+        return f"{self.kind}#{self.id}{target}"
+
+    def set_phase(self, phase, item=None):
+        """
+        Set phase of whole operation or of one of its items (e.g. node being provisioned)
+        """
+        with self.lock:
+            if item is None:
+                self.phase = phase
+            else:
+                self.phases[item] = phase
+        logging.info(f"Operation {self}{' ' + str(item) if item else ''} phase: {phase}")
+        self.changed()
+
+    def start(self):
+        self.started = time.time()
+        self.deadline = self.started + self.timeout
+
+    def item_deadline(self):
+        """
+        Return deadline of item started now: item_timeout from now, but not later than operation deadline
+        """
+        return min(time.time() + self.item_timeout, self.deadline)
+
+    def set_item(self, item, **details):
+        with self.lock:
+            self.items.setdefault(item, {}).update(details)
+        self.changed()
+
+    def finish_item(self, item=None):
+        with self.lock:
+            self.finished_items += 1
+            self.phases.pop(item, None)
+            self.items.pop(item, None)
+        self.changed()
+
+    def changed(self):
+        if self.listener is not None:
+            self.listener()
+
+    def vmnames(self):
+        with self.lock:
+            return [details["vmname"] for details in self.items.values() if details.get("vmname")]
+
+    def get_state(self):
+        """
+        Return operation with its items in progress for checkpoint
+        """
+        with self.lock:
+            items = [dict(details, item=item, phase=self.phases.get(item)) for item, details in self.items.items()]
+        return {"kind": self.kind, "count": self.count, "target": self.target, "phase": self.phase,
+                "deadline": self.deadline or time.time() + self.timeout, "items": items}
+
+    def is_done(self):
+        return self.future is not None and self.future.done()
+
+    def is_expired(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def remaining(self):
+        return max(self.count - self.finished_items, 0)
+
+
+class OperationRegistry:
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="operation")
+        self.lock = threading.Lock()
+        self.operations = []
+        self.on_change = None  # called on every change of operations (e.g. to checkpoint them)
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def submit(self, kind, func, count=1, timeout=900, target=None, item_timeout=None):
+        """
+        Run func(operation) in background and track it until it finishes
+        """
+        operation = Operation(kind, count, timeout, target, item_timeout)
+        operation.listener = self.changed
+        with self.lock:
+            self.operations.append(operation)
+        operation.future = self.executor.submit(self.__run, operation, func)
+        logging.info(f"Operation {operation} submitted")
+        return operation
+
+    def __run(self, operation, func):
+        operation.start()
+        operation.set_phase("running")
+        try:
+            with tracing.record("operation", operation=str(operation)):
+                operation.result = func(operation)
+            operation.set_phase("done")
+        except Exception as ex:
+            logging.error(f"Operation {operation} failed due {ex}")
+            operation.set_phase("failed")
+        finally:
+            with self.lock:
+                self.operations.remove(operation)
+            self.changed()
+        return operation.result
+
+    def in_flight(self, kind=None):
+        with self.lock:
+            return [operation for operation in self.operations if kind is None or operation.kind == kind]
+
+    def upcoming_nodes(self):
+        return sum(operation.remaining() for operation in self.in_flight("scale_up"))
+
+    def targets(self):
+        """
+        Return nodes and vms operations work on
+        """
+        targets = []
+        for operation in self.in_flight():
+            if operation.target:
+                targets.append(operation.target)
+            targets.extend(operation.vmnames())
+        return targets
+
+    @tracing.traced
+    def check_deadlines(self):
+        """
+        Cancel operations running longer than their deadline
+        """
+        for operation in self.in_flight():
+            if operation.is_expired() and not operation.cancelled.is_set():
+                logging.error(f"Operation {operation} exceeded its deadline in phase {operation.phase}. Cancelling")
+                operation.cancelled.set()
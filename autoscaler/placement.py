@@ -0,0 +1,84 @@
+from autoscaler.settings import *
+import logging
+import threading
+
+
+class Placement:
+    """
+    Selects Proxmox host for new vm by free memory, cpu load, running vms and storage headroom.
+    Policy spread prefers the least loaded host, pack prefers the most loaded host which still fits vm
+    """
+    def __init__(self, policy=pxe_placement_policy, storage=pxe_clone_storage):
+        self.policy = policy
+        self.storage = storage
+        self.lock = threading.Lock()
+        self.pending = {}  # vmid -> (host, memory bytes) of vms being created
+
+    def reserve(self, snapshot, vmid, memory, hosts=None):
+        """
+        Return host (of hosts if given) for vm with memory (bytes) and count it as allocated until release
+        """
+        with self.lock:
+            scores = self.score(snapshot, memory, hosts)
+            if not scores:
+                raise Exception("Cannot find Proxmox host with enough resources for new vm")
+            host = max(scores, key=scores.get)
+            self.pending[vmid] = (host, memory)
+            logging.info(f"Proxmox host {host} selected by {self.policy} placement ("
+                         + ", ".join(f"{name}: {score:.2f}" for name, score in sorted(scores.items())) + ")")
+            return host
+
+    def release(self, vmid):
+        with self.lock:
+            self.pending.pop(vmid, None)
+
+    def score(self, snapshot, memory, hosts=None):
+        pending_memory, pending_vms = {}, {}
+        for host, vm_memory in self.pending.values():
+            pending_memory[host] = pending_memory.get(host, 0) + vm_memory
+            pending_vms[host] = pending_vms.get(host, 0) + 1
+
+        running_vms = {}
+        for vm in snapshot.vms:
+            if vm.get("status") == "running":
+                running_vms[vm["node"]] = running_vms.get(vm["node"], 0) + 1
+        max_vms = max(list(running_vms.values()) + [1])
+
+        scores = {}
+        for node in snapshot.nodes:
+            host = node["node"]
+            if node.get("status") != "online" or not node.get("maxmem"):
+                continue
+            if hosts is not None and host not in hosts:
+                continue
+            memory_free = node["maxmem"] - node.get("mem", 0) - pending_memory.get(host, 0)
+            if memory_free < memory:
+                continue
+            storage_free = self.storage_free(snapshot, host)
+            if storage_free is not None and storage_free <= 0:
+                continue
+
+            memory_free_share = memory_free / node["maxmem"]
+            cpu_free_share = 1 - min(node.get("cpu", 0), 1)
+            vms_share = (running_vms.get(host, 0) + pending_vms.get(host, 0)) / max_vms
+            storage_share = storage_free if storage_free is not None else 1
+            score = memory_free_share + cpu_free_share + storage_share - vms_share / 2
+            scores[host] = score if self.policy == 'spread' else -score
+        return scores
+
+    def storage_free(self, snapshot, host):
+        """
+        Return free share of clone storage (or best images storage) of host, None if unknown
+        """
+        shares = []
+        for storage in snapshot.storages:
+            if storage.get("node") != host or not storage.get("maxdisk"):
+                continue
+            if self.storage and storage.get("storage") != self.storage:
+                continue
+            if not self.storage and "images" not in storage.get("content", "images"):
+                continue
+            shares.append((storage["maxdisk"] - storage.get("disk", 0)) / storage["maxdisk"])
+        if not shares:
+            return None
+        return max(shares)
@@ -0,0 +1,77 @@
+from autoscaler.settings import *
+from contextlib import contextmanager
+import logging
+import time
+
+
+class PollError(Exception):
+    pass
+
+
+class PollTimeout(PollError):
+    pass
+
+
+class PollCancelled(PollError):
+    pass
+
+
+@contextmanager
+def timed(phase, timings=None):
+    """
+    Record duration of phase (secs) to timings dict
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0) + duration
+        logging.debug(f"Phase {phase} took {duration:.2f} secs")
+
+
+def wait_until(condition, phase, deadline=None, cancelled=None, timings=None, ignore_errors=False,
+               initial_interval=None, max_interval=None, factor=1.5):
+    """
+    Poll condition() until it returns truthy value and return it.
+    Interval grows from initial_interval to max_interval. Raises PollTimeout after deadline (time.time() based)
+    and PollCancelled when cancelled event is set
+    """
+    interval = initial_interval or poll_initial_interval
+    max_interval = max_interval or poll_max_interval
+    attempts = 0
+
+    with timed(phase, timings):
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise PollCancelled(f"Waiting for {phase} cancelled")
+
+            attempts += 1
+            try:
+                result = condition()
+            except PollError:
+                raise
+            except Exception as ex:
+                if not ignore_errors:
+                    raise
+                logging.debug(f"Waiting for {phase}: {ex}")
+                result = None
+            if result:
+                logging.debug(f"Phase {phase} done after {attempts} checks")
+                return result
+
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PollTimeout(f"Waiting for {phase} timed out after {attempts} checks")
+                interval = min(interval, remaining)
+            if cancelled is not None:
+                cancelled.wait(interval)
+            else:
+                time.sleep(interval)
+            interval = min(interval * factor, max_interval)
+
+
+def format_timings(timings):
+    return ", ".join(f"{phase} {duration:.1f}s" for phase, duration in timings.items())
@@ -0,0 +1,147 @@
+from datetime import datetime, timezone
+import sys
+
+
+class Fields:
+    """
+    Trimmed copy of kubernetes api object part keeping only fields autoscaler reads,
+    under the same attribute names as kubernetes client models
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+
+class Metadata(Fields):
+    __slots__ = ("name", "namespace", "uid", "resource_version", "labels", "annotations", "owner_references")
+
+
+class OwnerReference(Fields):
+    __slots__ = ("kind", "name")
+
+
+class Condition(Fields):
+    __slots__ = ("type", "status", "reason", "message", "last_transition_time")
+
+
+class Resources(Fields):
+    __slots__ = ("requests",)
+
+
+class Container(Fields):
+    __slots__ = ("resources",)
+
+
+class PodSpec(Fields):
+    __slots__ = ("node_name", "containers", "init_containers")
+
+
+class PodStatus(Fields):
+    __slots__ = ("phase", "conditions")
+
+
+class NodeSpec(Fields):
+    __slots__ = ("unschedulable",)
+
+
+class NodeAddress(Fields):
+    __slots__ = ("type", "address")
+
+
+class NodeStatus(Fields):
+    __slots__ = ("capacity", "allocatable", "conditions", "addresses")
+
+
+class Object(Fields):
+    __slots__ = ("metadata", "spec", "status")
+
+
+MIRROR_ANNOTATION = "kubernetes.io/config.mirror"
+NO_REQUESTS = Resources(requests={})
+
+
+def intern(value):
+    """
+    Share equal strings (phases, quantities, label values) between objects
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_dict(values):
+    if not values:
+        return None
+    return {intern(key): intern(value) for key, value in values.items()}
+
+
+def parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def project_condition(condition):
+    return Condition(type=intern(condition.get("type")),
+                     status=intern(condition.get("status")),
+                     reason=intern(condition.get("reason")),
+                     message=condition.get("message"),
+                     last_transition_time=parse_time(condition.get("lastTransitionTime")))
+
+
+def project_metadata(metadata, keep_labels=False):
+    annotations = metadata.get("annotations") or {}
+    owners = [OwnerReference(kind=intern(owner.get("kind")), name=owner.get("name"))
+              for owner in metadata.get("ownerReferences") or []]
+    return Metadata(name=metadata.get("name"),
+                    namespace=intern(metadata.get("namespace")),
+                    uid=metadata.get("uid"),
+                    resource_version=metadata.get("resourceVersion"),
+                    labels=intern_dict(metadata.get("labels")) if keep_labels else None,
+                    annotations={MIRROR_ANNOTATION: annotations[MIRROR_ANNOTATION]}
+                    if MIRROR_ANNOTATION in annotations else None,
+                    owner_references=owners or None)
+
+
+def project_container(container):
+    requests = (container.get("resources") or {}).get("requests")
+    if not requests:
+        return Container(resources=NO_REQUESTS)
+    return Container(resources=Resources(requests=intern_dict(requests)))
+
+
+def project_pod(pod):
+    """
+    Return pod json (dict) trimmed to name, namespace, uid, owner kinds, mirror annotation, node name,
+    phase, PodScheduled condition and containers requests
+    """
+    spec, status = pod.get("spec") or {}, pod.get("status") or {}
+    conditions = [project_condition(condition) for condition in status.get("conditions") or []
+                  if condition.get("type") == "PodScheduled"]
+    return Object(metadata=project_metadata(pod.get("metadata") or {}),
+                  spec=PodSpec(node_name=spec.get("nodeName"),
+                               containers=[project_container(container)
+                                           for container in spec.get("containers") or []],
+                               init_containers=[project_container(container)
+                                                for container in spec.get("initContainers") or []] or None),
+                  status=PodStatus(phase=intern(status.get("phase")), conditions=conditions or None))
+
+
+def project_node(node):
+    """
+    Return node json (dict) trimmed to name, labels, unschedulable flag, capacity, allocatable,
+    conditions and addresses
+    """
+    spec, status = node.get("spec") or {}, node.get("status") or {}
+    return Object(metadata=project_metadata(node.get("metadata") or {}, keep_labels=True),
+                  spec=NodeSpec(unschedulable=spec.get("unschedulable")),
+                  status=NodeStatus(capacity=intern_dict(status.get("capacity")),
+                                    allocatable=intern_dict(status.get("allocatable")),
+                                    conditions=[project_condition(condition)
+                                                for condition in status.get("conditions") or []],
+                                    addresses=[NodeAddress(type=intern(address.get("type")),
+                                                           address=address.get("address"))
+                                               for address in status.get("addresses") or []]))
@@ -0,0 +1,85 @@
+from autoscaler import metrics
+from autoscaler import tracing
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+
+API_METHODS = ('get', 'post', 'put', 'delete', 'create', 'set')
+PARAMETRIZED_PATHS = ('nodes', 'qemu', 'lxc', 'tasks', 'storage')
+
+
+class CallCounter:
+    """
+    Counts Proxmox api calls in total by endpoint and per running operation
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.by_endpoint = {}
+        self.local = threading.local()
+
+    def record(self, method, endpoint, duration):
+        key = f"{method.upper()} {endpoint}"
+        metrics.proxmox_api_calls_total.inc(method=method.upper(), endpoint=endpoint)
+        metrics.proxmox_api_call_seconds.observe(duration, method=method.upper(), endpoint=endpoint)
+        with self.lock:
+            self.total += 1
+            self.by_endpoint[key] = self.by_endpoint.get(key, 0) + 1
+        for operation in getattr(self.local, "operations", []):
+            operation["calls"] += 1
+
+    @contextmanager
+    def operation(self, name):
+        if not hasattr(self.local, "operations"):
+            self.local.operations = []
+        operation = {"name": name, "calls": 0}
+        self.local.operations.append(operation)
+        start = time.monotonic()
+        try:
+            yield operation
+        finally:
+            self.local.operations.remove(operation)
+            logging.info(f"Proxmox operation {name} made {operation['calls']} api calls "
+                         f"in {time.monotonic() - start:.2f} secs")
+
+
+class CountedResource:
+    """
+    Wraps proxmoxer resource and records every api call in CallCounter
+    """
+    def __init__(self, resource, counter, path=()):
+        self._resource = resource
+        self._counter = counter
+        self._path = path
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+        attr = getattr(self._resource, item)
+        if item in API_METHODS:
+            return self.__counted(item, attr)
+        return CountedResource(attr, self._counter, self._path + (item,))
+
+    def __call__(self, *args):
+        path = self._path
+        for arg in args:
+            if path and path[-1] in PARAMETRIZED_PATHS:
+                path = path + ('{}',)
+            else:
+                path = path + (str(arg),)
+        return CountedResource(self._resource(*args), self._counter, path)
+
+    def __counted(self, method, func):
+        endpoint = "/" + "/".join(self._path)
+        span_name = f"proxmox {method.upper()} {endpoint}"
+
+        def call(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                with tracing.span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                self._counter.record(method, endpoint, time.monotonic() - start)
+        return call
@@ -1,83 +1,195 @@
 from autoscaler.settings import *
+from autoscaler.inventory import Inventory, VmidAllocator
+from autoscaler.placement import Placement
+from autoscaler.proxmox_api import CallCounter, CountedResource
+from autoscaler.polling import timed, wait_until, PollError, PollTimeout
 from proxmoxer import ProxmoxAPI
 import urllib3
+import functools
 import logging
+import re
+import threading
 import time
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-proxmox = ProxmoxAPI(
-    pxe_host, user=pxe_user, password=pxe_password, verify_ssl=False
-)
+api_calls = CallCounter()
+proxmox = CountedResource(ProxmoxAPI(pxe_host, user=pxe_user, password=pxe_password, verify_ssl=False),
+                          api_calls)
+inventory = Inventory(proxmox)
+vmids = VmidAllocator(proxmox, inventory)
+placement = Placement()
 
+DISK_KEY = re.compile(r"^(ide|sata|scsi|virtio|efidisk|tpmstate)[0-9]+$")
 
-def get_scaled_vms():
-    scaled_vms = []
-    for node in proxmox.nodes.get():
-        for vm in proxmox.nodes(node["node"]).qemu.get():
-            if pxe_autoscaled_node_name in vm["name"]:
-                scaled_vms.append(vm)
-    return scaled_vms
+# names taken by vms which are being created now
+allocation_lock = threading.Lock()
+reserved_vmnames = set()
 
 
-def get_scaled_vms_ip():
+def find_vms(vm_name):
+    """
+    Return vms named vm_name-N (names of other node groups may start with vm_name)
+    """
+    prefix = vm_name + "-"
+    return [vm for vm in inventory.get().vms
+            if vm.get("name", "").startswith(prefix) and vm["name"][len(prefix):].isdigit()]
+
+
+def get_scaled_vms(vm_name=pxe_autoscaled_node_name):
+    return find_vms(vm_name)
+
+
+def get_scaled_vms_ip(skip_vmnames=(), vm_name=pxe_autoscaled_node_name):
+    """
+    Return ipv4 addresses of running scaled vms asking qemu agent once per vm on its host
+    """
     vm_ips = []
-    vms = get_scaled_vms()
-    for vm in vms:
-        for node in proxmox.nodes.get():
-            vm_network = proxmox.nodes(node["node"]).qemu(vm["vmid"]).agent('network-get-interfaces').get()
-            for interface in vm_network['result']:
-                for ip in (interface['ip-addresses']):
-                    if ip['ip-address-type'] == 'ipv4':
-                        vm_ips.append(ip['ip-address'])
+    for vm in get_scaled_vms(vm_name):
+        if vm["name"] in skip_vmnames or vm.get("status") != "running":
+            continue
+        try:
+            vm_network = proxmox.nodes(vm["node"]).qemu(vm["vmid"]).agent('network-get-interfaces').get()
+        except Exception as ex:
+            logging.info(f"Cannot get ip addresses of vm {vm['name']} due {ex}")
+            continue
+        for interface in vm_network['result']:
+            for ip in interface.get('ip-addresses', []):
+                if ip['ip-address-type'] == 'ipv4':
+                    vm_ips.append(ip['ip-address'])
     return vm_ips
 
 
-def get_template_vmid():
-    for node in proxmox.nodes.get():
-        for vm in proxmox.nodes(node["node"]).qemu.get():
-            if pxe_autoscaled_node_template_vm in vm["name"]:
-                return vm["vmid"]
-    raise Exception("Cannot find template vm with name " + pxe_autoscaled_node_template_vm)
+def get_vm_ip(node, vmid):
+    """
+    Return ip address of cloud-init network config of vm, None for dhcp or not configured vm
+    """
+    ip_config = proxmox.nodes(node).qemu(vmid).config.get().get("ipconfig0", "")
+    for part in ip_config.split(","):
+        if part.startswith("ip=") and part != "ip=dhcp":
+            return part[3:].split("/")[0]
+    return None
 
 
-def get_free_vmid():
-    free_vmid = 100
-    busy_vmids = []
-    for node in proxmox.nodes.get():
-        for vm in proxmox.nodes(node["node"]).qemu.get():
-            busy_vmids.append(vm["vmid"])
-    while free_vmid in busy_vmids:
-        free_vmid += 1
-    return free_vmid
+def get_template_vmid(template_vm=pxe_autoscaled_node_template_vm):
+    snapshot = inventory.get()
+    if template_vm in snapshot.by_name:
+        return snapshot.by_name[template_vm]["vmid"]
+    for vm in snapshot.find_by_name_part(template_vm):
+        return vm["vmid"]
+    raise Exception("Cannot find template vm with name " + template_vm)
+
+
+def get_node_for_vm_allocation(vmid, template, hosts=None):
+    snapshot = inventory.get()
+    memory = snapshot.by_vmid.get(template, {}).get("maxmem", 0)
+    return placement.reserve(snapshot, vmid, memory, hosts)
+
+
+@functools.lru_cache(maxsize=32)
+def get_vm_storages(node, vmid):
+    """
+    Return storages of vm disks (cdroms except cloud-init drive are skipped)
+    """
+    config = proxmox.nodes(node).qemu(vmid).config.get()
+    storages = set()
+    for key, value in config.items():
+        value = str(value)
+        if not DISK_KEY.match(key) or ":" not in value:
+            continue
+        if "media=cdrom" in value and "cloudinit" not in value:
+            continue
+        storages.add(value.split(":", 1)[0])
+    return frozenset(storages)
+
+
+def is_on_shared_storage(vmid):
+    """
+    Return True if all disks of vm are on storages shared by hosts (Proxmox clones vm to other host
+    only then). Vm on local storage (e.g. local-lvm, local-zfs) is cloned on its own host
+    """
+    snapshot = inventory.get()
+    node = get_node_by_vmid(vmid)
+    shared = {storage["storage"] for storage in snapshot.storages
+              if storage.get("node") == node and storage.get("shared")}
+    storages = get_vm_storages(node, vmid)
+    return bool(storages) and storages <= shared
 
 
-def get_node_for_vm_allocation():
-    # TODO: node selection by usage
-    for node in proxmox.nodes.get():
-        return node["node"]
+def get_vm_by_vmname(vmname):
+    return inventory.get().by_name.get(vmname)
 
 
-def get_vm_by_vmname(vmname):
-    scaled_vms = get_scaled_vms()
-    for vm in scaled_vms:
-        if vm['name'] == vmname:
-            return vm
+def get_node_by_vmid(vmid):
+    node = inventory.get().node_by_vmid.get(vmid)
+    if node is None:
+        raise Exception("Cannot find vm with vmid " + str(vmid))
+    return node
+
+
+def get_vm_status(node, vmid):
+    return proxmox.nodes(node).qemu(vmid).status.current.get()['status']
+
+
+def get_task_status(node, upid):
+    task = proxmox.nodes(node).tasks(upid).status.get()
+    if task.get('status') == 'stopped':
+        return task
     return None
 
 
-def get_node_by_vmid(vmid):
-    for node in proxmox.nodes.get():
-        for vm in proxmox.nodes(node["node"]).qemu.get():
-            if vm["vmid"] == vmid:
-                return node["node"]
-    raise Exception("Cannot find vm with vmid " + vmid)
+def wait_task(node, upid, phase, deadline, cancelled=None, timings=None):
+    """
+    Wait Proxmox task by UPID to finish, raise exception if task failed
+    """
+    start = time.monotonic()
+    task = wait_until(lambda: get_task_status(node, upid), phase,
+                      deadline=deadline, cancelled=cancelled, timings=timings)
+    logging.info(f"Task {upid} finished with {task.get('exitstatus')} in {time.monotonic() - start:.1f} secs")
+    if task.get('exitstatus') != 'OK':
+        raise Exception(f"Task {upid} failed: {task.get('exitstatus')}")
+
+
+def shutdown_vm(vmname, node, vmid, cancelled=None, timings=None):
+    """
+    Shut vm down, stop it forcibly if it is not stopped in pxe_vm_shutdown_timeout
+    """
+    if get_vm_status(node, vmid) != "running":
+        return
+    logging.warning(f"Stopping vm {vmname} with vmid {vmid} on node {node}")
+    proxmox.nodes(node).qemu(vmid).status.shutdown.post(forceStop=1)
+
+    try:
+        wait_until(lambda: get_vm_status(node, vmid) != "running", "shutdown",
+                   deadline=time.time() + pxe_vm_shutdown_timeout, cancelled=cancelled, timings=timings)
+    except PollTimeout:
+        logging.warning(f"Vm {vmname} not stopped in {pxe_vm_shutdown_timeout} secs. Stopping forcibly")
+        proxmox.nodes(node).qemu(vmid).status.stop.post()
+        wait_until(lambda: get_vm_status(node, vmid) != "running", "stop",
+                   deadline=time.time() + pxe_vm_shutdown_timeout, cancelled=cancelled, timings=timings)
+    logging.warning(f"Stopped vm {vmname}")
+
+
+def remove_vm(vm, deadline=None, cancelled=None, timings=None):
+    """
+    Shut down and delete vm of inventory (needs only its name, vmid and host, no template lookup)
+    """
+    vmname, node, vmid = vm.get("name", ""), vm["node"], vm["vmid"]
+    with api_calls.operation(f"remove vm {vmname}"):
+        shutdown_vm(vmname, node, vmid, cancelled, timings)
+
+        logging.warning(f"Deleting vm {vmname} with vmid {vmid} from node {node}")
+        upid = proxmox.nodes(node).qemu(vmid).delete()
+        inventory.invalidate()
+        wait_task(node, upid, "delete task", deadline or time.time() + max_node_provision_time, cancelled, timings)
 
 
 class ProxmoxServer:
-    def __init__(self, cpu, memory, ip_address_cidr):
-        self.scaled_vms = get_scaled_vms()
+    def __init__(self, cpu, memory, ip_address_cidr, deadline=None, cancelled=None,
+                 template_vm=pxe_autoscaled_node_template_vm, vm_name=pxe_autoscaled_node_name):
+        self.vm_name_prefix = vm_name
+        self.scaled_vms = get_scaled_vms(vm_name)
 
         self.cpu, self.memory = cpu, memory
         self.__calculate_capacity()
@@ -92,38 +204,160 @@ class ProxmoxServer:
         self.name_server = pxe_autoscaled_node_dns_server
         self.cloud_init_ip_config = []
 
-        self.template = get_template_vmid()
-
-    def __generate_vmname(self):
-        vmname = pxe_autoscaled_node_name + "-1"
-        if self.scaled_vms:
-            vm_names = []
-            for vm in self.scaled_vms:
-                vm_names.append(vm["name"])
-            count = 1
-            while vmname in vm_names:
-                count += 1
-                vmname = pxe_autoscaled_node_name + "-" + str(count)
+        self.template = get_template_vmid(template_vm)
+
+        # provisioning deadline (time.time() based), cancellation event and phases durations
+        self.deadline = deadline or time.time() + max_node_provision_time
+        self.cancelled = cancelled
+        self.timings = {}
+        self.on_reserve = None  # called with vm when its name and vmid are reserved
+
+    def __generate_vmname(self, prefix):
+        vm_names = inventory.get().by_name
+        count = 1
+        vmname = prefix + "-1"
+        while vmname in vm_names or vmname in reserved_vmnames:
+            count += 1
+            vmname = prefix + "-" + str(count)
         return vmname
 
+    def __reserve(self, prefix=None, vmid=None):
+        self.vmid = vmid or vmids.allocate()
+        with allocation_lock:
+            self.vmname = self.__generate_vmname(prefix or self.vm_name_prefix)
+            reserved_vmnames.add(self.vmname)
+        if self.on_reserve is not None:
+            self.on_reserve(self)
+
     def __calculate_capacity(self):
         if self.scaled_vms:
-            self.cpu = self.scaled_vms[0]["cpus"]
+            self.cpu = self.scaled_vms[0]["maxcpu"]
             self.memory = round(self.scaled_vms[0]["maxmem"]/1024/1024)
 
     def create(self):
-        self.vmname = self.__generate_vmname()
-        self.vmid = get_free_vmid()
-        self.node = get_node_for_vm_allocation()
+        with api_calls.operation("create vm"):
+            with timed("allocation", self.timings):
+                self.__reserve()
+            self.__clone()
+
+            with timed("configure", self.timings):
+                self.__configure()
+            self.__start()
+
+    def create_standby(self, prefix=pxe_warm_pool_vm_name, boot=False):
+        """
+        Clone vm for warm pool and apply its cloud-init network config, boot it (without join) if boot is set
+        """
+        with api_calls.operation("create standby vm"):
+            self.__reserve(prefix=prefix)
+            self.__clone()
+            self.__configure()
+            if boot:
+                self.__start()
+                self.wait_os_running()
+
+    def take_standby(self, vm):
+        """
+        Rename warm pool vm to autoscaled node name. Booted vm gets node name as hostname and is left for join,
+        stopped vm is configured and started
+        """
+        with api_calls.operation("take standby vm"):
+            with timed("allocation", self.timings):
+                self.__reserve(vmid=vm["vmid"])
+            self.node = vm["node"]
+            logging.warning(f"Taking standby vm {vm['name']} as {self.vmname}")
+
+            if vm.get("status") == "running":
+                with timed("configure", self.timings):
+                    proxmox.nodes(self.node).qemu(self.vmid).config.post(name=self.vmname)
+                    # kubeadm join registers node under hostname set by cloud-init at first boot
+                    self.__exec(f"hostnamectl set-hostname {self.vmname}", "hostname")
+                inventory.invalidate()
+                return
+            with timed("configure", self.timings):
+                self.__configure(name=self.vmname)
+            inventory.invalidate()
+            self.__start()
+
+    def resume(self, vmname):
+        """
+        Attach to vm created before restart: wait its clone to finish, configure and start it if it is stopped
+        """
+        with api_calls.operation("resume vm"):
+            vm = get_vm_by_vmname(vmname)
+            if vm is None:
+                raise Exception(f"Cannot find vm {vmname}")
+            with allocation_lock:
+                self.vmname = vmname
+                reserved_vmnames.add(vmname)
+            self.vmid, self.node = vm["vmid"], vm["node"]
+            logging.warning(f"Resuming vm {vmname} with vmid {self.vmid} on node {self.node}")
+
+            self.__wait(lambda: "lock" not in proxmox.nodes(self.node).qemu(self.vmid).config.get(), "clone")
+            if self.get_status() == "stopped":
+                with timed("configure", self.timings):
+                    self.__configure()
+                self.__start()
+
+    def __clone(self):
+        template_node = get_node_by_vmid(self.template)
+        shared = is_on_shared_storage(self.template)
+        # template on local storage is cloned on its host, full clone is migrated to selected host then.
+        # Linked clone cannot leave host of template base disk
+        hosts = None if shared or pxe_clone_mode == 'full' else [template_node]
+        self.node = get_node_for_vm_allocation(self.vmid, self.template, hosts)
+        clone_node = self.node if shared else template_node
         logging.warning("Creating vm " + self.vmname
                         + " with vmid " + str(self.vmid)
                         + " from template " + str(self.template)
-                        + " on node " + self.node)
-
-        proxmox.nodes(self.node).qemu(self.template).clone.create(newid=self.vmid, name=self.vmname)
-
-        self.__configure()
-        self.__start()
+                        + " on node " + clone_node
+                        + " (" + pxe_clone_mode + " clone)")
+
+        with timed("clone", self.timings):
+            upid = self.__clone_task(template_node, clone_node)
+            inventory.invalidate()
+            self.wait_task(template_node, upid, "clone task")
+
+        if clone_node != self.node:
+            with timed("migrate", self.timings):
+                self.__migrate(clone_node)
+
+    def __clone_task(self, template_node, clone_node):
+        params = {"newid": self.vmid, "name": self.vmname}
+        if clone_node != template_node:
+            params["target"] = clone_node
+        if pxe_clone_snapshot:
+            params["snapname"] = pxe_clone_snapshot
+        full_params = dict(params, full=1)
+        if pxe_clone_storage:
+            full_params["storage"] = pxe_clone_storage
+
+        clone = proxmox.nodes(template_node).qemu(self.template).clone
+        if pxe_clone_mode == 'full':
+            return clone.create(**full_params)
+        try:
+            return clone.create(full=0, **params)
+        except Exception as ex:
+            if pxe_clone_mode == 'linked':
+                raise
+            logging.warning(f"Linked clone of template {self.template} not supported ({ex}). Making full clone")
+            return clone.create(**full_params)
+
+    def __migrate(self, source_node):
+        logging.warning(f"Migrating vm {self.vmname} with vmid {self.vmid} "
+                        f"from node {source_node} to node {self.node}")
+        upid = proxmox.nodes(source_node).qemu(self.vmid).migrate.post(target=self.node, **{'with-local-disks': 1})
+        inventory.invalidate()
+        self.wait_task(source_node, upid, "migrate task")
+
+    def wait_task(self, node, upid, phase):
+        wait_task(node, upid, phase, self.deadline, self.cancelled, self.timings)
+
+    def release(self):
+        with allocation_lock:
+            reserved_vmnames.discard(self.vmname)
+        vmids.release(self.vmid)
+        placement.release(self.vmid)
 
     def __start(self):
         logging.warning("Starting vm " + self.vmname
@@ -131,34 +365,27 @@ class ProxmoxServer:
                         + " on node " + self.node)
         proxmox.nodes(self.node).qemu(self.vmid).status.start.post()
 
-        while proxmox.nodes(self.node).qemu(self.vmid).status.current.get()['status'] == "stopped":
-            time.sleep(2)
+        self.__wait(lambda: self.get_status() != "stopped", "start")
         logging.warning(f"Started vm {self.vmname}")
 
-    def remove(self):
-        vm = get_vm_by_vmname(self.vmname)
-
-        self.vmid = vm["vmid"]
-        self.node = get_node_by_vmid(self.vmid)
-
-        self.__shutdown()
-
-        logging.warning("Deleting vm " + self.vmname
-                        + " with vmid " + str(self.vmid)
-                        + " from node " + self.node)
-        proxmox.nodes(self.node).qemu(self.vmid).delete()
+    def get_status(self):
+        return get_vm_status(self.node, self.vmid)
 
-    def __shutdown(self):
-        logging.warning("Stopping vm " + self.vmname
-                        + " with vmid " + str(self.vmid)
-                        + " on node " + self.node)
-        proxmox.nodes(self.node).qemu(self.vmid).status.shutdown.post(forceStop=1)
+    def __wait(self, condition, phase, deadline=None, ignore_errors=False):
+        return wait_until(condition, phase,
+                          deadline=deadline or self.deadline,
+                          cancelled=self.cancelled,
+                          timings=self.timings,
+                          ignore_errors=ignore_errors)
 
-        while proxmox.nodes(self.node).qemu(self.vmid).status.current.get()['status'] == "running":
-            time.sleep(2)
-        logging.warning(f"Stopped vm {self.vmname}")
+    def remove(self):
+        vm = get_vm_by_vmname(self.vmname)
+        if vm is None:
+            raise Exception("Cannot find vm with name " + self.vmname)
+        self.vmid, self.node = vm["vmid"], vm["node"]
+        remove_vm(vm, self.deadline, self.cancelled, self.timings)
 
-    def __configure(self):
+    def __configure(self, **config):
         if self.network_mode == 'dhcp':
             self.cloud_init_ip_config = "ip=dhcp"
         elif self.network_mode == 'manual':
@@ -168,49 +395,52 @@ class ProxmoxServer:
             raise Exception("pxe_autoscaled_node_network_mode setting not valid")
 
         proxmox.nodes(self.node).qemu(self.vmid).config.post(ipconfig0=self.cloud_init_ip_config,
-                                                             nameserver=self.name_server)
+                                                             nameserver=self.name_server,
+                                                             **config)
+
+    def __exec(self, command, phase):
+        """
+        Run command via qemu agent and wait it to exit. Returns exec-status result
+        """
+        agent = proxmox.nodes(self.node).qemu(self.vmid).agent
+        pid = agent.exec.post(command=command)
+        return wait_until(lambda: self.__exec_status(pid['pid']), phase,
+                          deadline=self.deadline,
+                          cancelled=self.cancelled)
+
+    def __exec_status(self, pid):
+        result = proxmox.nodes(self.node).qemu(self.vmid).agent('exec-status').get(pid=pid)
+        if result.get('exited') == 1:
+            return result
+        return None
 
     def join_cluster(self, join_command):
-        pid = None
-        result = {}
-        result['exited'] = None
-        while pid is None:
-            try:
-                pid = proxmox.nodes(self.node).qemu(self.vmid).agent.exec().post(command=join_command)
-            except Exception as ex:
-                logging.info("Waiting qemu agent to register joining process...")
-                time.sleep(3)
-
-        while result['exited'] != 1:
-            logging.info('Waiting for kubeadm joining process...')
-            result = proxmox.nodes(self.node).qemu(self.vmid).agent('exec-status').get(pid=pid['pid'])
-            time.sleep(3)
-
-        if 'This node has joined the cluster' in result['out-data']:
+        logging.info("Waiting qemu agent to register joining process...")
+        agent = proxmox.nodes(self.node).qemu(self.vmid).agent
+        pid = self.__wait(lambda: agent.exec.post(command=join_command), "agent", ignore_errors=True)
+        logging.info('Waiting for kubeadm joining process...')
+        result = self.__wait(lambda: self.__exec_status(pid['pid']), "join")
+
+        if 'This node has joined the cluster' in result.get('out-data', ''):
             logging.info(f"Node {self.vmname} joined cluster")
             return True
         else:
             logging.error("Node cannot join to cluster. Something goes wrong.")
-            logging.error(result['out-data'])
-            logging.error(result['err-data'])
+            logging.error(result.get('out-data'))
+            logging.error(result.get('err-data'))
             return False
 
     def is_os_running(self):
-        pid = None
         try:
-            pid = proxmox.nodes(self.node).qemu(self.vmid).agent.exec.post(command='systemctl is-system-running')
+            result = self.__exec('systemctl is-system-running', "os status")
+        except PollError:
+            raise
         except Exception as ex:
             logging.warning('OS not started. Waiting...')
-        if pid is None:
-            return False
-        else:
-            try:
-                result = proxmox.nodes(self.node).qemu(self.vmid).agent('exec-status').get(pid=pid['pid'])
-                status = result['out-data']
-            except Exception as ex:
-                logging.error(ex)
-                return False
-            logging.info('OS is in state ' + status.rstrip() + "...")
-            if status.rstrip() == 'running':
-                return True
             return False
+        status = result.get('out-data', '').rstrip()
+        logging.info('OS is in state ' + status + "...")
+        return status == 'running'
+
+    def wait_os_running(self):
+        self.__wait(self.is_os_running, "os running")
@@ -0,0 +1,48 @@
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+import functools
+import re
+
+
+# <quantity> ::= <signedNumber><suffix>, suffix is binary SI (Ki..Ei), decimal SI (n..E) or
+# decimal exponent (e<signedNumber>, E<signedNumber>)
+QUANTITY = re.compile(r"^([+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+))"
+                      r"(?:([KMGTPE]i)|([eE][+-]?[0-9]+)|([numkMGTPE]?))$")
+
+BINARY_SI = {"Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60}
+DECIMAL_SI = {"n": -9, "u": -6, "m": -3, "": 0, "k": 3, "M": 6, "G": 9, "T": 12, "P": 15, "E": 18}
+
+MEBIBYTE = 2 ** 20
+CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse(value):
+    """
+    Return kubernetes quantity (e.g. 500m, 1.5Gi, 128974848, 129e6) as exact Decimal
+    """
+    match = QUANTITY.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Invalid quantity {value!r}")
+    number, binary, exponent, decimal = match.groups()
+    if binary:
+        return Decimal(number) * BINARY_SI[binary]
+    if exponent:
+        return Decimal(number).scaleb(int(exponent[1:]))
+    return Decimal(number).scaleb(DECIMAL_SI[decimal])
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def cpu_millicores(value):
+    """
+    Return cpu quantity in millicores rounded up (as kubernetes MilliValue does)
+    """
+    return int((parse(value) * 1000).to_integral_value(rounding=ROUND_CEILING))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def memory_mebibytes(value):
+    """
+    Return memory quantity in MiB rounded down
+    """
+    return int((parse(value) / MEBIBYTE).to_integral_value(rounding=ROUND_FLOOR))
+
@@ -1,139 +1,369 @@
 from autoscaler import proxmox_controller as pc
 from autoscaler import k8s_controller as kc
+from autoscaler import garbage_collector
+from autoscaler import ipam
+from autoscaler import join
+from autoscaler import metrics
+from autoscaler import operations
+from autoscaler import polling
+from autoscaler import state
+from autoscaler import tracing
+from autoscaler import warm_pool
 from autoscaler.settings import *
-import ipaddress
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import math
 import time
-import subprocess
-import threading
+
+
+def create_scalers(node_groups):
+    """
+    Return scaler of every node group. Groups with the same ip pool share it, join credentials are shared
+    """
+    ip_pools = {}
+    join_credentials = None
+    scalers = []
+    for node_group in node_groups:
+        ip_pool = None
+        if pxe_autoscaled_node_network_mode == 'manual':
+            if node_group.ip_pool not in ip_pools:
+                ip_pools[node_group.ip_pool] = ipam.IpPool(node_group.ip_pool, node_group.ip_leases_file,
+                                                           max_node_provision_time)
+            ip_pool = ip_pools[node_group.ip_pool]
+        scaler = Scaler(node_group, ip_pool=ip_pool, join_credentials=join_credentials)
+        join_credentials = scaler.join_credentials
+        scalers.append(scaler)
+    return scalers
 
 
 class Scaler():
-    def __init__(self, node_group=kc.NodeGroup):
+    def __init__(self, node_group=kc.NodeGroup, ip_pool=None, join_credentials=None):
         self.node_group = node_group
         self.can_scale_down = True
         self.can_scale_up = True
-        self.can_clean_up = False
-        self.clean_delay = threading.Timer(pxe_vm_lost_cleanup_delay, self.set_can_clean_up, args=[True])
-
-    def scale_up(self):
-        logging.warning("Scaling up kubernetes cluster")
-
-        ip_address = self.__get_free_ip()
+        self.scale_up_delay = None
+        self.scale_down_delay = None
+        self.ip_pool = ip_pool
+        if self.ip_pool is None and pxe_autoscaled_node_network_mode == 'manual':
+            self.ip_pool = ipam.IpPool(node_group.ip_pool, node_group.ip_leases_file, max_node_provision_time)
+        self.operations = operations.OperationRegistry()
+        self.warm_pool = warm_pool.WarmPool(node_group, ip_pool=self.ip_pool)
+        self.garbage_collector = garbage_collector.GarbageCollector(node_group)
+        self.join_credentials = join_credentials or join.JoinCredentials(node_group.v1)
+
+    @tracing.traced
+    def scale_up(self, pods_requests=None, count=None):
+        logging.warning(f"Scaling up kubernetes cluster by node group {self.node_group.name}")
+
+        if count is None:
+            count = self.node_group.get_scale_up_count(pods_requests)
+        if count <= 0:
+            return None
+        logging.warning(f"Provisioning {count} new nodes")
+
+        self.__reconcile_ip_pool()
+        self.can_scale_up = False
+        self.can_scale_down = False
+        # nodes over scale_up_max_parallel wait for a free worker, so every wave of workers gets its own time
+        waves = math.ceil(count / scale_up_max_parallel)
+        operation = self.operations.submit("scale_up", self.__scale_up, count=count,
+                                           timeout=waves * max_node_provision_time,
+                                           item_timeout=max_node_provision_time)
+        self.node_group.upcoming_size = self.operations.upcoming_nodes()
+        return operation
+
+    def __scale_up(self, operation, resumed=()):
+        resumed = list(resumed)
+        added = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(operation.count, scale_up_max_parallel)) as pool:
+                results = list(pool.map(lambda i: self.__provision(operation, i + 1,
+                                                                   resumed[i] if i < len(resumed) else None),
+                                        range(operation.count)))
+            added = [node for node in results if node is not None]
+            self.node_group.update_current_size()
+        finally:
+            # timers set flags back even if operation failed, otherwise scaling stays disabled
+            if added:
+                logging.warning(f"Scaling up succesful. Added {len(added)} of {operation.count} nodes: "
+                                f"{', '.join(added)}")
+            else:
+                logging.error("Scaling up failed")
+            logging.warning("")
+
+            logging.info(f"Waiting {str(scale_up_delay_after_add)} secs for further scaling up "
+                         f"and {str(scale_down_delay_after_add)} secs for scaling down after scale up")
+            self.scale_up_delay = state.start_timer(scale_up_delay_after_add, self.set_can_scale_up, True)
+            self.scale_down_delay = state.start_timer(scale_down_delay_after_add, self.set_can_scale_down, True)
+        return added
+
+    def __provision(self, operation, item, resumed=None):
+        with tracing.record("provision", operation=str(operation), item=item):
+            return self.__provision_node(operation, item, resumed or {})
+
+    def __provision_node(self, operation, item, resumed):
+        ip_address = None
+        pxe_vm = None
+        vmname = None
+        standby = None
+        timings = {}
+        deadline = operation.item_deadline()
+        try:
+            operation.set_phase("allocating", item)
+            resumed_vm = resumed.get("vmname") and pc.get_vm_by_vmname(resumed["vmname"])
+            if not resumed_vm:
+                standby = self.warm_pool.take()
+            with polling.timed("allocation", timings):
+                # standby vm keeps ip address of its network config
+                ip_address = self.__reserve_free_ip(f"{operation}/{item}",
+                                                    resumed.get("ip") or (standby and standby.get("ip")))
+            if not ip_address:
+                return None
+            operation.set_item(item, ip=ip_address)
 
-        if ip_address:
-            self.can_scale_up = False
-            self.can_scale_down = False
             ip_address_cidr = ip_address + '/' + pxe_autoscaled_node_ip_mask
-            pxe_vm = pc.ProxmoxServer(cpu=self.node_group.capacity_cpu,
-                                      memory=self.node_group.capacity_mem,
-                                      ip_address_cidr=ip_address_cidr)
-
-            pxe_vm.create()
-            while not pxe_vm.is_os_running():
-                time.sleep(1)
-
-            join_command = self.__generate_kubeadm_join_command()
-
-            join_status = pxe_vm.join_cluster(join_command)
-            if join_status:
-                while not self.node_group.is_node_exist(pxe_vm.vmname):
-                    logging.warning('Waiting kubernetes to connect with node...')
-                    time.sleep(2)
-                self.node_group.label_new_node(pxe_vm.vmname)
-                while not self.node_group.is_node_ready(pxe_vm.vmname):
-                    time.sleep(2)
-                self.node_group.update_current_size()
-
-                logging.warning("Scaling up succesful")
-                logging.warning("")
-
-                logging.info(f"Waiting {str(scale_up_delay_after_add)} secs for further scaling up "
-                             f"and {str(scale_down_delay_after_add)} secs for scaling down after scale up")
-                delay_up = threading.Timer(scale_up_delay_after_add, self.set_can_scale_up, args=[True])
-                delay_down = threading.Timer(scale_down_delay_after_add, self.set_can_scale_down, args=[True])
-                delay_up.start()
-                delay_down.start()
-                return True
+            pxe_vm = self.__server(ip_address_cidr=ip_address_cidr,
+                                   deadline=deadline,
+                                   cancelled=operation.cancelled)
+            pxe_vm.timings = timings
+            pxe_vm.on_reserve = lambda vm: operation.set_item(item, vmname=vm.vmname)
+
+            operation.set_phase("creating", item)
+            if resumed_vm:
+                pxe_vm.resume(resumed["vmname"])
+            elif standby:
+                pxe_vm.take_standby(standby)
             else:
-                logging.error("Scaling up failed")
-                logging.warning("")
-                logging.info(f"Waiting {str(scale_up_delay_after_add)} secs for further scaling up "
-                             f"and {str(scale_down_delay_after_add)} secs for scaling down after scale up")
-                delay_up = threading.Timer(scale_up_delay_after_add, self.set_can_scale_up, args=[True])
-                delay_down = threading.Timer(scale_down_delay_after_add, self.set_can_scale_down, args=[True])
-                delay_up.start()
-                delay_down.start()
-                return False
+                pxe_vm.create()
+            operation.set_phase("waiting os", item)
+            pxe_vm.wait_os_running()
 
+            operation.set_phase("joining", item)
+            if resumed and self.node_group.cache.get_node(pxe_vm.vmname) is not None:
+                logging.info(f"Node {pxe_vm.vmname} joined cluster before restart")
+            else:
+                with polling.timed("join command", pxe_vm.timings):
+                    join_command = self.join_credentials.get_join_command()
+
+                if not pxe_vm.join_cluster(join_command):
+                    logging.error(f"Provisioning node {pxe_vm.vmname} failed")
+                    return None
+
+            operation.set_phase("waiting ready", item)
+            logging.warning('Waiting kubernetes to connect with node...')
+            self.__wait(lambda: self.node_group.is_node_exist(pxe_vm.vmname), "node registered", pxe_vm)
+            self.node_group.label_new_node(pxe_vm.vmname)
+            self.__wait(lambda: self.node_group.is_node_ready(pxe_vm.vmname), "node ready", pxe_vm)
+            vmname = pxe_vm.vmname
+            return vmname
+        except Exception as ex:
+            logging.error(f"Provisioning node with ip {ip_address} failed due {ex}")
+            return None
+        finally:
+            if standby:
+                self.warm_pool.release(standby)
+            if pxe_vm is not None:
+                pxe_vm.release()
+                logging.info(f"Provisioning of {pxe_vm.vmname or 'vm'} phases: {polling.format_timings(pxe_vm.timings)}")
+            if self.ip_pool is not None and ip_address:
+                self.ip_pool.release(ip_address, busy=True)
+            metrics.observe_timings(metrics.scale_up_phase_seconds, timings)
+            metrics.scaled_nodes_total.inc(kind="scale_up", result="added" if vmname else "failed")
+            operation.finish_item(item)
+            self.node_group.update_current_size()
+            self.node_group.upcoming_size = self.operations.upcoming_nodes()
+
+    def __server(self, ip_address_cidr='0.0.0.0/24', **kwargs):
+        return pc.ProxmoxServer(cpu=self.node_group.capacity_cpu,
+                                memory=self.node_group.capacity_mem,
+                                ip_address_cidr=ip_address_cidr,
+                                template_vm=self.node_group.template_vm,
+                                vm_name=self.node_group.vm_name,
+                                **kwargs)
+
+    def __wait(self, condition, phase, pxe_vm):
+        return polling.wait_until(condition, phase,
+                                  deadline=pxe_vm.deadline,
+                                  cancelled=pxe_vm.cancelled,
+                                  timings=pxe_vm.timings)
+
+    @tracing.traced
     def scale_down(self):
-        logging.warning("Scaling down kubernetes cluster")
-
-        node = self.node_group.redundant_node
-        logging.warning(f"Node {node} was selected for removing")
-
-        pxe_vm = pc.ProxmoxServer(cpu=self.node_group.capacity_cpu,
-                                  memory=self.node_group.capacity_mem,
-                                  ip_address_cidr='0.0.0.0/24')
-
+        logging.warning(f"Scaling down kubernetes cluster by node group {self.node_group.name}")
+
+        nodes = self.node_group.redundant_nodes or [self.node_group.redundant_node]
+        logging.warning(f"Nodes {', '.join(nodes)} were selected for removing")
+        self.can_scale_down = False
+        return self.__submit_scale_down(nodes, max_node_provision_time)
+
+    def __submit_scale_down(self, nodes, timeout):
+        operation = self.operations.submit("scale_down", lambda operation: self.__scale_down(operation, nodes),
+                                           count=len(nodes), target=nodes[0] if len(nodes) == 1 else None,
+                                           timeout=timeout, item_timeout=max_node_provision_time)
+        # vm names of items keep nodes out of clean up and are checkpointed for resuming
+        for i, node in enumerate(nodes):
+            operation.set_item(i + 1, vmname=node)
+        return operation
+
+    def __scale_down(self, operation, nodes):
+        removed = []
+        try:
+            with ThreadPoolExecutor(max_workers=len(nodes), thread_name_prefix="scale_down") as pool:
+                results = list(pool.map(lambda i: self.__remove(operation, i + 1, nodes[i]), range(len(nodes))))
+            removed = [node for node, is_removed in zip(nodes, results) if is_removed]
+            self.node_group.update_current_size()
+        finally:
+            # timer sets flag back even if operation failed, otherwise scaling down stays disabled
+            if removed:
+                logging.warning(f"Scaling down successful. Removed {len(removed)} of {len(nodes)} nodes: "
+                                f"{', '.join(removed)}")
+                logging.info(f"Waiting {str(scale_down_delay)} secs after scale down")
+                self.scale_down_delay = state.start_timer(scale_down_delay, self.set_can_scale_down, True)
+            else:
+                logging.error(f"Cannot scale down cluster due nodes {', '.join(nodes)} removing fail ")
+                logging.info(f"Waiting {str(scale_down_delay_after_error)} secs after scale down error")
+                self.scale_down_delay = state.start_timer(scale_down_delay_after_error, self.set_can_scale_down,
+                                                          True)
+        return removed
+
+    def __remove(self, operation, item, node):
+        with tracing.record("remove", operation=str(operation), item=item, node=node):
+            return self.__remove_node(operation, item, node)
+
+    def __remove_node(self, operation, item, node):
+        timings = {}
         is_scaled_down = False
+        cordoned = deleted = False
 
-        if self.node_group.cordon_node(node):
-            if self.node_group.drain_node(node):
-                if self.node_group.delete_node(node):
-                    self.can_scale_down = False
+        try:
+            deadline = operation.item_deadline()
+            pxe_vm = self.__server(deadline=deadline, cancelled=operation.cancelled)
+            pxe_vm.timings = timings
 
+            # node is already deleted when scale down is resumed after restart
+            deleted = self.node_group.cache.get_node(node) is None
+            if deleted:
+                logging.info(f"Node {node} is already deleted from kubernetes cluster")
+            else:
+                operation.set_phase("cordoning", item)
+                with polling.timed("cordon", timings):
+                    cordoned = self.node_group.cordon_node(node)
+                if cordoned:
+                    operation.set_phase("draining", item)
+                    with polling.timed("drain", timings):
+                        drained = self.node_group.drain_node(node, deadline=deadline,
+                                                             cancelled=operation.cancelled)
+                    if drained:
+                        operation.set_phase("deleting node", item)
+                        with polling.timed("delete node", timings):
+                            deleted = self.node_group.delete_node(node)
+            if deleted:
+                operation.set_phase("removing vm", item)
+                # vm is already removed when scale down is resumed after restart
+                if pc.get_vm_by_vmname(node) is None:
+                    logging.info(f"Vm {node} is already removed")
+                else:
                     pxe_vm.vmname = node
                     pxe_vm.remove()
-
-                    self.node_group.update_current_size()
-                    
-                    is_scaled_down = True
-                    logging.warning("Scaling down successful")
-                    logging.info(f"Waiting {str(scale_down_delay)} secs after scale down")
-
-                    delay = threading.Timer(scale_down_delay, self.set_can_scale_down, args=[True])
-                    delay.start()
-
-        if not is_scaled_down:
-            logging.error(f"Cannot scale down cluster due node {node} removing fail ")
-            logging.info(f"Waiting {str(scale_down_delay_after_error)} secs after scale down error")
-            time.sleep(scale_down_delay_after_error)
-
-    def __get_free_ip(self):
-        if pxe_autoscaled_node_network_mode == 'dhcp':
+                is_scaled_down = True
+        except Exception as ex:
+            logging.error(f"Removing node {node} failed due {ex}")
+        finally:
+            # node which is not removed is given back to scheduler instead of staying cordoned
+            if cordoned and not deleted:
+                self.node_group.uncordon_node(node)
+            logging.info(f"Removing of {node} phases: {polling.format_timings(timings)}")
+            metrics.observe_timings(metrics.scale_down_phase_seconds, timings)
+            metrics.scaled_nodes_total.inc(kind="scale_down", result="removed" if is_scaled_down else "failed")
+            if is_scaled_down:
+                operation.finish_item(item)
+        return is_scaled_down
+
+    def get_state(self):
+        """
+        Return flags, timers deadlines and in-flight scale operations for checkpoint
+        """
+        return {
+            "can_scale_up": self.can_scale_up,
+            "scale_up_delay": state.timer_deadline(self.scale_up_delay),
+            "can_scale_down": self.can_scale_down,
+            "scale_down_delay": state.timer_deadline(self.scale_down_delay),
+            "garbage_collector": self.garbage_collector.get_state(),
+            "node_group": self.node_group.get_state(),
+            "operations": [operation.get_state() for operation in self.operations.in_flight()
+                           if operation.kind in ("scale_up", "scale_down")],
+        }
+
+    def restore_state(self, saved):
+        """
+        Restart timers for their remaining time and resume in-flight scale operations of checkpoint
+        """
+        self.can_scale_up = saved.get("can_scale_up", True)
+        self.scale_up_delay = state.restore_timer(saved.get("scale_up_delay"), self.set_can_scale_up, True)
+        self.can_scale_down = saved.get("can_scale_down", True)
+        self.scale_down_delay = state.restore_timer(saved.get("scale_down_delay"), self.set_can_scale_down, True)
+        self.garbage_collector.restore_state(saved.get("garbage_collector", {}))
+        self.node_group.restore_state(saved.get("node_group", {}))
+
+        for operation in saved.get("operations", []):
+            self.__resume(operation)
+        # flags of operations which are not resumed would never be set back by their timers
+        if not self.can_scale_up and self.scale_up_delay is None and not self.operations.in_flight("scale_up"):
+            self.can_scale_up = True
+        if not self.can_scale_down and self.scale_down_delay is None and not self.operations.in_flight():
+            self.can_scale_down = True
+
+    def __resume(self, saved):
+        timeout = saved["deadline"] - time.time()
+        if timeout <= 0:
+            logging.warning(f"Operation {saved['kind']} exceeded its deadline before restart. Not resuming")
+            return None
+        if saved["kind"] == "scale_down":
+            nodes = [item["vmname"] for item in saved.get("items", []) if item.get("vmname")] \
+                or [node for node in [saved.get("target")] if node]
+            if not nodes:
+                return None
+            logging.warning(f"Resuming scale down of nodes {', '.join(nodes)}")
+            return self.__submit_scale_down(nodes, timeout)
+
+        items = saved.get("items", [])
+        if not items:
+            return None
+        logging.warning(f"Resuming provisioning of {len(items)} nodes: "
+                        f"{', '.join(item.get('vmname') or item.get('ip') or '?' for item in items)}")
+        operation = self.operations.submit("scale_up", lambda operation: self.__scale_up(operation, items),
+                                           count=len(items), timeout=timeout,
+                                           item_timeout=max_node_provision_time)
+        for i, item in enumerate(items):
+            if item.get("vmname"):
+                operation.set_item(i + 1, vmname=item["vmname"])
+        self.node_group.upcoming_size = self.operations.upcoming_nodes()
+        return operation
+
+    def __reserve_free_ip(self, holder, ip=None):
+        if self.ip_pool is None:
             return '0.0.0.0'
-
-        ip_pool = []
-        first_ip, last_ip = pxe_autoscaled_node_ip_pool.split('-')
-        for ip in range(int(ipaddress.ip_address(first_ip)), (int(ipaddress.ip_address(last_ip))) + 1):
-            ip_pool.append(ipaddress.ip_address(ip).exploded)
-
-        px_ips = pc.get_scaled_vms_ip()
-        for ip in px_ips:
-            if ip in ip_pool:
-                ip_pool.remove(ip)
-
-        self.node_group.update_current_size()
-        busy_ips = self.node_group.nodes_ip_addresses
-        for ip in busy_ips:
-            if ip in ip_pool:
-                ip_pool.remove(ip)
-
-        if ip_pool:
-            free_ip = ip_pool[0]
-            logging.info(f"Found free ip address for new host {free_ip}")
-        else:
-            free_ip = None
-            logging.error("Free ip address for new host not found")
-
-        return free_ip
-
-    def __generate_kubeadm_join_command(self):
-        string = subprocess.check_output('kubeadm token create --print-join-command', shell=True)
-        command = string.decode('utf-8').strip()
-        logging.info(f"Generated join command: {command}")
-        return command
+        if ip:
+            return self.ip_pool.claim(ip, holder)
+        return self.ip_pool.reserve(holder)
+
+    def __reconcile_ip_pool(self):
+        if self.ip_pool is None:
+            return
+        busy_ips = set()
+        node_names = set()
+        for node in self.node_group.cache.nodes.store.list():
+            for address in node.status.addresses or []:
+                if address.type == 'InternalIP':
+                    busy_ips.add(address.address)
+                    node_names.add(node.metadata.name)
+        busy_ips.update(pc.get_scaled_vms_ip(skip_vmnames=node_names, vm_name=self.node_group.vm_name))
+        busy_ips.update(self.warm_pool.get_ips())
+        self.ip_pool.reconcile(busy_ips)
+
+    @tracing.traced
+    def refill_warm_pool(self):
+        self.warm_pool.refill(self.operations)
 
     def get_can_scale_down(self):
         return self.can_scale_down
@@ -155,47 +385,11 @@ class Scaler():
         else:
             logging.info("Scaler now cannot scale up")
 
-    def get_can_clean_up(self):
-        return self.can_clean_up
-
-    def set_can_clean_up(self, state):
-        self.can_clean_up = state
-        if self.can_clean_up:
-            logging.info("Timeout done. Scaler now start cleaning...")
-
+    @tracing.traced
     def clean_up(self):
+        """
+        Start background removal of lost vms, returns its operation or None
+        """
         self.node_group.update_current_size()
-        nodes = self.node_group.nodes
-        vms = pc.get_scaled_vms()
-        for vm in vms:
-            if vm['name'] not in nodes:
-
-                if not self.get_can_clean_up():
-                    if not self.clean_delay.is_alive():
-                        self.clean_delay = threading.Timer(pxe_vm_lost_cleanup_delay, self.set_can_clean_up, args=[True])
-                        self.clean_delay.start()
-                        logging.info(f"Cleaning delay started for node {vm['name']}")
-                        return False
-                    return False
-                self.set_can_clean_up(False)
-
-                logging.warning(f"Removing lost autoscaled node {vm['name']}..")
-                not_ready_nodes = self.node_group.get_nodes(ready=False)
-                if vm['name'] in not_ready_nodes:
-                    self.node_group.drain_node(vm['name'])
-                    self.node_group.delete_node(vm['name'])
-
-                pxe_vm = pc.ProxmoxServer(cpu=self.node_group.capacity_cpu,
-                                          memory=self.node_group.capacity_mem,
-                                          ip_address_cidr='0.0.0.0/24')
-                pxe_vm.vmname = vm['name']
-                pxe_vm.remove()
-                logging.warning(f"Virtual machine {vm['name']} removed")
-                self.node_group.update_current_size()
-                return True
-
-        if self.clean_delay.is_alive():
-            logging.info(f"Cleaning delay canceled")
-            self.clean_delay.cancel()
-        return False
-
+        busy_vms = set(pc.reserved_vmnames) | set(self.operations.targets())
+        return self.garbage_collector.collect(self.operations, busy_vms)
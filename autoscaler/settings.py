@@ -12,7 +12,7 @@ except KeyError:
 pxe_autoscaled_node_template_vm = "autoscaler.tmpl"  # preconfigured template vm for autoscaler
 pxe_autoscaled_node_name = "autoscaler.node"  # autoscaled vm names in pxe (node-01, node-02 ...)
 pxe_autoscaled_node_network_mode = 'manual'  # manual or dhcp
-pxe_autoscaled_node_ip_pool = '10.99.0.13-10.99.0.19'  # ip range for manual network mode
+pxe_autoscaled_node_ip_pool = '10.99.0.13-10.99.0.19'  # ip range (or network in cidr notation) for manual network mode
 pxe_autoscaled_node_ip_mask = '24'  # cidr notation network mask
 pxe_autoscaled_node_ip_gateway = '10.99.0.1'  # ip gateway for manual network mode
 pxe_autoscaled_node_dns_server = '10.128.4.20'  # dns server for manual network mode
@@ -20,8 +20,8 @@ node_group_label = "pxe-autoscaler/autoscaler-managed-node"  # label for autosca
 min_size = 2
 max_size = 5
 scan_interval = 15
-max_node_provision_time = 900  # 15 min TODO: time waiting scaled up node becomes ready
-pxe_vm_lost_cleanup_delay = 300  # delay after lost or unready vm cleaning up
+max_node_provision_time = 900  # 15 min deadline of node provisioning (clone, start, join, ready) and removing
+pxe_vm_lost_cleanup_delay = 300  # (secs) grace period of every lost or unready vm before it is cleaned up
 scale_down_unneeded_time = 600  # time after unneeded node scales down
 scale_down_delay = 600  # time waiting after scaling down
 scale_up_delay_after_add = 300  # Time waiting after adding node for further scaling up
@@ -30,3 +30,40 @@ scale_down_delay_after_error = 600  # time waiting after error while scaling dow
 scale_down_utilization_threshold = 50  # enables scaling down when node underutilizated at %
 max_total_unready_percentage = 45  # TODO: disables scaler when % of nodes unready
 ok_total_unready_count = 3  # TODO: disable scaler when more of 3 nodes unready
+informer_watch_timeout = 300  # (secs) pods and nodes watch request timeout, watch resumes from last resourceVersion
+informer_retry_delay = 5  # (secs) delay before rewatching after informer error
+scale_up_max_parallel = 5  # maximum vms provisioned at the same time while scaling up
+scan_event_debounce = 2  # (secs) window for collecting unschedulable pods after first of them wakes up watcher
+poll_initial_interval = 0.5  # (secs) first interval of vm and node state polling, grows up to poll_max_interval
+poll_max_interval = 5  # (secs) maximum interval of vm and node state polling
+pxe_vm_shutdown_timeout = 120  # (secs) time waiting vm shutdown before forced stop
+pxe_warm_pool_size = 0  # pre-cloned and configured vms kept for fast scaling up, not counted in min_size and max_size (0 disables)
+pxe_warm_pool_vm_name = "autoscaler.warm"  # warm pool vm names in pxe (autoscaler.warm-1, ...), must not contain pxe_autoscaled_node_name
+pxe_warm_pool_boot = False  # keep warm pool vms booted (configured, not joined), so scale up taking one only runs join
+pxe_clone_mode = 'auto'  # auto (linked clone if template storage supports it, full otherwise), linked or full
+pxe_clone_storage = ''  # target storage for full clones (empty - storage of template)
+pxe_clone_snapshot = ''  # template vm snapshot to clone from (empty - template base disk)
+pxe_placement_policy = 'spread'  # spread (least loaded pve host) or pack (most loaded pve host which fits new vm)
+pxe_ip_leases_file = 'ip-leases.json'  # file keeping ip addresses leased to vms being provisioned
+join_token_ttl = 7200  # (secs) lifetime of bootstrap token created for joining new nodes
+metrics_port = 8000  # port of prometheus /metrics endpoint, 0 disables it
+trace_file = ''  # json lines file for per-tick timing breakdown (spans of decision functions and api calls), empty disables tracing
+trace_profile_every = 0  # profile every N-th tick by cProfile, 0 disables profiling
+trace_profile_dir = 'profiles'  # directory for cProfile stats dumps
+node_groups = []  # node groups with own label, shape and vms ([{'name': 'big', 'label': ..., 'template': ..., 'vm_name': ..., 'min_size': 0, 'max_size': 3, 'cpu': 8, 'memory': '32Gi'}]), empty - one group of settings above
+history_size = 360  # samples kept per node and node group series (one sample per scan)
+forecast_mode = ''  # '' disables proactive scale up, ewma (smoothed pods requests) or holt (smoothed requests with linear trend)
+forecast_lead_time = 600  # (secs) how far ahead requests are forecast, about time of node provisioning
+forecast_alpha = 0.3  # level smoothing factor of forecast (weight of the last sample)
+forecast_beta = 0.1  # trend smoothing factor of holt forecast
+forecast_min_samples = 20  # samples collected before forecast is used
+forecast_target_utilization = 0.8  # share of allocatable resources forecast requests may take before nodes are provisioned in advance
+scale_down_utilization_smoothing = 1  # weight of the last sample in node utilization used by scale down, 1 disables smoothing
+state_file = 'autoscaler-state.json'  # checkpoint of timers and in-flight operations resumed after restart, empty disables it
+drain_max_parallel = 10  # pods evicted at the same time while draining node
+drain_timeout = 300  # (secs) deadline of node drain: evictions (retried while disruption budget does not allow them) and pods deletion
+drain_backoff_max = 30  # (secs) maximum delay between eviction retries refused by disruption budget (429)
+scale_down_max_empty_bulk = 10  # empty nodes (without pods except DaemonSet ones) removed together in one scale down, 1 disables bulk removal
+scale_down_max_underutilized_bulk = 1  # underutilized nodes with pods which fit other nodes removed together in one scale down
+pxe_vm_lost_cleanup_max_parallel = 5  # lost vms removed at the same time by clean up
+informer_list_page_size = 500  # objects per page of initial pods and nodes list
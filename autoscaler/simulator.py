@@ -0,0 +1,109 @@
+class NodeState:
+    def __init__(self, name, cpu_allocatable, memory_allocatable, pods, schedulable=True):
+        """
+        pods - list of movable pods (name, cpu request milicores, memory request MB)
+        """
+        self.name = name
+        self.schedulable = schedulable
+        self.cpu_allocatable = cpu_allocatable
+        self.memory_allocatable = memory_allocatable
+        self.pods = pods
+        self.cpu_requested = sum(pod[1] for pod in pods)
+        self.memory_requested = sum(pod[2] for pod in pods)
+
+    def load(self):
+        return self.cpu_requested / max(self.cpu_allocatable, 1) \
+            + self.memory_requested / max(self.memory_allocatable, 1)
+
+
+class ScaleDownSimulator:
+    """
+    Checks by requests whether pods of a node can be placed to other nodes of node group
+    """
+    def __init__(self, nodes, daemon_requests=None):
+        """
+        nodes - list of NodeState, daemon_requests - {node: (cpu, memory)} requested by not movable pods
+        """
+        self.nodes = nodes
+        daemon_requests = daemon_requests or {}
+        self.cpu_free = {}
+        self.memory_free = {}
+        for node in nodes:
+            daemon_cpu, daemon_memory = daemon_requests.get(node.name, (0, 0))
+            self.cpu_free[node.name] = node.cpu_allocatable - node.cpu_requested - daemon_cpu
+            self.memory_free[node.name] = node.memory_allocatable - node.memory_requested - daemon_memory
+
+    def get_node(self, node_name):
+        for node in self.nodes:
+            if node.name == node_name:
+                return node
+        return None
+
+    def find_unplaceable_pod(self, node_name):
+        """
+        Return name of first pod of node which does not fit other nodes, None if all pods fit
+        """
+        node = self.get_node(node_name)
+        others = [other.name for other in self.nodes if other.name != node_name and other.schedulable]
+        cpu_free = [self.cpu_free[name] for name in others]
+        memory_free = [self.memory_free[name] for name in others]
+
+        for pod, cpu, memory in sorted(node.pods, key=lambda p: (p[1], p[2]), reverse=True):
+            for i in range(len(others)):
+                if cpu_free[i] >= cpu and memory_free[i] >= memory:
+                    cpu_free[i] -= cpu
+                    memory_free[i] -= memory
+                    break
+            else:
+                return pod
+        return None
+
+    def can_remove(self, node_name):
+        return self.find_unplaceable_pod(node_name) is None
+
+    def rank_candidates(self):
+        """
+        Return names of all removable nodes, least loaded first
+        """
+        removable = []
+        for node in sorted(self.nodes, key=lambda n: (len(n.pods), n.load())):
+            if self.can_remove(node.name):
+                removable.append(node.name)
+        return removable
+
+    def select_removable(self, candidates, limit):
+        """
+        Return up to limit candidates (in their order) which can be removed together: pods of every
+        selected node are placed to kept nodes, taking into account pods placed from nodes selected before
+        """
+        cpu_free, memory_free = dict(self.cpu_free), dict(self.memory_free)
+        placed = {}  # node -> pods placed to it from removed nodes
+        selected = []
+        for node_name in candidates:
+            if len(selected) >= limit:
+                break
+            node = self.get_node(node_name)
+            if node is None:
+                continue
+            others = [other.name for other in self.nodes
+                      if other.name != node_name and other.schedulable and other.name not in selected]
+            trial_cpu = {name: cpu_free[name] for name in others}
+            trial_memory = {name: memory_free[name] for name in others}
+            placement = {}
+            pods = node.pods + placed.get(node_name, [])
+            for pod in sorted(pods, key=lambda p: (p[1], p[2]), reverse=True):
+                for other in others:
+                    if trial_cpu[other] >= pod[1] and trial_memory[other] >= pod[2]:
+                        trial_cpu[other] -= pod[1]
+                        trial_memory[other] -= pod[2]
+                        placement.setdefault(other, []).append(pod)
+                        break
+                else:
+                    break
+            else:
+                selected.append(node_name)
+                cpu_free.update(trial_cpu)
+                memory_free.update(trial_memory)
+                for other, other_pods in placement.items():
+                    placed.setdefault(other, []).extend(other_pods)
+        return selected
@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+def start_timer(interval, function, *args):
+    """
+    Start threading.Timer which remembers its deadline (time.time() based) for checkpoints
+    """
+    timer = threading.Timer(max(interval, 0), function, args=list(args))
+    timer.deadline = time.time() + max(interval, 0)
+    timer.start()
+    return timer
+
+
+def timer_deadline(timer):
+    """
+    Return deadline of running timer, None if timer is not running
+    """
+    if timer is None or not timer.is_alive():
+        return None
+    return getattr(timer, "deadline", None)
+
+
+def restore_timer(deadline, function, *args):
+    """
+    Start timer for remaining time until deadline (fires at once if deadline passed), None without deadline
+    """
+    if deadline is None:
+        return None
+    return start_timer(deadline - time.time(), function, *args)
+
+
+class StateStore:
+    """
+    Checkpoint of scalers timers and in-flight operations kept in json file (replaced atomically),
+    so restarted autoscaler resumes cooldowns and provisioning instead of starting over
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            logging.error(f"Cannot read state from {self.path} due {ex}")
+            return {}
+
+    def save(self, state):
+        if not self.path:
+            return
+        with self.lock:
+            try:
+                tmp_file = self.path + ".tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_file, self.path)
+            except OSError as ex:
+                logging.error(f"Cannot save state to {self.path} due {ex}")
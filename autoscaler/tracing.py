@@ -0,0 +1,111 @@
+from autoscaler.settings import *
+from contextlib import contextmanager
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Tracer:
+    """
+    Collects spans of one record (decision loop tick, operation) in current thread. Spans are aggregated
+    by path (count and total duration) and record is written as JSON line to trace_file when it ends.
+    Records can be profiled by cProfile, stats are dumped to profile_dir
+    """
+    def __init__(self, trace_file=trace_file, profile_dir=trace_profile_dir):
+        self.trace_file = trace_file
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def record(self, kind, profile=False, **fields):
+        profiler = None
+        if profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        current = None
+        if self.trace_file and getattr(self.local, "current", None) is None:
+            current = self.local.current = {"path": [], "spans": {}}
+        start_time = time.time()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            if profiler is not None:
+                profiler.disable()
+                self.__dump_profile(profiler, kind, fields)
+            if current is not None:
+                self.local.current = None
+                spans = [{"path": path, "count": count, "duration": round(total, 6)}
+                         for path, (count, total) in sorted(current["spans"].items())]
+                self.__write(dict(kind=kind, start=start_time, duration=round(duration, 6), spans=spans, **fields))
+
+    @contextmanager
+    def span(self, name):
+        current = getattr(self.local, "current", None)
+        if current is None:
+            yield
+            return
+        path = current["path"]
+        path.append(name)
+        key = " > ".join(path)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            path.pop()
+            stat = current["spans"].get(key)
+            if stat is None:
+                current["spans"][key] = [1, duration]
+            else:
+                stat[0] += 1
+                stat[1] += duration
+
+    def __write(self, record):
+        try:
+            line = json.dumps(record, default=str)
+            with self.lock:
+                with open(self.trace_file, "a") as f:
+                    f.write(line + "\n")
+        except OSError as ex:
+            logging.error(f"Cannot write trace to {self.trace_file} due {ex}")
+
+    def __dump_profile(self, profiler, kind, fields):
+        name = "-".join([kind] + [str(value) for value in fields.values()])
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+            logging.info(f"Profile of {name} saved to {path}")
+        except OSError as ex:
+            logging.error(f"Cannot save profile of {name} due {ex}")
+
+
+tracer = Tracer()
+
+
+def record(kind, profile=False, **fields):
+    return tracer.record(kind, profile, **fields)
+
+
+def span(name):
+    return tracer.span(name)
+
+
+def traced(func):
+    """
+    Decorator wrapping function calls in span named by function qualified name
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracer.span(name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,117 @@
+from autoscaler import proxmox_controller as pc
+from autoscaler.settings import *
+import logging
+import threading
+
+
+class WarmPool:
+    """
+    Pre-cloned vms of node group (named warm_pool_vm_name-N) with cloud-init network config applied, stopped
+    or booted but not joined (boot), which are taken by scale up instead of cloning. In manual network mode
+    every vm keeps ip address leased from ip pool while it is created. Pool is not a part of node group size
+    and is reconciled from Proxmox inventory
+    """
+    def __init__(self, node_group, size=None, vm_name=None, ip_pool=None, boot=pxe_warm_pool_boot):
+        self.node_group = node_group
+        self.size = node_group.warm_pool_size if size is None else size
+        self.vm_name = vm_name or node_group.warm_pool_vm_name
+        self.ip_pool = ip_pool
+        self.boot = boot
+        self.lock = threading.Lock()
+        self.taken = set()
+
+    def get_vms(self):
+        return pc.find_vms(self.vm_name)
+
+    def get_ready_vms(self):
+        return [vm for vm in self.get_vms()
+                if vm.get("status") in ("stopped", "running") and not vm.get("lock")
+                and vm["vmid"] not in self.taken and vm["name"] not in pc.reserved_vmnames]
+
+    def take(self):
+        """
+        Return standby vm (with ip address of its network config) reserved for caller or None when pool is empty
+        """
+        if self.size <= 0:
+            return None
+        with self.lock:
+            vms = self.get_ready_vms()
+            if not vms:
+                logging.info("Warm pool is empty")
+                return None
+            # booted vms need only join
+            vm = min(vms, key=lambda vm: vm.get("status") != "running")
+            self.taken.add(vm["vmid"])
+        try:
+            return dict(vm, ip=pc.get_vm_ip(vm["node"], vm["vmid"]))
+        except Exception:
+            self.release(vm)
+            raise
+
+    def release(self, vm):
+        with self.lock:
+            self.taken.discard(vm["vmid"])
+
+    def get_ips(self):
+        """
+        Return ip addresses of pool vms network config, they are in use while vms are in pool
+        """
+        ips = []
+        for vm in self.get_vms():
+            try:
+                ip = pc.get_vm_ip(vm["node"], vm["vmid"])
+            except Exception as ex:
+                logging.info(f"Cannot get ip address of standby vm {vm['name']} due {ex}")
+                continue
+            if ip:
+                ips.append(ip)
+        return ips
+
+    def refill(self, operations):
+        """
+        Clone missing or remove extra standby vms in background
+        """
+        if operations.in_flight("warm_pool"):
+            return
+        vms = [vm for vm in self.get_vms() if vm["vmid"] not in self.taken]
+        missing = self.size - len(vms)
+        if missing > 0:
+            logging.info(f"Warm pool {self.vm_name} has {len(vms)} of {self.size} vms. Refilling...")
+            # standby vms are cloned one by one, each in its own max_node_provision_time
+            operations.submit("warm_pool", self.__create, count=missing, timeout=missing * max_node_provision_time,
+                              item_timeout=max_node_provision_time)
+        elif missing < 0:
+            logging.info(f"Warm pool {self.vm_name} has {len(vms)} of {self.size} vms. Removing extra vms...")
+            extra = vms[:-missing]
+            operations.submit("warm_pool", lambda operation: self.__remove(operation, extra), count=len(extra),
+                              timeout=max_node_provision_time)
+
+    def __create(self, operation):
+        for i in range(operation.count):
+            ip_address = self.ip_pool.reserve(f"{operation}/{i + 1}") if self.ip_pool is not None else '0.0.0.0'
+            if not ip_address:
+                return
+            pxe_vm = self.__server(ip_address_cidr=ip_address + '/' + pxe_autoscaled_node_ip_mask,
+                                   deadline=operation.item_deadline(), cancelled=operation.cancelled)
+            try:
+                pxe_vm.create_standby(prefix=self.vm_name, boot=self.boot)
+            finally:
+                pxe_vm.release()
+                if self.ip_pool is not None:
+                    self.ip_pool.release(ip_address, busy=True)
+                operation.finish_item()
+
+    def __remove(self, operation, vms):
+        for vm in vms:
+            pxe_vm = self.__server()
+            pxe_vm.vmname = vm["name"]
+            pxe_vm.remove()
+            operation.finish_item()
+
+    def __server(self, ip_address_cidr='0.0.0.0/24', **kwargs):
+        return pc.ProxmoxServer(cpu=self.node_group.capacity_cpu,
+                                memory=self.node_group.capacity_mem,
+                                ip_address_cidr=ip_address_cidr,
+                                template_vm=self.node_group.template_vm,
+                                vm_name=self.node_group.vm_name,
+                                **kwargs)
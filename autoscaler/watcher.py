@@ -1,6 +1,14 @@
 from autoscaler import k8s_controller as kc
+from autoscaler import proxmox_controller as pc
 from autoscaler import scaler as sc
+from autoscaler import expander
+from autoscaler import informer
+from autoscaler import metrics
+from autoscaler import state
+from autoscaler import tracing
 from autoscaler.settings import *
+from collections import deque
+import threading
 import time
 import logging
 
@@ -12,22 +20,186 @@ class Watcher:
         self.watching_interval = scan_interval
         self.scale_down_interval = scale_down_interval
 
-        self.node_group = kc.NodeGroup(node_group_label,
-                                       min_size,
-                                       max_size)
-        self.scaler = sc.Scaler(self.node_group)
+        self.node_groups = kc.create_node_groups()
+        self.scalers = sc.create_scalers(self.node_groups)
+        self.k8s = self.node_groups[0].k8s
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.unschedulable_since = None
+        self.reaction_times = deque(maxlen=100)
+        self.ticks = 0
+        self.k8s.cache.pods.add_event_handler(self.on_pod_event)
+
+        self.state = state.StateStore(state_file)
+        self.restore()
+        for scaler in self.scalers:
+            scaler.operations.on_change = self.checkpoint
+
+    def restore(self):
+        saved = self.state.load()
+        if not saved:
+            return
+        groups = saved.get("groups", {})
+        for scaler in self.scalers:
+            if scaler.node_group.name in groups:
+                scaler.restore_state(groups[scaler.node_group.name])
+        logging.info(f"State restored from {state_file} saved {time.time() - saved.get('time', 0):.0f} secs ago")
+
+    def checkpoint(self):
+        self.state.save({"time": time.time(),
+                         "groups": {scaler.node_group.name: scaler.get_state() for scaler in self.scalers}})
+
+    def on_pod_event(self, event_type, pod, old_pod):
+        if event_type == 'DELETED' or not informer.pod_unschedulable_index(pod):
+            return
+        if old_pod is not None and informer.pod_unschedulable_index(old_pod):
+            return
+        if not kc.is_pod_insufficient_resources(pod):
+            return
+
+        since = time.time()
+        for condition in pod.status.conditions:
+            if condition.type == "PodScheduled" and condition.last_transition_time:
+                since = min(since, condition.last_transition_time.timestamp())
+        with self.lock:
+            if self.unschedulable_since is None:
+                self.unschedulable_since = since
+        logging.info(f"Pod {pod.metadata.name} became unschedulable. Waking up watcher")
+        self.wakeup.set()
+
+    def record_reaction_time(self):
+        with self.lock:
+            since, self.unschedulable_since = self.unschedulable_since, None
+        if since is not None:
+            reaction_time = max(time.time() - since, 0)
+            self.reaction_times.append(reaction_time)
+            metrics.reaction_seconds.observe(reaction_time)
+            logging.info(f"Unschedulable pods evaluated in {reaction_time:.2f} secs")
+
+    def get_reaction_time(self):
+        """
+        Return last and average time between pod became unschedulable and its evaluation
+        """
+        if not self.reaction_times:
+            return None, None
+        return self.reaction_times[-1], sum(self.reaction_times) / len(self.reaction_times)
+
+    @tracing.traced
+    def update_metrics(self):
+        metrics.pending_pods.set(len(self.k8s.get_unschedulable_pods()))
+        for scaler in self.scalers:
+            node_group = scaler.node_group
+            group = node_group.name
+            metrics.node_group_size.set(node_group.current_size, group=group, state="current")
+            metrics.node_group_size.set(node_group.upcoming_size, group=group, state="upcoming")
+            metrics.node_group_size.set(node_group.min_size, group=group, state="min")
+            metrics.node_group_size.set(node_group.max_size, group=group, state="max")
+            forecast = node_group.get_forecast_requests()
+            if forecast is not None:
+                metrics.node_group_requests_forecast.set(forecast[0], group=group, resource="cpu")
+                metrics.node_group_requests_forecast.set(forecast[1], group=group, resource="memory")
+            metrics.scaler_state.set(int(scaler.get_can_scale_up()), group=group, state="can_scale_up")
+            metrics.scaler_state.set(int(scaler.get_can_scale_down()), group=group, state="can_scale_down")
+            metrics.lost_vms.set(scaler.garbage_collector.pending(), group=group)
+            metrics.scaler_state.set(int(node_group.unneeded_node_delay.is_alive()), group=group,
+                                     state="unneeded_node_delay")
+            metrics.scaler_state.set(int(node_group.unneeded_node_delay_elapsed), group=group,
+                                     state="unneeded_node_delay_elapsed")
+
+    @tracing.traced
+    def scale_up(self):
+        """
+        Scale up node groups below min_size and node group selected by expander for unschedulable pods.
+        Return True if cluster needs scaling up
+        """
+        need_scaling_up = False
+        for scaler in self.scalers:
+            if scaler.node_group.is_below_min_size():
+                need_scaling_up = True
+                if scaler.get_can_scale_up():
+                    scaler.scale_up()
+
+        if not self.k8s.has_unschedulable_pods():
+            return self.scale_up_forecast() or need_scaling_up
+        candidates = [scaler for scaler in self.scalers if scaler.node_group.get_free_size() > 0]
+        if not candidates:
+            logging.warning("Autoscaler reached maximum size. Cant scale")
+            return need_scaling_up
+        # node group being scaled up counts pending pods by its own new nodes, other groups may scale up
+        candidates = [scaler for scaler in candidates
+                      if scaler.get_can_scale_up() and not scaler.node_group.upcoming_size]
+        if not candidates:
+            return True
+        pods_requests = [kc.get_pod_requests(pod) for pod in self.k8s.get_unschedulable_pods()]
+        # pods which nodes being provisioned will take are not provisioned for again
+        pods_requests = expander.exclude_upcoming([scaler.node_group for scaler in self.scalers], pods_requests)
+        if not pods_requests:
+            return True
+        option = expander.least_waste([scaler.node_group for scaler in candidates], pods_requests)
+        if option is None:
+            logging.warning("Unschedulable pods do not fit to nodes of any node group")
+            return True
+        for scaler in candidates:
+            if scaler.node_group is option.node_group:
+                scaler.scale_up(option.pods_requests)
+        return True
+
+    def scale_up_forecast(self):
+        """
+        Provision nodes in advance when forecast requests exceed node group capacity in forecast_lead_time.
+        Return True if any node group needs scaling up
+        """
+        if not forecast_mode:
+            return False
+        need_scaling_up = False
+        for scaler in self.scalers:
+            count = scaler.node_group.get_forecast_scale_up_count()
+            if count <= 0:
+                continue
+            need_scaling_up = True
+            if scaler.get_can_scale_up() and not scaler.node_group.upcoming_size:
+                logging.warning(f"Proactive scaling up of node group {scaler.node_group.name}")
+                scaler.scale_up(count=count)
+        return need_scaling_up
+
+    def wait_next_scan(self):
+        if self.wakeup.wait(self.watching_interval):
+            # coalesce burst of unschedulable pods into one evaluation
+            time.sleep(scan_event_debounce)
+            self.wakeup.clear()
+
+    def tick(self):
+        """
+        One scan of cluster: scale up, scale down and clean up decisions
+        """
+        self.ticks += 1
+        profile = trace_profile_every > 0 and self.ticks % trace_profile_every == 0
+        tick_start = time.monotonic()
+        with tracing.record("tick", profile=profile, tick=self.ticks):
+            pc.inventory.invalidate()
+            kc.utilization.invalidate()
+            self.record_reaction_time()
+            for scaler in self.scalers:
+                scaler.operations.check_deadlines()
+                scaler.node_group.record_history()
+
+            if not self.scale_up():
+                for scaler in self.scalers:
+                    if scaler.get_can_scale_down():
+                        if scaler.node_group.is_scaled():
+                            if scaler.node_group.can_scale_down():
+                                scaler.scale_down()
+
+            for scaler in self.scalers:
+                scaler.clean_up()
+                scaler.refill_warm_pool()
+            self.update_metrics()
+            self.checkpoint()
+        metrics.tick_seconds.observe(time.monotonic() - tick_start)
 
     def run(self):
         logging.info("Watching cluster")
         while True:
-            if self.node_group.is_need_scaling_up():
-                if self.scaler.get_can_scale_up():
-                    self.scaler.scale_up()
-
-            elif self.scaler.get_can_scale_down():
-                if self.node_group.is_scaled():
-                    if self.node_group.can_scale_down():
-                        self.scaler.scale_down()
-
-            time.sleep(self.watching_interval)
-            self.scaler.clean_up()
+            self.tick()
+            self.wait_next_scan()
@@ -0,0 +1,358 @@
+"""
+End-to-end benchmark of autoscaler against fake Kubernetes and Proxmox api servers
+running in a child process. Synthetic cluster of --nodes nodes (--group-nodes of them autoscaled)
+with --pods pods on --hosts pve hosts, every api request is delayed by --latency-ms.
+Watcher runs --ticks steady scans, then --pending unschedulable pods are created and scans
+continue until new nodes are Ready.
+
+Reports scan (tick) latency, api calls, memory, time to Ready of new nodes and drain time of autoscaled node
+(pods evictions are refused --eviction-refusals times by disruption budget). Results are saved
+to benchmarks/results/<scenario>-<time>.json and compared with the previous run of the same scenario.
+
+Usage: python -m benchmarks.e2e_bench [--nodes 500] [--pods 50000] [--hosts 10] [--latency-ms 5] ...
+"""
+from benchmarks import fake_kubernetes
+from benchmarks import fake_proxmox
+import argparse
+import glob
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import ssl
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="End-to-end autoscaler benchmark")
+    parser.add_argument("--scenario", help="results name (default is made of cluster size and latency)")
+    parser.add_argument("--nodes", type=int, default=500, help="kubernetes nodes")
+    parser.add_argument("--pods", type=int, default=50000, help="kubernetes pods")
+    parser.add_argument("--group-nodes", type=int, default=10, help="autoscaled nodes at start")
+    parser.add_argument("--hosts", type=int, default=10, help="pve hosts")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency of every api request")
+    parser.add_argument("--ticks", type=int, default=20, help="steady scans before scale up")
+    parser.add_argument("--pending", type=int, default=20, help="unschedulable pods (1 cpu, 1Gi) for scale up")
+    parser.add_argument("--max-new", type=int, default=20, help="node group max_size above its start size")
+    parser.add_argument("--interval", type=float, default=1, help="scan interval (secs)")
+    parser.add_argument("--clone-time", type=float, default=1, help="fake clone task duration (secs)")
+    parser.add_argument("--boot-time", type=float, default=1, help="fake vm boot time (secs)")
+    parser.add_argument("--join-time", type=float, default=1, help="fake kubeadm join duration (secs)")
+    parser.add_argument("--ready-delay", type=float, default=1, help="fake node Ready delay after join (secs)")
+    parser.add_argument("--eviction-refusals", type=int, default=1,
+                        help="429 (disruption budget) responses to eviction of every pod")
+    parser.add_argument("--termination-delay", type=float, default=0.5, help="fake pod deletion delay after eviction")
+    parser.add_argument("--shared-storage", action="store_true",
+                        help="template on shared storage (clone to any host), local-lvm otherwise")
+    parser.add_argument("--clone-mode", default="auto", help="pxe_clone_mode (full clones are migrated "
+                                                             "from template host on local storage)")
+    parser.add_argument("--warm-pool", type=int, default=0, help="warm pool vms (filled during steady scans)")
+    parser.add_argument("--warm-pool-boot", action="store_true", help="keep warm pool vms booted")
+    parser.add_argument("--lost", type=int, default=5, help="lost vms (without kubernetes node) for clean up")
+    parser.add_argument("--timeout", type=float, default=300, help="scale up deadline (secs)")
+    parser.add_argument("--trace", action="store_true", help="write tick traces to results directory")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure python heap peak (slow)")
+    parser.add_argument("--verbose", action="store_true", help="show autoscaler logs")
+    options = parser.parse_args(argv)
+    if not options.scenario:
+        options.scenario = (f"n{options.nodes}-p{options.pods}-g{options.group_nodes}-h{options.hosts}"
+                            f"-l{options.latency_ms:g}")
+    return options
+
+
+def run_fakes(options, names, cert_file, key_file, connection):
+    logging.disable(logging.CRITICAL)
+    with open(cert_file, "rb") as f:
+        ca_cert = f.read()
+    kubernetes = fake_kubernetes.FakeKubernetes(nodes=options.nodes,
+                                                pods=options.pods,
+                                                group_nodes=options.group_nodes,
+                                                group_label=names["label"],
+                                                group_prefix=names["node"],
+                                                latency=options.latency_ms / 1000,
+                                                ready_delay=options.ready_delay,
+                                                ca_cert=ca_cert,
+                                                eviction_refusals=options.eviction_refusals,
+                                                termination_delay=options.termination_delay)
+    proxmox = fake_proxmox.FakeProxmox(hosts=options.hosts,
+                                       group_nodes=options.group_nodes,
+                                       group_prefix=names["node"],
+                                       template_name=names["template"],
+                                       latency=options.latency_ms / 1000,
+                                       clone_time=options.clone_time,
+                                       boot_time=options.boot_time,
+                                       join_time=options.join_time,
+                                       lost_vms=options.lost,
+                                       shared_storage=options.shared_storage,
+                                       kubernetes=kubernetes)
+    kubernetes_server = fake_kubernetes.serve(kubernetes)
+    proxmox_server = fake_proxmox.serve(proxmox, cert_file, key_file)
+    connection.send((kubernetes_server.server_address[1], proxmox_server.server_address[1]))
+    connection.recv()
+
+
+def configure(options, kubernetes_port, proxmox_port, workdir):
+    """
+    Point autoscaler settings and kubernetes client to fake servers. Must run before autoscaler modules import
+    """
+    from autoscaler import settings
+    from kubernetes import client
+
+    settings.pxe_host = f"127.0.0.1:{proxmox_port}"
+    settings.pxe_clone_mode = options.clone_mode
+    settings.pxe_warm_pool_size = options.warm_pool
+    settings.pxe_warm_pool_boot = options.warm_pool_boot
+    settings.min_size = 1
+    settings.max_size = options.group_nodes + options.max_new
+    settings.pxe_autoscaled_node_network_mode = 'manual'
+    settings.pxe_autoscaled_node_ip_pool = '10.200.0.0/16'
+    settings.pxe_ip_leases_file = os.path.join(workdir, "ip-leases.json")
+    settings.state_file = os.path.join(workdir, "autoscaler-state.json")
+    settings.max_node_provision_time = options.timeout
+    settings.poll_initial_interval = 0.1
+    settings.poll_max_interval = 1
+    settings.scan_event_debounce = 0.1
+    settings.informer_watch_timeout = 60
+    settings.informer_retry_delay = 1
+    settings.scale_up_delay_after_add = 1
+    settings.scale_down_delay_after_add = 1
+    settings.scale_down_unneeded_time = 3600
+    settings.pxe_vm_lost_cleanup_delay = 3600
+    settings.metrics_port = 0
+    if options.trace:
+        settings.trace_file = os.path.join(RESULTS_DIR, f"{options.scenario}-trace.jsonl")
+
+    configuration = client.Configuration()
+    configuration.host = f"http://127.0.0.1:{kubernetes_port}"
+    configuration.api_key = {"authorization": "bench"}
+    configuration.api_key_prefix = {"authorization": "Bearer"}
+    client.Configuration.set_default(configuration)
+
+
+def get_stats(url):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(url, context=context if url.startswith("https") else None) as response:
+        stats = json.loads(response.read())
+    return stats.get("data", stats)  # proxmox api wraps response in data
+
+
+def calls_delta(before, after):
+    return sum(after["calls"].values()) - sum(before["calls"].values())
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def histogram_means(histogram):
+    means = {}
+    with histogram.lock:
+        for (phase,), counts in histogram.values.items():
+            count = sum(counts[:-1])
+            if count:
+                means[phase] = round(counts[-1] / count, 3)
+    return means
+
+
+def run(options, kubernetes_url, proxmox_url):
+    from autoscaler import k8s_controller as kc
+    from autoscaler import metrics
+    from autoscaler import settings
+    from autoscaler import watcher
+
+    if options.tracemalloc:
+        tracemalloc.start()
+    result = {"scenario": options.scenario, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "options": vars(options)}
+
+    start = time.monotonic()
+    wr = watcher.Watcher(options.interval)
+    result["startup_secs"] = round(time.monotonic() - start, 3)
+
+    # steady scans
+    kubernetes_before, proxmox_before = get_stats(kubernetes_url), get_stats(proxmox_url)
+    tick_times = []
+    for _ in range(options.ticks):
+        start = time.monotonic()
+        wr.tick()
+        tick_times.append(time.monotonic() - start)
+    kubernetes_after, proxmox_after = get_stats(kubernetes_url), get_stats(proxmox_url)
+    ticks = max(len(tick_times), 1)
+    result["tick_ms"] = {"p50": round(percentile(tick_times, 0.5) * 1000, 2) if tick_times else None,
+                         "p95": round(percentile(tick_times, 0.95) * 1000, 2) if tick_times else None,
+                         "max": round(max(tick_times) * 1000, 2) if tick_times else None}
+    result["calls_per_tick"] = {"kubernetes": round(calls_delta(kubernetes_before, kubernetes_after) / ticks, 2),
+                                "proxmox": round(calls_delta(proxmox_before, proxmox_after) / ticks, 2)}
+
+    # warm pool refill started by steady scans is waited for, so scale up takes standby vms
+    if options.warm_pool:
+        start = time.monotonic()
+        for scaler in wr.scalers:
+            for operation in scaler.operations.in_flight("warm_pool"):
+                operation.future.result()
+        result["warm_pool"] = {"vms": options.warm_pool, "boot": options.warm_pool_boot,
+                               "fill_secs": round(time.monotonic() - start, 3)}
+
+    # scale up
+    scale_up_times = []
+    if options.pending:
+        urllib.request.urlopen(urllib.request.Request(f"{kubernetes_url.rsplit('/', 1)[0]}/pending"
+                                                      f"?count={options.pending}", method="POST")).read()
+        scale_up_start = time.time()
+        # nodes over scale_up_max_parallel are provisioned in further waves, each with its own deadline
+        deadline = time.monotonic() + options.timeout * math.ceil(options.max_new / settings.scale_up_max_parallel)
+        kubernetes_stats = get_stats(kubernetes_url)
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            wr.tick()
+            scale_up_times.append(time.monotonic() - start)
+            kubernetes_stats = get_stats(kubernetes_url)
+            scaling_up = any(scaler.operations.in_flight("scale_up") for scaler in wr.scalers)
+            if kubernetes_stats["pending"] == 0 and not scaling_up:
+                break
+            wr.wait_next_scan()
+        ready = sorted(ready_at - scale_up_start for ready_at in kubernetes_stats["ready_at"].values()
+                       if ready_at >= scale_up_start)
+        result["scale_up"] = {
+            "nodes_ready": len(ready),
+            "pods_pending": kubernetes_stats["pending"],
+            "time_to_ready_secs": {"first": round(ready[0], 2) if ready else None,
+                                   "p50": round(percentile(ready, 0.5), 2) if ready else None,
+                                   "last": round(ready[-1], 2) if ready else None},
+            "tick_ms_p95": round(percentile(scale_up_times, 0.95) * 1000, 2) if scale_up_times else None,
+            "phase_mean_secs": histogram_means(metrics.scale_up_phase_seconds),
+        }
+
+    # drain of autoscaled node
+    node_group = wr.scalers[0].node_group
+    node_group.update_current_size()
+    if node_group.nodes:
+        node = node_group.nodes[0]
+        pods = len(node_group.drainer.get_pods_to_evict(node))
+        start = time.monotonic()
+        drained = node_group.drain_node(node)
+        result["drain"] = {"pods": pods, "drained": drained, "secs": round(time.monotonic() - start, 3)}
+
+    # bulk scale down of nodes left empty (unneeded time is skipped)
+    scaler = wr.scalers[0]
+    kc.utilization.invalidate()
+    before = len(node_group.nodes)
+    node_group.set_unneeded_node_delay_elapsed(True)
+    if node_group.can_scale_down():
+        start = time.monotonic()
+        removed = scaler.scale_down().future.result()
+        node_group.update_current_size()
+        result["scale_down"] = {"selected": len(node_group.redundant_nodes), "removed": len(removed or []),
+                                "nodes_before": before, "nodes_after": len(node_group.nodes),
+                                "secs": round(time.monotonic() - start, 3)}
+
+    # clean up of lost vms (their grace period is skipped)
+    if options.lost:
+        scaler.garbage_collector.grace_period = 0
+        lost = scaler.garbage_collector.pending()
+        start = time.monotonic()
+        operation = scaler.clean_up()
+        submit_secs = time.monotonic() - start
+        if operation is not None:
+            operation.future.result()
+        result["clean_up"] = {"lost": lost, "removed": lost - scaler.garbage_collector.pending(),
+                              "submit_ms": round(submit_secs * 1000, 2),
+                              "secs": round(time.monotonic() - start, 3)}
+
+    result["calls_total"] = {"kubernetes": get_stats(kubernetes_url)["calls"], "proxmox": get_stats(proxmox_url)["calls"]}
+    result["memory_mb"] = {"max_rss": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if options.tracemalloc:
+        result["memory_mb"]["python_peak"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+
+    for scaler in wr.scalers:
+        for operation in scaler.operations.in_flight():
+            operation.cancelled.set()
+            operation.future.result()
+        scaler.node_group.unneeded_node_delay.cancel()
+        if scaler.scale_down_delay is not None:
+            scaler.scale_down_delay.cancel()
+    return result
+
+
+def save(result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    previous = sorted(glob.glob(os.path.join(RESULTS_DIR, f"{result['scenario']}-2*.json")))
+    path = os.path.join(RESULTS_DIR, f"{result['scenario']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    print(f"Results saved to {path}")
+    if previous:
+        with open(previous[-1]) as f:
+            compare(json.load(f), result, os.path.basename(previous[-1]))
+
+
+def flatten(result, prefix=""):
+    values = {}
+    for key, value in result.items():
+        if key in ("options", "calls_total", "phase_mean_secs"):
+            continue
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(old, new, name):
+    print(f"Compared with {name}:")
+    old_values, new_values = flatten(old), flatten(new)
+    for key, value in new_values.items():
+        if key not in old_values:
+            continue
+        change = f"{(value - old_values[key]) / old_values[key] * 100:+.1f}%" if old_values[key] else ""
+        print(f"  {key:<32} {old_values[key]:>10} -> {value:<10} {change}")
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
+                        level=logging.INFO if options.verbose else logging.CRITICAL)
+    from autoscaler import settings
+    names = {"label": settings.node_group_label,
+             "node": settings.pxe_autoscaled_node_name,
+             "template": settings.pxe_autoscaled_node_template_vm}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert_file, key_file = fake_proxmox.generate_certificate(workdir)
+        connection, child_connection = multiprocessing.Pipe()
+        fakes = multiprocessing.Process(target=run_fakes,
+                                        args=(options, names, cert_file, key_file, child_connection),
+                                        daemon=True)
+        fakes.start()
+        kubernetes_port, proxmox_port = connection.recv()
+        try:
+            configure(options, kubernetes_port, proxmox_port, workdir)
+            result = run(options,
+                         f"http://127.0.0.1:{kubernetes_port}/bench/stats",
+                         f"https://127.0.0.1:{proxmox_port}/bench/stats")
+        finally:
+            connection.send("stop")
+            fakes.join(5)
+
+    print(json.dumps({key: value for key, value in result.items() if key not in ("options", "calls_total")},
+                     indent=2))
+    save(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Microbenchmark of scale up estimator
+
+Usage: python -m benchmarks.estimator_bench [pods count ...]
+"""
+from autoscaler import estimator
+import logging
+import random
+import sys
+import timeit
+
+
+NODE_CPU = 4000
+NODE_MEMORY = 8192
+MAX_NEW_NODES = 5000
+
+
+def generate_requests(count, seed=42):
+    rnd = random.Random(seed)
+    cpus = [50, 100, 250, 500, 1000, 2000]
+    memories = [64, 128, 256, 512, 1024, 2048, 4096]
+    return [(rnd.choice(cpus), rnd.choice(memories)) for _ in range(count)]
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000, 20000]
+    for count in counts:
+        requests = generate_requests(count)
+        repeat = max(1, 20000 // count)
+        seconds = timeit.timeit(lambda: estimator.estimate_nodes_count(requests, NODE_CPU, NODE_MEMORY,
+                                                                        MAX_NEW_NODES),
+                                number=repeat) / repeat
+        nodes = estimator.estimate_nodes_count(requests, NODE_CPU, NODE_MEMORY, MAX_NEW_NODES)
+        print(f"{count:>7} pods -> {nodes:>4} nodes  {seconds * 1000:9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+Fake Kubernetes api server for benchmarks: nodes and pods with list+watch, node patch and delete,
+pod eviction, bootstrap token secrets, kube-public/cluster-info and metrics.k8s.io.
+New nodes are registered when fake Proxmox vm runs kubeadm join and become Ready after ready_delay,
+then pending pods are bound to them. Control endpoints: POST /bench/pending, GET /bench/stats
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import base64
+import bisect
+import json
+import random
+import re
+import threading
+import time
+
+
+NODE_CPU = 4
+NODE_MEMORY_KI = 8 * 1024 * 1024
+NODE_PODS = 110
+# kubelet reserves part of capacity, so allocatable is below it as on real nodes
+NODE_ALLOCATABLE_CPU = "3800m"
+NODE_ALLOCATABLE_MEMORY_KI = NODE_MEMORY_KI - 512 * 1024
+AGENT_CPU, AGENT_MEMORY = 50, 64
+POD_CPUS = (50, 100, 250, 500)
+POD_MEMORIES = (64, 128, 256, 512)
+
+
+def timestamp(seconds=None):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def make_node(name, ip, labels=None, ready=True):
+    return {
+        "metadata": {"name": name, "uid": f"uid-{name}", "labels": dict(labels or {}, **{"kubernetes.io/hostname": name}),
+                     "creationTimestamp": timestamp()},
+        "spec": {},
+        "status": {
+            "capacity": {"cpu": str(NODE_CPU), "memory": f"{NODE_MEMORY_KI}Ki", "pods": str(NODE_PODS)},
+            "allocatable": {"cpu": NODE_ALLOCATABLE_CPU, "memory": f"{NODE_ALLOCATABLE_MEMORY_KI}Ki",
+                            "pods": str(NODE_PODS)},
+            "conditions": [{"type": "Ready", "status": "True" if ready else "False",
+                            "lastTransitionTime": timestamp()}],
+            "addresses": [{"type": "InternalIP", "address": ip}, {"type": "Hostname", "address": name}]
+        }
+    }
+
+
+def make_pod(namespace, name, cpu, memory, node_name=None, owner_kind="ReplicaSet"):
+    pod = {
+        "metadata": {"name": name, "namespace": namespace, "uid": f"uid-{namespace}-{name}",
+                     "creationTimestamp": timestamp(),
+                     "ownerReferences": [{"apiVersion": "apps/v1", "kind": owner_kind, "name": f"{name}-owner",
+                                          "uid": f"uid-{name}-owner", "controller": True}]},
+        "spec": {"containers": [{"name": "app", "image": "bench",
+                                 "resources": {"requests": {"cpu": f"{cpu}m", "memory": f"{memory}Mi"}}}]},
+        "status": {}
+    }
+    if node_name:
+        bind_pod(pod, node_name)
+    else:
+        pod["status"] = {
+            "phase": "Pending",
+            "conditions": [{"type": "PodScheduled", "status": "False", "reason": "Unschedulable",
+                            "message": "0/1 nodes are available: 1 Insufficient cpu, 1 Insufficient memory.",
+                            "lastTransitionTime": timestamp()}]
+        }
+    return pod
+
+
+def bind_pod(pod, node_name):
+    pod["spec"]["nodeName"] = node_name
+    pod["status"] = {"phase": "Running",
+                     "conditions": [{"type": "PodScheduled", "status": "True", "lastTransitionTime": timestamp()}]}
+
+
+def pod_requests(pod):
+    requests = pod["spec"]["containers"][0]["resources"]["requests"]
+    return int(requests["cpu"][:-1]), int(requests["memory"][:-2])
+
+
+def merge(target, patch):
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        elif value is None:
+            target.pop(key, None)
+        else:
+            target[key] = value
+
+
+class FakeKubernetes:
+    def __init__(self, nodes=500, pods=50000, group_nodes=10, group_label="pxe-autoscaler/autoscaler-managed-node",
+                 group_prefix="autoscaler.node", group_ip_prefix="10.200", latency=0.0, ready_delay=1.0,
+                 usage=0.6, ca_cert=b"", seed=42, eviction_refusals=0, termination_delay=0.0):
+        self.latency = latency
+        self.eviction_refusals = eviction_refusals  # 429 responses to evictions of every pod (disruption budget)
+        self.termination_delay = termination_delay  # delay between eviction and deletion of pod
+        self.refused = {}
+        self.ready_delay = ready_delay
+        self.usage = usage
+        self.ca_cert = ca_cert
+        self.random = random.Random(seed)
+        self.lock = threading.Condition()
+        self.resource_version = 1
+        self.objects = {"nodes": {}, "pods": {}}
+        self.events = {"nodes": [], "pods": []}  # watch event json lines
+        self.event_versions = {"nodes": [], "pods": []}  # resourceVersion of every event
+        self.secrets = {}
+        self.calls = {}
+        self.ready_at = {}
+        self.pending_count = 0
+        self.pending = set()  # keys of not scheduled pods
+
+        for i in range(nodes):
+            if i < group_nodes:
+                name = f"{group_prefix}-{i + 1}"
+                node = make_node(name, f"{group_ip_prefix}.{i // 250}.{i % 250 + 1}", {group_label: "true"})
+            else:
+                name = f"worker-{i + 1}"
+                node = make_node(name, f"10.100.{i // 250}.{i % 250 + 1}")
+            self.__store("nodes", name, node)
+        node_names = sorted(self.objects["nodes"])
+        for name in node_names:
+            self.__store_agent(name)
+        for i in range(max(pods - len(node_names), 0)):
+            node_name = node_names[i % len(node_names)] if node_names else None
+            namespace = f"ns-{i % 50}"
+            self.__store("pods", f"{namespace}/pod-{i}",
+                         make_pod(namespace, f"pod-{i}", self.random.choice(POD_CPUS),
+                                  self.random.choice(POD_MEMORIES), node_name))
+
+    # state
+
+    def __store(self, kind, key, obj, event_type=None):
+        self.resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self.resource_version)
+        if event_type == "DELETED":
+            self.objects[kind].pop(key, None)
+        else:
+            self.objects[kind][key] = obj
+        if event_type is not None:
+            self.events[kind].append(json.dumps({"type": event_type, "object": obj}))
+            self.event_versions[kind].append(self.resource_version)
+            self.lock.notify_all()
+
+    def __store_agent(self, node_name, event_type=None):
+        self.__store("pods", f"kube-system/agent-{node_name}",
+                     make_pod("kube-system", f"agent-{node_name}", AGENT_CPU, AGENT_MEMORY, node_name,
+                              owner_kind="DaemonSet"), event_type)
+
+    def add_pending_pods(self, count, cpu=1000, memory=1024):
+        with self.lock:
+            for _ in range(count):
+                self.pending_count += 1
+                name = f"pending-{self.pending_count}"
+                self.pending.add(f"bench/{name}")
+                self.__store("pods", f"bench/{name}", make_pod("bench", name, cpu, memory), "ADDED")
+
+    def register_node(self, name, ip):
+        """
+        Called by fake Proxmox when vm has run kubeadm join
+        """
+        with self.lock:
+            if name in self.objects["nodes"]:
+                return
+            self.__store("nodes", name, make_node(name, ip, ready=False), "ADDED")
+            self.__store_agent(name, "ADDED")
+        timer = threading.Timer(self.ready_delay, self.__set_ready, args=[name])
+        timer.daemon = True
+        timer.start()
+
+    def __set_ready(self, name):
+        with self.lock:
+            node = self.objects["nodes"].get(name)
+            if node is None:
+                return
+            node["status"]["conditions"][0]["status"] = "True"
+            self.__store("nodes", name, node, "MODIFIED")
+            self.ready_at[name] = time.time()
+            self.__schedule(name)
+
+    def __schedule(self, node_name):
+        cpu_free = int(NODE_ALLOCATABLE_CPU.rstrip("m")) - AGENT_CPU
+        memory_free = NODE_ALLOCATABLE_MEMORY_KI // 1024 - AGENT_MEMORY
+        for key in sorted(self.pending):
+            pod = self.objects["pods"].get(key)
+            if pod is None:
+                self.pending.discard(key)
+                continue
+            cpu, memory = pod_requests(pod)
+            if cpu > cpu_free or memory > memory_free:
+                continue
+            cpu_free -= cpu
+            memory_free -= memory
+            bind_pod(pod, node_name)
+            self.pending.discard(key)
+            self.__store("pods", key, pod, "MODIFIED")
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "ready_at": dict(self.ready_at), "pending": len(self.pending),
+                    "nodes": len(self.objects["nodes"]), "pods": len(self.objects["pods"])}
+
+    # requests
+
+    def handle(self, handler, method):
+        url = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = None
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length:
+            body = json.loads(handler.rfile.read(length))
+        for route_method, pattern, func in self.routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                if not url.path.startswith("/bench/"):
+                    endpoint = f"{method} {endpoint_name(pattern)}"
+                    with self.lock:
+                        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+                    if self.latency:
+                        time.sleep(self.latency)
+                return func(self, handler, query, body, *match.groups())
+        return send_json(handler, status(404, f"{method} {url.path} not found"), 404)
+
+    def list_or_watch(self, kind, list_kind, handler, query):
+        if query.get("watch", "").lower() == "true":
+            return self.watch(kind, handler, query)
+        # pages continue from offset (apiserver uses opaque token bound to resourceVersion)
+        offset, limit = int(query.get("continue") or 0), int(query.get("limit") or 0)
+        with self.lock:
+            keys = sorted(self.objects[kind])
+            page = keys[offset:offset + limit] if limit else keys[offset:]
+            metadata = {"resourceVersion": str(self.resource_version)}
+            if limit and offset + limit < len(keys):
+                metadata["continue"] = str(offset + limit)
+            body = json.dumps({"kind": list_kind, "apiVersion": "v1", "metadata": metadata,
+                               "items": [self.objects[kind][key] for key in page]})
+        send_body(handler, body.encode())
+
+    def watch(self, kind, handler, query):
+        since = int(query.get("resourceVersion") or 0)
+        deadline = time.monotonic() + int(query.get("timeoutSeconds") or 60)
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        try:
+            while True:
+                with self.lock:
+                    versions = self.event_versions[kind]
+                    lines = self.events[kind][bisect.bisect_right(versions, since):]
+                    if versions:
+                        since = max(since, versions[-1])
+                    if not lines:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            handler.wfile.write(b"0\r\n\r\n")
+                            return
+                        self.lock.wait(min(remaining, 1))
+                        continue
+                chunk = "".join(line + "\n" for line in lines).encode()
+                handler.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def list_nodes(self, handler, query, body):
+        return self.list_or_watch("nodes", "NodeList", handler, query)
+
+    def list_pods(self, handler, query, body):
+        return self.list_or_watch("pods", "PodList", handler, query)
+
+    def read_node(self, handler, query, body, name):
+        with self.lock:
+            node = self.objects["nodes"].get(name)
+            if node is None:
+                return send_json(handler, status(404, f"node {name} not found"), 404)
+            return send_json(handler, node)
+
+    def patch_node(self, handler, query, body, name):
+        with self.lock:
+            node = self.objects["nodes"].get(name)
+            if node is None:
+                return send_json(handler, status(404, f"node {name} not found"), 404)
+            merge(node, body or {})
+            self.__store("nodes", name, node, "MODIFIED")
+            return send_json(handler, node)
+
+    def delete_node(self, handler, query, body, name):
+        with self.lock:
+            node = self.objects["nodes"].get(name)
+            if node is None:
+                return send_json(handler, status(404, f"node {name} not found"), 404)
+            self.__store("nodes", name, node, "DELETED")
+            # pod garbage collector deletes pods bound to deleted node (DaemonSet agent, not evicted pods)
+            for key, pod in list(self.objects["pods"].items()):
+                if pod["spec"].get("nodeName") == name:
+                    self.__store("pods", key, pod, "DELETED")
+        return send_json(handler, status(200, "deleted"))
+
+    def evict_pod(self, handler, query, body, namespace, name):
+        key = f"{namespace}/{name}"
+        with self.lock:
+            pod = self.objects["pods"].get(key)
+            if pod is None:
+                return send_json(handler, status(404, f"pod {key} not found"), 404)
+            if self.refused.get(key, 0) < self.eviction_refusals:
+                self.refused[key] = self.refused.get(key, 0) + 1
+                return send_json(handler, status(429, "Cannot evict pod as it would violate the pod's disruption budget."),
+                                 429)
+            if self.termination_delay > 0:
+                pod["metadata"]["deletionTimestamp"] = timestamp()
+                self.__store("pods", key, pod, "MODIFIED")
+                timer = threading.Timer(self.termination_delay, self.__delete_pod, args=[key])
+                timer.daemon = True
+                timer.start()
+            else:
+                self.__store("pods", key, pod, "DELETED")
+        return send_json(handler, {"kind": "Eviction", "apiVersion": "policy/v1",
+                                   "metadata": {"name": name, "namespace": namespace}}, 201)
+
+    def __delete_pod(self, key):
+        with self.lock:
+            pod = self.objects["pods"].get(key)
+            if pod is not None:
+                self.__store("pods", key, pod, "DELETED")
+
+    def read_cluster_info(self, handler, query, body):
+        kubeconfig = json.dumps({"apiVersion": "v1", "kind": "Config",
+                                 "clusters": [{"name": "", "cluster": {
+                                     "server": "https://10.0.0.1:6443",
+                                     "certificate-authority-data": base64.b64encode(self.ca_cert).decode()}}]})
+        return send_json(handler, {"kind": "ConfigMap", "apiVersion": "v1",
+                                   "metadata": {"name": "cluster-info", "namespace": "kube-public"},
+                                   "data": {"kubeconfig": kubeconfig}})
+
+    def list_secrets(self, handler, query, body, namespace):
+        with self.lock:
+            items = [secret for secret in self.secrets.values() if secret["metadata"]["namespace"] == namespace]
+        return send_json(handler, {"kind": "SecretList", "apiVersion": "v1", "metadata": {}, "items": items})
+
+    def create_secret(self, handler, query, body, namespace):
+        data = {key: base64.b64encode(value.encode()).decode() for key, value in body.pop("stringData", {}).items()}
+        body["data"] = dict(body.get("data") or {}, **data)
+        body["metadata"]["namespace"] = namespace
+        with self.lock:
+            self.secrets[(namespace, body["metadata"]["name"])] = body
+        return send_json(handler, body, 201)
+
+    def node_metrics(self, handler, query, body):
+        with self.lock:
+            requests = {name: [0, 0] for name in self.objects["nodes"]}
+            for pod in self.objects["pods"].values():
+                node_name = pod["spec"].get("nodeName")
+                if node_name:
+                    cpu, memory = pod_requests(pod)
+                    used = requests.setdefault(node_name, [0, 0])
+                    used[0] += cpu
+                    used[1] += memory
+            items = [{"metadata": {"name": name}, "timestamp": timestamp(), "window": "30s",
+                      "usage": {"cpu": f"{int(cpu * self.usage * 1000000)}n",
+                                "memory": f"{int(memory * self.usage * 1024)}Ki"}}
+                     for name, (cpu, memory) in requests.items()]
+        return send_json(handler, {"kind": "NodeMetricsList", "apiVersion": "metrics.k8s.io/v1beta1",
+                                   "metadata": {}, "items": items})
+
+    def pod_metrics(self, handler, query, body):
+        with self.lock:
+            items = []
+            for pod in self.objects["pods"].values():
+                if not pod["spec"].get("nodeName"):
+                    continue
+                cpu, memory = pod_requests(pod)
+                items.append({"metadata": {"name": pod["metadata"]["name"], "namespace": pod["metadata"]["namespace"]},
+                              "timestamp": timestamp(), "window": "30s",
+                              "containers": [{"name": "app",
+                                              "usage": {"cpu": f"{int(cpu * self.usage * 1000000)}n",
+                                                        "memory": f"{int(memory * self.usage * 1024)}Ki"}}]})
+        return send_json(handler, {"kind": "PodMetricsList", "apiVersion": "metrics.k8s.io/v1beta1",
+                                   "metadata": {}, "items": items})
+
+    def bench_pending(self, handler, query, body):
+        self.add_pending_pods(int(query.get("count", 1)), int(query.get("cpu", 1000)), int(query.get("memory", 1024)))
+        return send_json(handler, {"pending": self.pending_count})
+
+    def bench_stats(self, handler, query, body):
+        return send_json(handler, self.stats())
+
+    routes = [
+        ("GET", re.compile(r"/api/v1/nodes$"), list_nodes),
+        ("GET", re.compile(r"/api/v1/pods$"), list_pods),
+        ("GET", re.compile(r"/api/v1/nodes/([^/]+)$"), read_node),
+        ("PATCH", re.compile(r"/api/v1/nodes/([^/]+)$"), patch_node),
+        ("DELETE", re.compile(r"/api/v1/nodes/([^/]+)$"), delete_node),
+        ("POST", re.compile(r"/api/v1/namespaces/([^/]+)/pods/([^/]+)/eviction$"), evict_pod),
+        ("GET", re.compile(r"/api/v1/namespaces/kube-public/configmaps/cluster-info$"), read_cluster_info),
+        ("GET", re.compile(r"/api/v1/namespaces/([^/]+)/secrets$"), list_secrets),
+        ("POST", re.compile(r"/api/v1/namespaces/([^/]+)/secrets$"), create_secret),
+        ("GET", re.compile(r"/apis/metrics.k8s.io/v1beta1/nodes$"), node_metrics),
+        ("GET", re.compile(r"/apis/metrics.k8s.io/v1beta1/pods$"), pod_metrics),
+        ("POST", re.compile(r"/bench/pending$"), bench_pending),
+        ("GET", re.compile(r"/bench/stats$"), bench_stats),
+    ]
+
+
+def status(code, message):
+    return {"kind": "Status", "apiVersion": "v1", "metadata": {},
+            "status": "Success" if code < 400 else "Failure", "message": message, "code": code}
+
+
+def send_body(handler, body, code=200):
+    handler.send_response(code)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def endpoint_name(pattern):
+    return re.sub(r"\(\[[^\]]*\]\+\)", "{}", pattern.pattern).rstrip("$")
+
+
+def send_json(handler, obj, code=200):
+    send_body(handler, json.dumps(obj).encode(), code)
+
+
+def serve(fake, port=0, address="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            fake.handle(self, "GET")
+
+        def do_POST(self):
+            fake.handle(self, "POST")
+
+        def do_PATCH(self):
+            fake.handle(self, "PATCH")
+
+        def do_DELETE(self):
+            fake.handle(self, "DELETE")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-kubernetes", daemon=True).start()
+    return server
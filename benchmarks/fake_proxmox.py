@@ -0,0 +1,364 @@
+"""
+Fake Proxmox VE api server (HTTPS with self-signed certificate) for benchmarks: cluster resources,
+nextid, clone, migrate, config, start, shutdown, delete, tasks and qemu agent exec. Tasks and vm state changes
+take configured time. Like Proxmox, clone to other host is refused unless storage is shared, and linked
+clone on local storage cannot be migrated. kubeadm join run by agent registers node in fake Kubernetes.
+Control endpoint: GET /bench/stats
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import itertools
+import json
+import os
+import re
+import ssl
+import subprocess
+import threading
+import time
+
+
+HOST_MEMORY = 256 * 1024 ** 3
+HOST_CPU = 64
+VM_MEMORY = 8 * 1024 ** 3
+VM_CPU = 4
+TEMPLATE_VMID = 9000
+
+
+def generate_certificate(directory):
+    """
+    Create self-signed certificate and key by openssl, return their paths
+    """
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-keyout", key_file, "-out", cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+
+class FakeProxmox:
+    def __init__(self, hosts=10, group_nodes=10, group_prefix="autoscaler.node", group_ip_prefix="10.200",
+                 template_name="autoscaler.tmpl", latency=0.0, clone_time=1.0, boot_time=1.0,
+                 join_time=1.0, shutdown_time=0.5, delete_time=0.5, migrate_time=0.5, shared_storage=False,
+                 lost_vms=0, kubernetes=None):
+        self.latency = latency
+        self.clone_time = clone_time
+        self.boot_time = boot_time
+        self.join_time = join_time
+        self.shutdown_time = shutdown_time
+        self.delete_time = delete_time
+        self.migrate_time = migrate_time
+        self.storage = "ceph" if shared_storage else "local-lvm"
+        self.shared_storage = shared_storage
+        self.kubernetes = kubernetes
+        self.lock = threading.RLock()
+        self.hosts = [f"pve{i + 1}" for i in range(hosts)]
+        self.vms = {}
+        self.tasks = {}  # upid -> (finish time, callback)
+        self.execs = {}  # pid -> (finish time, result)
+        self.pids = itertools.count(1000)
+        self.upids = itertools.count(1)
+        self.calls = {}
+
+        self.__add_vm(TEMPLATE_VMID, template_name, self.hosts[0], "stopped", template=1)
+        for i in range(group_nodes):
+            vm = self.__add_vm(100 + i, f"{group_prefix}-{i + 1}", self.hosts[i % hosts], "running")
+            vm["ip"] = f"{group_ip_prefix}.{i // 250}.{i % 250 + 1}"
+            vm["booted_at"] = 0
+        # running vms of node group which never joined kubernetes (e.g. left by failed scale up)
+        for i in range(lost_vms):
+            vm = self.__add_vm(5000 + i, f"{group_prefix}-{1000 + i}", self.hosts[i % hosts], "running")
+            vm["ip"] = f"{group_ip_prefix}.255.{i % 250 + 1}"
+            vm["booted_at"] = 0
+
+    # state
+
+    def __add_vm(self, vmid, name, host, status, template=0):
+        vm = {"vmid": vmid, "name": name, "node": host, "status": status, "template": template,
+              "maxmem": VM_MEMORY, "maxcpu": VM_CPU, "ip": None, "booted_at": None, "lock": None, "linked": False}
+        self.vms[vmid] = vm
+        return vm
+
+    def __advance(self):
+        now = time.monotonic()
+        for upid, (finish, callback) in list(self.tasks.items()):
+            if finish is not None and finish <= now:
+                callback()
+                self.tasks[upid] = (None, None)
+
+    def __task(self, host, kind, vmid, duration, callback):
+        upid = f"UPID:{host}:{next(self.upids):08X}:00000000:{int(time.time()):08X}:{kind}:{vmid}:root@pam:"
+        self.tasks[upid] = (time.monotonic() + duration, callback)
+        return upid
+
+    def __vm(self, vmid):
+        vm = self.vms.get(int(vmid))
+        if vm is None:
+            raise FakeError(500, f"Configuration file 'qemu-server/{vmid}.conf' does not exist")
+        return vm
+
+    def resources(self):
+        resources = []
+        for host in self.hosts:
+            running = [vm for vm in self.vms.values() if vm["node"] == host and vm["status"] == "running"]
+            resources.append({"type": "node", "id": f"node/{host}", "node": host, "status": "online",
+                              "maxmem": HOST_MEMORY, "mem": len(running) * VM_MEMORY // 2,
+                              "maxcpu": HOST_CPU, "cpu": min(len(running) * VM_CPU / HOST_CPU / 2, 1)})
+            resources.append({"type": "storage", "id": f"storage/{host}/{self.storage}", "node": host,
+                              "storage": self.storage, "shared": int(self.shared_storage),
+                              "content": "images,rootdir", "status": "available",
+                              "maxdisk": 4 * 1024 ** 4, "disk": len(self.vms) * 32 * 1024 ** 3 // len(self.hosts)})
+        for vm in self.vms.values():
+            resource = {"type": "qemu", "id": f"qemu/{vm['vmid']}", "vmid": vm["vmid"], "name": vm["name"],
+                        "node": vm["node"], "status": vm["status"], "template": vm["template"],
+                        "maxmem": vm["maxmem"], "maxcpu": vm["maxcpu"]}
+            if vm["lock"]:
+                resource["lock"] = vm["lock"]
+            resources.append(resource)
+        return resources
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "vms": len(self.vms)}
+
+    # requests
+
+    @staticmethod
+    def __params(query):
+        # agent exec passes command argv as repeated parameters
+        return {key: " ".join(values) if key == "command" else values[-1]
+                for key, values in parse_qs(query).items()}
+
+    def handle(self, handler, method):
+        url = urlparse(handler.path)
+        params = self.__params(url.query)
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length:
+            params.update(self.__params(handler.rfile.read(length).decode()))
+        path = url.path
+        if path.startswith("/api2/json"):
+            path = path[len("/api2/json"):]
+        for route_method, pattern, func in self.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                if not path.startswith("/bench/"):
+                    endpoint = f"{method} {endpoint_name(pattern)}"
+                    with self.lock:
+                        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+                    if self.latency:
+                        time.sleep(self.latency)
+                try:
+                    with self.lock:
+                        self.__advance()
+                        data = func(self, params, *match.groups())
+                except FakeError as ex:
+                    return send_json(handler, {"data": None, "errors": ex.message}, ex.code, ex.message)
+                return send_json(handler, {"data": data})
+        return send_json(handler, {"data": None}, 501, "Method not implemented")
+
+    def ticket(self, params):
+        return {"ticket": "PVE:bench:TICKET", "CSRFPreventionToken": "bench:TOKEN", "username": params.get("username")}
+
+    def cluster_resources(self, params):
+        return self.resources()
+
+    def nextid(self, params):
+        vmid = 100
+        while vmid in self.vms:
+            vmid += 1
+        return str(vmid)
+
+    def nodes(self, params):
+        return [{"node": host, "status": "online"} for host in self.hosts]
+
+    def clone(self, params, host, vmid):
+        template = self.__vm(vmid)
+        newid = int(params["newid"])
+        if newid in self.vms:
+            raise FakeError(500, f"unable to create VM {newid}: config file already exists")
+        if params.get("target", host) != host and not self.shared_storage:
+            raise FakeError(500, f"can't clone to non-shared storage '{self.storage}'")
+        vm = self.__add_vm(newid, params.get("name", f"Copy-of-VM-{template['name']}"),
+                           params.get("target", host), "stopped")
+        vm["lock"] = "clone"
+        vm["linked"] = params.get("full") != "1"
+
+        def done():
+            vm["lock"] = None
+        return self.__task(host, "qmclone", vmid, self.clone_time, done)
+
+    def migrate(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        if vm["status"] == "running":
+            raise FakeError(500, "can't migrate running VM without --online")
+        if vm["linked"] and not self.shared_storage:
+            raise FakeError(500, f"can't migrate local disk '{self.storage}:base-{TEMPLATE_VMID}-disk-0/"
+                                 f"vm-{vm['vmid']}-disk-0': linked clone")
+        vm["lock"] = "migrate"
+
+        def done():
+            vm["node"] = params["target"]
+            vm["lock"] = None
+        return self.__task(host, "qmigrate", vmid, self.migrate_time, done)
+
+    def task_status(self, params, host, upid):
+        if upid not in self.tasks:
+            raise FakeError(500, f"no such task {upid}")
+        finish, _ = self.tasks[upid]
+        if finish is None:
+            return {"upid": upid, "status": "stopped", "exitstatus": "OK"}
+        return {"upid": upid, "status": "running"}
+
+    def config(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        if "name" in params:
+            vm["name"] = params["name"]
+        match = re.match(r"ip=([0-9.]+)", params.get("ipconfig0", ""))
+        if match:
+            vm["ip"] = match.group(1)
+        return None
+
+    def read_config(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        config = {"name": vm["name"], "memory": vm["maxmem"] // 1024 // 1024, "cores": vm["maxcpu"],
+                  "scsi0": f"{self.storage}:{'base' if vm['template'] else 'vm'}-{vm['vmid']}-disk-0,size=32G",
+                  "ide2": f"{self.storage}:vm-{vm['vmid']}-cloudinit,media=cdrom"}
+        if vm["ip"]:
+            config["ipconfig0"] = f"ip={vm['ip']}/24"
+        if vm["lock"]:
+            config["lock"] = vm["lock"]
+        return config
+
+    def start(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        vm["status"] = "running"
+        vm["booted_at"] = time.monotonic() + self.boot_time
+        return self.__task(host, "qmstart", vmid, 0, lambda: None)
+
+    def current(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        return {"vmid": vm["vmid"], "name": vm["name"], "status": vm["status"], "qmpstatus": vm["status"]}
+
+    def shutdown(self, params, host, vmid):
+        vm = self.__vm(vmid)
+
+        def done():
+            vm["status"] = "stopped"
+            vm["booted_at"] = None
+        return self.__task(host, "qmshutdown", vmid, self.shutdown_time, done)
+
+    def stop(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        vm["status"] = "stopped"
+        vm["booted_at"] = None
+        return self.__task(host, "qmstop", vmid, 0, lambda: None)
+
+    def delete(self, params, host, vmid):
+        vm = self.__vm(vmid)
+        if vm["status"] == "running":
+            raise FakeError(500, f"VM {vmid} is running - destroy failed")
+        return self.__task(host, "qmdestroy", vmid, self.delete_time, lambda: self.vms.pop(vm["vmid"], None))
+
+    def __agent(self, vmid):
+        vm = self.__vm(vmid)
+        if vm["status"] != "running" or vm["booted_at"] is None or vm["booted_at"] > time.monotonic():
+            raise FakeError(500, "QEMU guest agent is not running")
+        return vm
+
+    def agent_exec(self, params, host, vmid):
+        vm = self.__agent(vmid)
+        command = params.get("command", "")
+        pid = next(self.pids)
+        now = time.monotonic()
+        if "kubeadm join" in command:
+            self.execs[pid] = (now + self.join_time, {"exitcode": 0, "out-data": "This node has joined the cluster\n"})
+            if self.kubernetes is not None:
+                timer = threading.Timer(self.join_time, self.kubernetes.register_node, args=[vm["name"], vm["ip"]])
+                timer.daemon = True
+                timer.start()
+        elif "is-system-running" in command:
+            self.execs[pid] = (now, {"exitcode": 0, "out-data": "running\n"})
+        else:
+            self.execs[pid] = (now, {"exitcode": 0, "out-data": ""})
+        return {"pid": pid}
+
+    def agent_exec_status(self, params, host, vmid):
+        self.__agent(vmid)
+        finish, result = self.execs[int(params["pid"])]
+        if finish > time.monotonic():
+            return {"exited": 0}
+        return dict(result, exited=1)
+
+    def agent_network(self, params, host, vmid):
+        vm = self.__agent(vmid)
+        addresses = [{"ip-address-type": "ipv4", "ip-address": "127.0.0.1", "prefix": 8}]
+        if vm["ip"]:
+            addresses.append({"ip-address-type": "ipv4", "ip-address": vm["ip"], "prefix": 24})
+        return {"result": [{"name": "eth0", "ip-addresses": addresses}]}
+
+    routes = [
+        ("POST", re.compile(r"/access/ticket$"), ticket),
+        ("GET", re.compile(r"/cluster/resources$"), cluster_resources),
+        ("GET", re.compile(r"/cluster/nextid$"), nextid),
+        ("GET", re.compile(r"/nodes$"), nodes),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/clone$"), clone),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/migrate$"), migrate),
+        ("GET", re.compile(r"/nodes/([^/]+)/tasks/([^/]+)/status$"), task_status),
+        ("GET", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/config$"), read_config),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/config$"), config),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/status/start$"), start),
+        ("GET", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/status/current$"), current),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/status/shutdown$"), shutdown),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/status/stop$"), stop),
+        ("DELETE", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)$"), delete),
+        ("POST", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/agent/exec$"), agent_exec),
+        ("GET", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/agent/exec-status$"), agent_exec_status),
+        ("GET", re.compile(r"/nodes/([^/]+)/qemu/([0-9]+)/agent/network-get-interfaces$"), agent_network),
+        ("GET", re.compile(r"/bench/stats$"), lambda self, params: self.stats()),
+    ]
+
+
+class FakeError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def endpoint_name(pattern):
+    return re.sub(r"\(\[[^\]]*\]\+\)", "{}", pattern.pattern).rstrip("$")
+
+
+def send_json(handler, obj, code=200, reason=None):
+    body = json.dumps(obj).encode()
+    handler.send_response(code, reason)
+    handler.send_header("Content-Type", "application/json;charset=UTF-8")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def serve(fake, cert_file, key_file, port=0, address="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            fake.handle(self, "GET")
+
+        def do_POST(self):
+            fake.handle(self, "POST")
+
+        def do_PUT(self):
+            fake.handle(self, "PUT")
+
+        def do_DELETE(self):
+            fake.handle(self, "DELETE")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, name="fake-proxmox", daemon=True).start()
+    return server
@@ -1,6 +1,7 @@
 import logging
 from kubernetes import config
 from autoscaler.settings import *
+from autoscaler import metrics
 from autoscaler import watcher
 
 
@@ -23,6 +24,8 @@ def logging_setup():
 def main():
     logging_setup()
     kubernetes_setup()
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
 
     wr = watcher.Watcher(scan_interval)
     wr.run()